@@ -6,12 +6,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from typing import List
 import logging
+import numpy as np
 
 from app.core.database import get_db
+from app.core.workers import run_in_process
 from app.models.schemas import OptimizationParams, OptimizationResult, Coordinate
 from app.services.clustering_service import cluster_employees
 from app.services.osrm_service import osrm_service
-from app.services.optimization_service import create_optimized_routes
+from app.services.optimization_service import max_effective_capacity
+from app.services.decomposition_solver import solve_routes
 
 logger = logging.getLogger(__name__)
 
@@ -55,10 +58,12 @@ async def run_optimization(
     logger.info(f"Found {len(employees)} employees")
     
     # Step 2: Cluster employees into stops
-    clustering_result = cluster_employees(
+    clustering_result = await run_in_process(
+        cluster_employees,
         employee_data=employees,
         max_walking_distance=params.max_walking_distance,
-        method="dbscan"
+        method="dbscan",
+        max_stop_capacity=max_effective_capacity(params.use_16_seaters, params.use_27_seaters)
     )
     
     stops = clustering_result["stops"]
@@ -112,18 +117,23 @@ async def run_optimization(
     
     # Step 4: Solve CVRP
     logger.info("Solving CVRP...")
-    optimization_result = create_optimized_routes(
+    optimization_result = await solve_routes(
         stops=stops,
         depot_location=depot,
-        distance_matrix=matrix_result["distances"],
+        distance_matrix=np.asarray(matrix_result["distances"], dtype=np.float64),
         num_16_seaters=params.use_16_seaters,
         num_27_seaters=params.use_27_seaters,
         time_limit_seconds=params.time_limit_seconds,
-        vehicle_priority=params.vehicle_priority or "auto"
+        vehicle_priority=params.vehicle_priority or "auto",
+        # Strict fleet: no optional vehicles, whichever solver mode runs
+        optional_16_seaters=0,
+        optional_27_seaters=0,
+        solver_mode=params.solver_mode
     )
     
     # Step 5: Get route geometries from OSRM
     routes_with_geometry = []
+    all_route_coords = []
     for route in optimization_result["routes"]:
         # Start from depot, go through stops, return to depot
         route_coords = [depot]  # Start from depot
@@ -132,9 +142,13 @@ async def run_optimization(
             for stop in route["stops"]
         ])
         route_coords.append(depot)  # Return to depot
-        
+        all_route_coords.append(route_coords)
+    
+    # Fetch all geometries concurrently (bounded fan-out), results in route order
+    route_geometries = await osrm_service.get_multiple_routes(all_route_coords)
+    
+    for route, route_coords, route_geometry in zip(optimization_result["routes"], all_route_coords, route_geometries):
         if len(route_coords) >= 2:
-            route_geometry = await osrm_service.get_route(route_coords)
             osrm_polyline = route_geometry.get("geometry", [])
             
             # Manually add depot at start and end of polyline
@@ -197,6 +211,12 @@ async def run_optimization(
             "max_walking_distance": params.max_walking_distance
         },
         "osrm_available": not matrix_result.get("fallback", False),
+        "solver": {
+            "status": optimization_result["status"],
+            "objective": optimization_result.get("objective"),
+            "convergence": optimization_result.get("convergence"),
+            "decomposition": optimization_result.get("decomposition")
+        },
         "created_at": saved.created_at.isoformat()
     }
     
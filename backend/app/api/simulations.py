@@ -4,18 +4,28 @@ Simulations API Router - Manage simulation history with routes
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Literal, Tuple
 from pydantic import BaseModel, Field
 from datetime import datetime
+import asyncio
 import logging
 import json
+import numpy as np
 from geopy.distance import geodesic
 
 from app.core.database import get_db
-from app.models.schemas import OptimizationParams, Coordinate, TrafficMode, RouteType, TRAFFIC_SCALING_FACTORS
+from app.core.workers import run_in_process
+from app.models.schemas import OptimizationParams, Coordinate, TrafficMode, RouteType, SolverMode, TRAFFIC_SCALING_FACTORS
 from app.services.clustering_service import cluster_employees
+from app.services.incremental_clustering import cluster_employees_incremental
+from app.services.walking_clustering import cluster_employees_walking
+from app.services.clustering_sweep import sweep_walking_distances, OPTICS_MAX_EPS
+from app.services.clustering_cache import (
+    clustering_fingerprint, ensure_clustering_cache_table, get_cached_stops, store_cached_stops
+)
 from app.services.osrm_service import osrm_service
-from app.services.optimization_service import create_optimized_routes
+from app.services.optimization_service import max_effective_capacity, optional_vehicle_pool
+from app.services.decomposition_solver import solve_routes
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +48,18 @@ class SimulationCreate(BaseModel):
     shift_id: Optional[int] = Field(default=None, description="Shift ID to filter employees. None means all employees")
     route_type: RouteType = Field(default=RouteType.RING, description="Route type: ring (round trip), to_home (iş çıkışı), to_depot (iş başı)")
     employee_ids: Optional[List[int]] = Field(default=None, description="Specific employee IDs to include. Overrides shift_id filter.")
+    clustering_method: Literal["dbscan", "walking"] = Field(default="dbscan", description="Stop clustering: 'dbscan' (straight-line) or 'walking' (foot network distances)")
+    solver_mode: Optional[SolverMode] = Field(default=None, description="CVRP solver: 'portfolio', 'decomposition' (large instances) or 'auto'. None uses the server setting")
+
+
+class ClusteringSweepRequest(BaseModel):
+    """Schema for previewing stop counts over several walking distances"""
+    walking_distances: List[int] = Field(..., min_length=1, max_length=100, description="Walking distances in meters (50-2000)")
+    shift_id: Optional[int] = Field(default=None, description="Shift ID to filter employees. None means all employees")
+    employee_ids: Optional[List[int]] = Field(default=None, description="Specific employee IDs to include. Overrides shift_id filter.")
+    use_16_seaters: int = Field(default=5, ge=0, le=50)
+    use_27_seaters: int = Field(default=5, ge=0, le=50)
+    buffer_seats: int = Field(default=0, ge=0, le=5, description="Buffer seats to leave empty per vehicle")
 
 
 class SimulationSummary(BaseModel):
@@ -165,6 +187,161 @@ async def ensure_simulation_tables(db: AsyncSession):
     await db.commit()
 
 
+async def _fetch_employees(
+    db: AsyncSession,
+    employee_ids: Optional[List[int]],
+    shift_id: Optional[int]
+) -> List[dict]:
+    """Fetch employees with home locations (filtered by employee_ids, shift_id, or all)"""
+    if employee_ids is not None and len(employee_ids) > 0:
+        query = text("""
+            SELECT id, name, 
+                   ST_Y(home_location) as lat, 
+                   ST_X(home_location) as lng
+            FROM employees
+            WHERE id = ANY(:ids)
+        """)
+        result = await db.execute(query, {"ids": employee_ids})
+    elif shift_id is not None:
+        query = text("""
+            SELECT id, name, 
+                   ST_Y(home_location) as lat, 
+                   ST_X(home_location) as lng
+            FROM employees
+            WHERE shift_id = :shift_id
+        """)
+        result = await db.execute(query, {"shift_id": shift_id})
+    else:
+        query = text("""
+            SELECT id, name, 
+                   ST_Y(home_location) as lat, 
+                   ST_X(home_location) as lng
+            FROM employees
+        """)
+        result = await db.execute(query)
+    
+    employees = [
+        {"id": row.id, "name": row.name, "lat": row.lat, "lng": row.lng}
+        for row in result.fetchall()
+    ]
+    
+    return employees
+
+
+def _route_coordinates(
+    stop_coords: List[tuple],
+    depot: tuple,
+    route_type: RouteType
+) -> List[tuple]:
+    """Coordinates to route through for a stop sequence, by route_type."""
+    if route_type == RouteType.RING:
+        # Ring: Depot → Stops → Depot (tam tur)
+        return [depot] + stop_coords + [depot]
+    elif route_type == RouteType.TO_HOME:
+        # To Home: Depot → Stops (iş çıkışı - evlere bırakma)
+        return [depot] + stop_coords
+    else:  # RouteType.TO_DEPOT
+        # To Depot: Stops → Depot (iş başı - evlerden toplama)
+        return stop_coords + [depot]
+
+
+async def _cluster_and_snap_stops(
+    employees: List[dict],
+    employee_lookup: dict,
+    params: SimulationCreate,
+    max_stop_capacity: int
+) -> Tuple[List[dict], bool]:
+    """
+    Cluster employees into stops and snap the stops onto the road network.
+    
+    Returns:
+        (stops, cacheable); cacheable is False when any stop kept its raw
+        centroid because snapping failed (e.g. OSRM down or circuit open), or
+        when walking clustering fell back to straight-line distances
+    """
+    if params.clustering_method == "walking":
+        # Neighbours must be within walking distance on the foot network.
+        # Foot tables are fetched here; clustering itself runs in the process pool.
+        clustering_result = await cluster_employees_walking(
+            employee_data=employees,
+            max_walking_distance=params.max_walking_distance,
+            max_stop_capacity=max_stop_capacity
+        )
+    elif params.employee_ids:
+        # Ad-hoc area selection - no previous clustering to patch
+        clustering_result = await run_in_process(
+            cluster_employees,
+            employee_data=employees,
+            max_walking_distance=params.max_walking_distance,
+            method="dbscan",
+            max_stop_capacity=max_stop_capacity
+        )
+    else:
+        # Shift (or all employees): patch the previous clustering of this scope.
+        # The previous clustering lives in this process, so use a thread.
+        clustering_result = await asyncio.to_thread(
+            cluster_employees_incremental,
+            employee_data=employees,
+            max_walking_distance=params.max_walking_distance,
+            scope_key=("shift", params.shift_id),
+            max_stop_capacity=max_stop_capacity
+        )
+    
+    stops = clustering_result["stops"]
+    
+    if not stops:
+        return stops, False
+    
+    if clustering_result.get("walking_fallback"):
+        logger.warning("Yürüme ağı kısmen kullanılamadı, kümeleme önbelleğe alınmayacak")
+    
+    # Step 2.5: Snap stops to road network
+    # This ensures stops are on actual roads where vehicles can stop
+    stop_coords = [(s["location"]["lat"], s["location"]["lng"]) for s in stops]
+    snapped_results = await osrm_service.snap_multiple_to_road(stop_coords)
+    
+    # Update stop locations to snapped road positions
+    for i, (stop, snap_result) in enumerate(zip(stops, snapped_results)):
+        # Add employee names to stop
+        employee_names = []
+        for emp_id in stop.get("employee_ids", []):
+            emp = employee_lookup.get(emp_id)
+            if emp:
+                employee_names.append(emp.get("name", f"Çalışan #{emp_id}"))
+        stop["employee_names"] = employee_names
+        
+        if snap_result.get("valid"):
+            # Update stop location to road position
+            stop["original_location"] = stop["location"].copy()
+            stop["location"] = snap_result["snapped"]
+            stop["road_name"] = snap_result.get("road_name", "")
+            
+            # Calculate actual walking distances for each employee to snapped stop
+            max_walk = 0
+            employee_walks = []
+            for emp_id in stop.get("employee_ids", []):
+                emp = employee_lookup.get(emp_id)
+                if emp:
+                    walk_dist = geodesic(
+                        (emp["lat"], emp["lng"]),
+                        (stop["location"]["lat"], stop["location"]["lng"])
+                    ).meters
+                    max_walk = max(max_walk, walk_dist)
+                    employee_walks.append({
+                        "employee_id": emp_id,
+                        "walking_distance": round(walk_dist)
+                    })
+            
+            stop["max_walking_distance"] = round(max_walk)
+            stop["employee_walking_distances"] = employee_walks
+            logger.info(f"Durak {i+1}: {stop['road_name'] or 'Yol'} - max yürüyüş: {round(max_walk)}m")
+        else:
+            stop["max_walking_distance"] = stop.get("max_distance_to_centroid", 0)
+    
+    all_snapped = all(snap_result.get("valid") for snap_result in snapped_results)
+    return stops, all_snapped and not clustering_result.get("walking_fallback", False)
+
+
 @router.post("/", response_model=SimulationSummary)
 async def create_simulation(
     params: SimulationCreate,
@@ -173,6 +350,7 @@ async def create_simulation(
     """Create a new simulation - runs optimization and saves results"""
     try:
         await ensure_simulation_tables(db)
+        await ensure_clustering_cache_table(db)
         
         # Get shift info if shift_id is provided
         shift_name = None
@@ -191,37 +369,7 @@ async def create_simulation(
             shift_name = "Tüm Çalışanlar"
         
         # Step 1: Fetch employees (filtered by employee_ids, shift_id, or all)
-        if params.employee_ids is not None and len(params.employee_ids) > 0:
-            query = text("""
-                SELECT id, name, 
-                       ST_Y(home_location) as lat, 
-                       ST_X(home_location) as lng
-                FROM employees
-                WHERE id = ANY(:ids)
-            """)
-            result = await db.execute(query, {"ids": params.employee_ids})
-        elif params.shift_id is not None:
-            query = text("""
-                SELECT id, name, 
-                       ST_Y(home_location) as lat, 
-                       ST_X(home_location) as lng
-                FROM employees
-                WHERE shift_id = :shift_id
-            """)
-            result = await db.execute(query, {"shift_id": params.shift_id})
-        else:
-            query = text("""
-                SELECT id, name, 
-                       ST_Y(home_location) as lat, 
-                       ST_X(home_location) as lng
-                FROM employees
-            """)
-            result = await db.execute(query)
-        
-        employees = [
-            {"id": row.id, "name": row.name, "lat": row.lat, "lng": row.lng}
-            for row in result.fetchall()
-        ]
+        employees = await _fetch_employees(db, params.employee_ids, params.shift_id)
         
         if not employees:
             if params.shift_id is not None:
@@ -231,63 +379,40 @@ async def create_simulation(
         logger.info(f"Simülasyon başlatılıyor: {len(employees)} çalışan (Vardiya: {shift_name})")
         
         # Step 2: Cluster employees into stops
-        clustering_result = cluster_employees(
-            employee_data=employees,
-            max_walking_distance=params.max_walking_distance,
-            method="dbscan"
+        # Stops are capped at the largest vehicle so the CVRP is never infeasible
+        max_stop_capacity = max_effective_capacity(
+            params.use_16_seaters, params.use_27_seaters, params.buffer_seats
         )
+        employee_lookup = {e["id"]: e for e in employees}
         
-        stops = clustering_result["stops"]
+        # Same employees and parameters as an earlier run: reuse its snapped stops
+        fingerprint = clustering_fingerprint(
+            employees, params.max_walking_distance, params.clustering_method, max_stop_capacity
+        )
+        stops = await get_cached_stops(db, fingerprint)
+        
+        if stops is not None:
+            logger.info(f"Kümeleme önbellekten alındı: {len(stops)} durak")
+            # Names are not part of the fingerprint, refresh them
+            for stop in stops:
+                stop["employee_names"] = [
+                    employee_lookup[emp_id].get("name", f"Çalışan #{emp_id}")
+                    for emp_id in stop.get("employee_ids", [])
+                    if emp_id in employee_lookup
+                ]
+        else:
+            stops, cacheable = await _cluster_and_snap_stops(
+                employees, employee_lookup, params, max_stop_capacity
+            )
+            # Degraded (unsnapped) stops would be served until evicted; don't keep them
+            if cacheable:
+                await store_cached_stops(
+                    db, fingerprint, stops, params.clustering_method, params.max_walking_distance, len(employees)
+                )
         
         if not stops:
             raise HTTPException(status_code=400, detail="Durak oluşturulamadı")
         
-        # Step 2.5: Snap stops to road network
-        # This ensures stops are on actual roads where vehicles can stop
-        stop_coords = [(s["location"]["lat"], s["location"]["lng"]) for s in stops]
-        snapped_results = await osrm_service.snap_multiple_to_road(stop_coords)
-        
-        # Build employee lookup for walking distance calculation
-        employee_lookup = {e["id"]: e for e in employees}
-        
-        # Update stop locations to snapped road positions
-        for i, (stop, snap_result) in enumerate(zip(stops, snapped_results)):
-            # Add employee names to stop
-            employee_names = []
-            for emp_id in stop.get("employee_ids", []):
-                emp = employee_lookup.get(emp_id)
-                if emp:
-                    employee_names.append(emp.get("name", f"Çalışan #{emp_id}"))
-            stop["employee_names"] = employee_names
-            
-            if snap_result.get("valid"):
-                # Update stop location to road position
-                stop["original_location"] = stop["location"].copy()
-                stop["location"] = snap_result["snapped"]
-                stop["road_name"] = snap_result.get("road_name", "")
-                
-                # Calculate actual walking distances for each employee to snapped stop
-                max_walk = 0
-                employee_walks = []
-                for emp_id in stop.get("employee_ids", []):
-                    emp = employee_lookup.get(emp_id)
-                    if emp:
-                        walk_dist = geodesic(
-                            (emp["lat"], emp["lng"]),
-                            (stop["location"]["lat"], stop["location"]["lng"])
-                        ).meters
-                        max_walk = max(max_walk, walk_dist)
-                        employee_walks.append({
-                            "employee_id": emp_id,
-                            "walking_distance": round(walk_dist)
-                        })
-                
-                stop["max_walking_distance"] = round(max_walk)
-                stop["employee_walking_distances"] = employee_walks
-                logger.info(f"Durak {i+1}: {stop['road_name'] or 'Yol'} - max yürüyüş: {round(max_walk)}m")
-            else:
-                stop["max_walking_distance"] = stop.get("max_distance_to_centroid", 0)
-        
         # Step 3: Get distance matrix from OSRM
         depot = (params.depot_location.lat, params.depot_location.lng)
         coordinates = [depot]
@@ -302,16 +427,18 @@ async def create_simulation(
             exclude_tolls=params.exclude_tolls
         )
         
+        # Matrices go to the solver process as NumPy arrays (cheap to pickle)
+        distance_matrix = np.asarray(matrix_result["distances"], dtype=np.float64)
+        duration_matrix = matrix_result.get("durations")
+        if duration_matrix is not None:
+            duration_matrix = np.asarray(duration_matrix, dtype=np.float64)
+        
         # Apply traffic scaling to duration matrix based on traffic mode
         traffic_factor = TRAFFIC_SCALING_FACTORS.get(params.traffic_mode, 1.0)
-        duration_matrix = matrix_result.get("durations")
         
-        if duration_matrix and traffic_factor != 1.0:
+        if duration_matrix is not None and traffic_factor != 1.0:
             # Scale all durations by traffic factor
-            duration_matrix = [
-                [int(d * traffic_factor) for d in row]
-                for row in duration_matrix
-            ]
+            duration_matrix = np.floor(duration_matrix * traffic_factor)
             logger.info(f"Trafik modu: {params.traffic_mode.value} - süre faktörü: {traffic_factor}x")
         
         # Convert max_travel_time from minutes to seconds (also scaled by traffic)
@@ -329,55 +456,75 @@ async def create_simulation(
         
         logger.info(f"Optimization for {num_stops} stops - solver time limit: {solver_time_limit}s")
         
-        # Step 4: Solve CVRP with retry logic for tight time constraints
+        # Step 4: Solve CVRP once with a pool of optional vehicles
+        # The solver adds optional vehicles (at a high fixed cost) only when the
+        # requested fleet cannot serve every stop within the route time limit
         num_16 = params.use_16_seaters
         num_27 = params.use_27_seaters
-        max_retries = 5
-        optimization_result = None
-        
-        for attempt in range(max_retries):
-            optimization_result = create_optimized_routes(
-                stops=stops,
-                depot_location=depot,
-                distance_matrix=matrix_result["distances"],
-                num_16_seaters=num_16,
-                num_27_seaters=num_27,
-                time_limit_seconds=solver_time_limit,
-                vehicle_priority=params.vehicle_priority or "auto",
-                duration_matrix=duration_matrix,
-                max_route_duration=max_route_duration,
-                buffer_seats=params.buffer_seats
-            )
-            
-            # Check if we got a valid solution
-            if optimization_result.get("status") != "NO_SOLUTION" and optimization_result.get("vehicles_used", 0) > 0:
-                if attempt > 0:
-                    logger.info(f"Çözüm bulundu: {attempt + 1}. denemede, toplam {num_16 + num_27} araç ile")
-                break
-            
-            # No solution found - increase vehicle count and retry
-            logger.warning(f"Süre kısıtı nedeniyle çözüm bulunamadı (deneme {attempt + 1}). Araç sayısı artırılıyor...")
-            
-            # Add more vehicles based on priority
-            if params.vehicle_priority == "small":
-                num_16 += 2
-            elif params.vehicle_priority == "large":
-                num_27 += 2
-            else:
-                # Auto mode - add one of each
-                num_16 += 1
-                num_27 += 1
+        vehicle_priority = params.vehicle_priority or "auto"
+        optional_16, optional_27 = optional_vehicle_pool(
+            num_16,
+            num_27,
+            vehicle_priority,
+            [stop["employee_count"] for stop in stops],
+            params.buffer_seats
+        )
+        
+        optimization_result = await solve_routes(
+            stops=stops,
+            depot_location=depot,
+            distance_matrix=distance_matrix,
+            num_16_seaters=num_16,
+            num_27_seaters=num_27,
+            time_limit_seconds=solver_time_limit,
+            vehicle_priority=vehicle_priority,
+            duration_matrix=duration_matrix,
+            max_route_duration=max_route_duration,
+            buffer_seats=params.buffer_seats,
+            optional_16_seaters=optional_16,
+            optional_27_seaters=optional_27,
+            solver_mode=params.solver_mode
+        )
         
         if optimization_result.get("status") == "NO_SOLUTION" or optimization_result.get("vehicles_used", 0) == 0:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Verilen süre kısıtı ({params.max_travel_time} dk) ile çözüm bulunamadı. Daha uzun süre veya daha fazla araç gerekli."
+            infeasibility = optimization_result.get("infeasibility") or {}
+            reason = infeasibility.get("reason")
+            logger.warning(f"CVRP çözümsüz: {infeasibility}")
+            if reason == "stop_exceeds_capacity":
+                detail = (
+                    f"Bazı duraklardaki yolcu sayısı araç kapasitesini ({infeasibility['max_capacity']} kişi) aşıyor. "
+                    "Boş koltuk sayısını azaltın veya durak yarıçapını küçültün."
+                )
+            elif reason == "insufficient_capacity":
+                detail = (
+                    f"Toplam yolcu sayısı ({infeasibility['total_demand']}) araç kapasitesini "
+                    f"({infeasibility['total_capacity']}) aşıyor. Daha fazla araç gerekli."
+                )
+            else:
+                detail = (
+                    f"Verilen süre kısıtı ({params.max_travel_time} dk) ile çözüm bulunamadı. "
+                    "Daha uzun süre veya daha fazla araç gerekli."
+                )
+            raise HTTPException(status_code=400, detail=detail)
+        
+        # Count the optional vehicles the solver used as part of the fleet
+        for route in optimization_result["routes"]:
+            if route.get("optional_vehicle"):
+                if route["vehicle_type"] == "16-seater":
+                    num_16 += 1
+                else:
+                    num_27 += 1
+        if optimization_result.get("optional_vehicles_used"):
+            logger.info(
+                f"Çözüm için {optimization_result['optional_vehicles_used']} ek araç kullanıldı "
+                f"(alt sınır: {optimization_result.get('vehicle_lower_bound')} araç)"
             )
         
         # Step 5: Get route geometries based on route_type
         routes_with_geometry = []
         route_type = params.route_type
         
+        planned_routes = []
         for route in optimization_result["routes"]:
             # Filter out depot entries from stops - only get actual employee stops
             actual_stops = [stop for stop in route["stops"] if stop.get("type") != "depot"]
@@ -387,19 +534,16 @@ async def create_simulation(
                 (stop["location"]["lat"], stop["location"]["lng"])
                 for stop in actual_stops
             ]
-            
-            if route_type == RouteType.RING:
-                # Ring: Depot → Stops → Depot (tam tur)
-                route_coords = [depot] + stop_coords + [depot]
-            elif route_type == RouteType.TO_HOME:
-                # To Home: Depot → Stops (iş çıkışı - evlere bırakma)
-                route_coords = [depot] + stop_coords
-            else:  # RouteType.TO_DEPOT
-                # To Depot: Stops → Depot (iş başı - evlerden toplama)
-                route_coords = stop_coords + [depot]
-            
+            planned_routes.append((route, actual_stops, _route_coordinates(stop_coords, depot, route_type)))
+        
+        # Fetch all geometries concurrently (bounded fan-out), results in route order
+        route_geometries = await osrm_service.get_multiple_routes(
+            [route_coords for _, _, route_coords in planned_routes],
+            exclude_tolls=params.exclude_tolls
+        )
+        
+        for (route, actual_stops, route_coords), route_geometry in zip(planned_routes, route_geometries):
             if len(route_coords) >= 2:
-                route_geometry = await osrm_service.get_route(route_coords, exclude_tolls=params.exclude_tolls)
                 osrm_polyline = route_geometry.get("geometry", [])
                 legs = route_geometry.get("legs", [])
                 
@@ -590,6 +734,34 @@ async def create_simulation(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/clustering-sweep")
+async def clustering_sweep(
+    params: ClusteringSweepRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """Stop counts and stop demand histograms for a list of walking distances"""
+    if any(d < 50 or d > OPTICS_MAX_EPS for d in params.walking_distances):
+        raise HTTPException(status_code=400, detail=f"Yürüme mesafesi 50-{OPTICS_MAX_EPS:.0f}m arasında olmalı")
+    
+    employees = await _fetch_employees(db, params.employee_ids, params.shift_id)
+    if not employees:
+        raise HTTPException(status_code=400, detail="Çalışan bulunamadı")
+    
+    max_stop_capacity = max_effective_capacity(
+        params.use_16_seaters, params.use_27_seaters, params.buffer_seats
+    )
+    # OPTICS models are cached in this process, so use a thread
+    results = await asyncio.to_thread(
+        sweep_walking_distances, employees, params.walking_distances, max_stop_capacity
+    )
+    
+    return {
+        "employee_count": len(employees),
+        "max_stop_capacity": max_stop_capacity,
+        "results": results
+    }
+
+
 @router.get("/", response_model=List[SimulationSummary])
 async def list_simulations(
     skip: int = 0,
@@ -838,8 +1010,8 @@ async def preview_route_update(
             route_coords.append((loc["lat"], loc["lng"]))
         route_coords.append(depot)
         
-        # Get new route from OSRM
-        route_data = await osrm_service.get_route(route_coords)
+        # Preview route, stitched from cached legs where possible
+        route_data = await osrm_service.get_route_preview(route_coords)
         
         # Apply traffic factor to duration
         new_duration = route_data.get("duration", 0) * traffic_factor
@@ -1089,8 +1261,8 @@ async def preview_route_reorder(
             route_coords.append((loc["lat"], loc["lng"]))
         route_coords.append(depot)
         
-        # Get new route from OSRM
-        route_data = await osrm_service.get_route(route_coords)
+        # Preview route, stitched from cached legs where possible
+        route_data = await osrm_service.get_route_preview(route_coords)
         
         # Apply traffic factor to duration
         new_duration = route_data.get("duration", 0) * traffic_factor
@@ -1291,7 +1463,7 @@ async def preview_add_employee(
             route_coords.append((loc["lat"], loc["lng"]))
         route_coords.append(depot)
 
-        route_data = await osrm_service.get_route(route_coords)
+        route_data = await osrm_service.get_route_preview(route_coords)
         new_distance = route_data.get("distance", 0)
         new_duration = route_data.get("duration", 0) * traffic_factor
 
@@ -1488,7 +1660,7 @@ async def preview_remove_employee(
         new_distance = 0.0
         new_duration = 0.0
         if len(route_coords) > 2:
-            route_data = await osrm_service.get_route(route_coords)
+            route_data = await osrm_service.get_route_preview(route_coords)
             new_distance = route_data.get("distance", 0)
             new_duration = route_data.get("duration", 0) * traffic_factor
 
@@ -1823,11 +1995,18 @@ async def reoptimize_route(
         if not employees:
             raise HTTPException(status_code=400, detail="Personel bilgileri bulunamadı")
 
-        # 5. Personelleri yeniden kümele
-        clustering_result = cluster_employees(
+        # Araç kapasitesini ve tipini koruyoruz
+        vehicle_capacity = route.capacity
+        buffer_seats = sim.buffer_seats or 0
+        effective_capacity = max(1, vehicle_capacity - buffer_seats)
+
+        # 5. Personelleri yeniden kümele (duraklar araç kapasitesini aşmaz)
+        clustering_result = await run_in_process(
+            cluster_employees,
             employee_data=employees,
             max_walking_distance=sim.max_walking_distance,
-            method="dbscan"
+            method="dbscan",
+            max_stop_capacity=effective_capacity
         )
         stops = clustering_result["stops"]
 
@@ -1883,22 +2062,18 @@ async def reoptimize_route(
 
         matrix_result = await osrm_service.get_distance_matrix(coordinates)
 
-        # Trafik ölçeklendirmesi
+        distance_matrix = np.asarray(matrix_result["distances"], dtype=np.float64)
         duration_matrix = matrix_result.get("durations")
-        if duration_matrix and traffic_factor != 1.0:
-            duration_matrix = [
-                [int(d * traffic_factor) for d in row]
-                for row in duration_matrix
-            ]
+        if duration_matrix is not None:
+            duration_matrix = np.asarray(duration_matrix, dtype=np.float64)
+
+        # Trafik ölçeklendirmesi
+        if duration_matrix is not None and traffic_factor != 1.0:
+            duration_matrix = np.floor(duration_matrix * traffic_factor)
 
         max_route_duration = int(sim.max_travel_time * 60 * traffic_factor)
 
         # 8. Tek araç ile TSP çöz (CVRP solver, 1 araç)
-        # Araç kapasitesini ve tipini koruyoruz
-        vehicle_capacity = route.capacity
-        buffer_seats = sim.buffer_seats or 0
-        effective_capacity = max(1, vehicle_capacity - buffer_seats)
-
         # Demands: depot=0, stops=employee_count
         demands = [0]
         demands.extend([stop["employee_count"] for stop in stops])
@@ -1906,7 +2081,7 @@ async def reoptimize_route(
         from app.services.optimization_service import CVRPSolver
 
         solver = CVRPSolver(
-            distance_matrix=matrix_result["distances"],
+            distance_matrix=distance_matrix,
             demands=demands,
             vehicle_capacities=[effective_capacity],
             depot_index=0,
@@ -1916,7 +2091,7 @@ async def reoptimize_route(
             max_route_duration=max_route_duration
         )
 
-        solution = solver.solve()
+        solution = await run_in_process(solver.solve)
 
         if solution.get("status") == "NO_SOLUTION" or solution.get("vehicles_used", 0) == 0:
             raise HTTPException(
@@ -1948,12 +2123,7 @@ async def reoptimize_route(
             for s in optimized_stops
         ]
 
-        if route_type == RouteType.RING:
-            route_coords = [depot] + stop_coords_ordered + [depot]
-        elif route_type == RouteType.TO_HOME:
-            route_coords = [depot] + stop_coords_ordered
-        else:  # TO_DEPOT
-            route_coords = stop_coords_ordered + [depot]
+        route_coords = _route_coordinates(stop_coords_ordered, depot, route_type)
 
         new_distance = 0.0
         new_duration = 0.0
@@ -0,0 +1,119 @@
+"""
+Circuit breaker - Fast-fail calls to a dependency that is down
+
+When OSRM hangs, every request waits for the full HTTP timeout before the
+caller falls back to straight-line estimates. The breaker counts consecutive
+failures (timeouts, connection errors, 5xx) and opens after
+settings.osrm_breaker_failure_threshold of them. While open, calls are
+rejected immediately with CircuitOpenError so callers take their fallback
+path at once.
+
+After settings.osrm_breaker_reset_seconds the next call runs a single health
+probe (half-open). A healthy probe closes the breaker; otherwise it stays open
+for another reset period.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker with half-open health probing.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None):
+        """
+        Args:
+            name: Dependency name used in logs and errors
+            failure_threshold: Consecutive failures that open the breaker
+            reset_timeout: Seconds to stay open before probing again
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.osrm_breaker_failure_threshold
+        self.reset_timeout = reset_timeout if reset_timeout is not None else settings.osrm_breaker_reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trips = 0
+        self.rejected = 0
+        self._probe_lock = asyncio.Lock()
+
+    def _open(self):
+        if self.state != OPEN:
+            self.trips += 1
+            logger.error(f"{self.name} circuit opened after {self.failures} consecutive failures")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def record_success(self):
+        """A call reached a healthy dependency."""
+        if self.state != CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        """A call failed because the dependency is unhealthy."""
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._open()
+
+    async def before_call(self, probe: Callable[[], Awaitable[bool]]):
+        """
+        Admit or reject a call.
+
+        Args:
+            probe: Health check run once when the reset timeout has passed
+
+        Raises:
+            CircuitOpenError: The breaker is open (or a probe is in progress)
+        """
+        if self.state == CLOSED:
+            return
+
+        if (
+            self.state == OPEN
+            and time.monotonic() - self.opened_at >= self.reset_timeout
+            and not self._probe_lock.locked()
+        ):
+            async with self._probe_lock:
+                self.state = HALF_OPEN
+                try:
+                    healthy = await probe()
+                except Exception:
+                    healthy = False
+                if healthy:
+                    self.record_success()
+                else:
+                    self._open()
+
+        if self.state != CLOSED:
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} circuit open")
+
+    def stats(self) -> Dict:
+        """Breaker state and counters since process start."""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "open_for_seconds": (
+                round(time.monotonic() - self.opened_at, 1) if self.opened_at is not None else None
+            ),
+            "trips": self.trips,
+            "rejected_calls": self.rejected
+        }
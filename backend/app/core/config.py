@@ -2,7 +2,7 @@
 Configuration settings for the application
 """
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Literal
 import os
 
 
@@ -17,6 +17,43 @@ class Settings(BaseSettings):
     
     # OSRM
     osrm_url: str = os.getenv("OSRM_URL", "http://localhost:5000")
+    # OSRM instance built with the foot profile (walking-network clustering)
+    osrm_foot_url: str = os.getenv("OSRM_FOOT_URL", "http://localhost:5001")
+    # Shared OSRM HTTP client pool (per OSRM instance)
+    osrm_max_connections: int = 32
+    osrm_max_keepalive_connections: int = 16
+    osrm_keepalive_expiry: float = 30.0
+    # HTTP/2 is only negotiated over https and needs the 'h2' package
+    osrm_http2: bool = False
+    # Largest OSRM table request (osrm-routed --max-table-size) and parallel block requests
+    osrm_max_table_size: int = 100
+    osrm_table_concurrency: int = 8
+    # Route geometries fetched in parallel per simulation
+    osrm_route_concurrency: int = 4
+    # Circuit breaker: consecutive failures that open it, seconds before a health probe
+    osrm_breaker_failure_threshold: int = 5
+    osrm_breaker_reset_seconds: float = 30.0
+    # OSRM pair cache: coordinate rounding (decimal places), in-process LRU size
+    # in cells (the default holds one full 1000-point matrix, ~24 MB), Postgres
+    # persistence and how long persisted pairs stay valid
+    matrix_cache_precision: int = 5
+    matrix_cache_max_pairs: int = 1000000
+    matrix_cache_persist: bool = True
+    matrix_cache_ttl_days: int = 30
+    # OSRM route cache: in-process size limit and optional Postgres persistence
+    # (least recently used rows evicted past the row limit), plus the size limit
+    # of the per-leg cache
+    route_cache_max_bytes: int = 64 * 1024 * 1024
+    route_cache_persist: bool = False
+    route_cache_max_rows: int = 20000
+    leg_cache_max_bytes: int = 64 * 1024 * 1024
+    # Stop snapping: parallel OSRM nearest requests, snap cache grid cell
+    # (decimal places of lat/lng, 4 = ~11 m) and number of cached cells
+    osrm_snap_concurrency: int = 8
+    snap_cache_decimals: int = 4
+    snap_cache_max_entries: int = 20000
+    # Offline road-class index for local main-road snapping (see app/services/road_index.py)
+    road_index_path: str = os.getenv("ROAD_INDEX_PATH", "")
     
     # OpenRouteService API (for walking routes)
     ors_api_key: str = os.getenv("ORS_API_KEY", "")
@@ -32,6 +69,35 @@ class Settings(BaseSettings):
     # Clustering parameters
     min_cluster_size: int = 3
     max_cluster_radius_meters: float = 200.0
+    # Above this many employees DBSCAN uses a sparse neighborhood graph
+    sparse_clustering_threshold: int = 1000
+    # Number of shifts whose clustering is kept for incremental updates
+    incremental_clustering_max_scopes: int = 32
+    # Snapped stop sets kept in the clustering_cache table (least recently used evicted)
+    clustering_cache_max_entries: int = 500
+    # Walking-network clustering: coordinates per foot table request and parallel requests
+    walking_table_max_size: int = 100
+    walking_table_concurrency: int = 4
+    # Employee sets whose OPTICS ordering is kept for walking-distance sweeps
+    optics_cache_max_entries: int = 16
+    
+    # Worker processes for clustering and route solving (0 = one per CPU core)
+    process_pool_workers: int = 0
+    process_pool_start_method: str = "spawn"
+    # Parallel CVRP searches per solve, best objective wins
+    # (0 = all worker processes but one, leaving a worker for other jobs; 1 = off)
+    solver_portfolio_size: int = 0
+    # Stop a CVRP search once its best objective improved by less than this fraction
+    # of its variable (non-fixed vehicle) cost over the last window
+    # (window 0 = always use the full time limit)
+    solver_plateau_window_seconds: float = 10.0
+    solver_plateau_min_improvement: float = 0.005
+    # CVRP solver mode: 'portfolio' (single model), 'decomposition' (partitioned) or
+    # 'auto' (decomposition above the stop threshold); partitions are 'sweep' or 'cluster'
+    solver_mode: Literal["portfolio", "decomposition", "auto"] = "auto"
+    solver_decomposition_threshold: int = 250
+    solver_partition_size: int = 100
+    solver_partition_method: Literal["sweep", "cluster"] = "sweep"
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,133 @@
+"""
+Worker pool - Runs CPU-bound pipeline stages off the asyncio event loop
+
+Clustering and OR-Tools solves can take up to a minute. Running them inside
+an async handler blocks every other request on the worker, health checks
+included. run_in_process hands such calls to a shared process pool instead;
+the pool is created on first use and shut down by the application lifespan.
+
+Arguments are pickled to the worker, so pass matrices as NumPy arrays (one
+contiguous buffer) rather than nested lists of Python floats. When many
+workers need the same large arrays, shared_arrays places them in shared
+memory once and workers attach to them by name.
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+import logging
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def process_pool_size() -> int:
+    """Configured number of worker processes (defaults to the CPU count)."""
+    return settings.process_pool_workers or os.cpu_count() or 1
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context(settings.process_pool_start_method)
+            _pool = ProcessPoolExecutor(max_workers=process_pool_size(), mp_context=context)
+            logger.info(f"Process pool started with {process_pool_size()} workers")
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Forget a broken pool so the next call starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_process(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a picklable callable in the process pool and await its result.
+
+    Args:
+        func: Module-level function (or bound method of a picklable object)
+        *args, **kwargs: Arguments passed to func
+
+    Returns:
+        Whatever func returns
+    """
+    pool = get_process_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); don't leave the pool unusable
+        logger.error("Process pool worker died, restarting pool")
+        _discard_pool(pool)
+        raise
+
+
+def shutdown_process_pool():
+    """Stop the worker processes; called on application shutdown."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+        logger.info("Process pool stopped")
+
+
+@contextmanager
+def shared_arrays(**arrays: Optional[np.ndarray]) -> Iterator[Dict[str, Optional[Dict]]]:
+    """
+    Copy arrays into shared memory for the duration of the block.
+    
+    Yields picklable references (name, shape, dtype) to pass to workers, which
+    read them with attach_shared_array. None values stay None. The blocks are
+    released when the block exits.
+    """
+    blocks = []
+    refs: Dict[str, Optional[Dict]] = {}
+    try:
+        for key, array in arrays.items():
+            if array is None:
+                refs[key] = None
+                continue
+            array = np.ascontiguousarray(array)
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            refs[key] = {"name": block.name, "shape": array.shape, "dtype": array.dtype.str}
+        yield refs
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def attach_shared_array(ref: Optional[Dict]) -> Tuple[Optional[SharedMemory], Optional[np.ndarray]]:
+    """
+    Open an array created by shared_arrays without copying it.
+    
+    Returns:
+        (block, array); close the block once the array is no longer used
+    """
+    if ref is None:
+        return None, None
+    # Pool workers share the parent's resource tracker, so attaching here does
+    # not change who unlinks the block
+    block = SharedMemory(name=ref["name"])
+    return block, np.ndarray(ref["shape"], dtype=np.dtype(ref["dtype"]), buffer=block.buf)
@@ -4,10 +4,17 @@ Employee Shuttle Route Optimization System - Main Application
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 from app.core.config import settings
 from app.core.database import init_db
+from app.core.workers import shutdown_process_pool
+from app.services.osrm_service import osrm_service, osrm_foot_service
+from app.services.matrix_cache import pair_cache
+from app.services.route_cache import route_cache, leg_cache
+from app.services.snap_cache import snap_cache
+from app.services.road_index import get_road_index
 from app.api import employees, stops, optimization, routes, simulation, settings as settings_api, simulations, shifts
 
 # Configure logging
@@ -20,8 +27,12 @@ async def lifespan(app: FastAPI):
     """Application lifespan handler"""
     logger.info("Starting up Shuttle Route Optimization System...")
     await init_db()
+    await asyncio.to_thread(get_road_index)
     yield
     logger.info("Shutting down...")
+    await osrm_service.aclose()
+    await osrm_foot_service.aclose()
+    shutdown_process_pool()
 
 
 app = FastAPI(
@@ -67,5 +78,12 @@ async def health_check():
     return {
         "status": "healthy",
         "database": "connected",
-        "osrm": settings.osrm_url
+        "osrm": settings.osrm_url,
+        "osrm_breaker": osrm_service.breaker.stats(),
+        "osrm_foot_breaker": osrm_foot_service.breaker.stats(),
+        "matrix_cache": pair_cache.stats(),
+        "route_cache": route_cache.stats(),
+        "leg_cache": leg_cache.stats(),
+        "snap_cache": snap_cache.stats(),
+        "osrm_requests": osrm_service.inflight_stats()
     }
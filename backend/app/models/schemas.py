@@ -2,7 +2,7 @@
 Pydantic schemas for API request/response models
 """
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -21,6 +21,10 @@ class RouteType(str, Enum):
     TO_DEPOT = "to_depot"   # Stops → Depot (pick up - iş başı)
 
 
+# CVRP solver modes (see decomposition_solver.solve_routes)
+SolverMode = Literal["portfolio", "decomposition", "auto"]
+
+
 # Traffic scaling factors based on Istanbul traffic data
 TRAFFIC_SCALING_FACTORS = {
     TrafficMode.NONE: 1.0,
@@ -179,6 +183,7 @@ class OptimizationParams(BaseModel):
     time_limit_seconds: int = Field(default=30, ge=5, le=300, description="Optimization time limit")
     traffic_mode: TrafficMode = Field(default=TrafficMode.NONE, description="Traffic profile: none, morning (08:00), or evening (18:00)")
     buffer_seats: int = Field(default=0, ge=0, le=5, description="Buffer seats to leave empty per vehicle for comfort")
+    solver_mode: Optional[SolverMode] = Field(default=None, description="CVRP solver: 'portfolio', 'decomposition' (large instances) or 'auto'. None uses the server setting")
 
 
 class ClusteringResult(BaseModel):
@@ -0,0 +1,136 @@
+"""
+Clustering Cache - Persists clustered and road-snapped stops in Postgres
+
+The same shift is usually simulated many times with different fleet or
+traffic settings while employees and walking distance stay the same. Stops
+are stored under a fingerprint of the employee set and clustering parameters,
+so a repeat simulation skips clustering and the OSRM nearest calls entirely.
+The table is kept to settings.clustering_cache_max_entries rows, evicting the
+least recently used fingerprints.
+"""
+import hashlib
+import json
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bump when clustering or snapping changes so old entries stop matching
+CLUSTERING_CACHE_VERSION = 1
+
+
+def clustering_fingerprint(
+    employee_data: List[Dict],
+    max_walking_distance: float,
+    method: str,
+    max_stop_capacity: Optional[int] = None
+) -> str:
+    """
+    Hash of the employee set (ids and coordinates) and clustering parameters.
+
+    Args:
+        employee_data: List of dicts with 'id', 'lat', 'lng' keys
+        max_walking_distance: Maximum walking distance in meters
+        method: Clustering method name
+        max_stop_capacity: Stop capacity limit used when clustering
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(
+        f"v{CLUSTERING_CACHE_VERSION}|{method}|{float(max_walking_distance):.1f}|{max_stop_capacity}".encode()
+    )
+    for emp in sorted(employee_data, key=lambda e: e["id"]):
+        digest.update(f"|{emp['id']}:{float(emp['lat']):.7f},{float(emp['lng']):.7f}".encode())
+    return digest.hexdigest()
+
+
+def _json_default(value):
+    """Serialize numpy scalars that end up in stop dictionaries."""
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+async def ensure_clustering_cache_table(db: AsyncSession):
+    """Create the clustering cache table if it doesn't exist"""
+    await db.execute(text("""
+        CREATE TABLE IF NOT EXISTS clustering_cache (
+            fingerprint VARCHAR(64) PRIMARY KEY,
+            method VARCHAR(50) NOT NULL,
+            max_walking_distance DOUBLE PRECISION NOT NULL,
+            employee_count INT NOT NULL,
+            stops JSONB NOT NULL,
+            hit_count INT DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    await db.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_clustering_cache_last_used ON clustering_cache (last_used_at)"
+    ))
+    await db.commit()
+
+
+async def get_cached_stops(db: AsyncSession, fingerprint: str) -> Optional[List[Dict]]:
+    """
+    Return cached snapped stops for a fingerprint and mark them as recently used.
+
+    Returns:
+        List of stop dictionaries, or None on a cache miss
+    """
+    result = await db.execute(text("""
+        UPDATE clustering_cache
+        SET last_used_at = CURRENT_TIMESTAMP, hit_count = hit_count + 1
+        WHERE fingerprint = :fingerprint
+        RETURNING stops
+    """), {"fingerprint": fingerprint})
+    row = result.fetchone()
+    await db.commit()
+
+    if not row:
+        return None
+    return json.loads(row.stops) if isinstance(row.stops, str) else row.stops
+
+
+async def store_cached_stops(
+    db: AsyncSession,
+    fingerprint: str,
+    stops: List[Dict],
+    method: str,
+    max_walking_distance: float,
+    employee_count: int
+):
+    """
+    Store snapped stops for a fingerprint and evict least recently used entries.
+    """
+    await db.execute(text("""
+        INSERT INTO clustering_cache
+        (fingerprint, method, max_walking_distance, employee_count, stops)
+        VALUES (:fingerprint, :method, :walk_dist, :employee_count, :stops)
+        ON CONFLICT (fingerprint) DO UPDATE
+        SET stops = EXCLUDED.stops, last_used_at = CURRENT_TIMESTAMP
+    """), {
+        "fingerprint": fingerprint,
+        "method": method,
+        "walk_dist": float(max_walking_distance),
+        "employee_count": employee_count,
+        "stops": json.dumps(stops, default=_json_default)
+    })
+
+    await db.execute(text("""
+        DELETE FROM clustering_cache
+        WHERE fingerprint IN (
+            SELECT fingerprint FROM clustering_cache
+            ORDER BY last_used_at DESC
+            OFFSET :max_entries
+        )
+    """), {"max_entries": settings.clustering_cache_max_entries})
+
+    await db.commit()
@@ -5,14 +5,29 @@ This module implements spatial clustering to group employees within walking dist
 of shuttle stops (200m constraint).
 """
 import numpy as np
+from scipy import sparse as sp
 from sklearn.cluster import DBSCAN, KMeans
 from sklearn.metrics import pairwise_distances
-from typing import List, Tuple, Dict
-from geopy.distance import geodesic
+from sklearn.neighbors import BallTree
+from ortools.graph.python import min_cost_flow
+from typing import List, Tuple, Dict, Optional
+import math
 import logging
 
+from app.core.config import settings
+from app.services.distance_utils import (
+    distance_matrix as ellipsoidal_distance_matrix,
+    ellipsoidal_distance,
+    EARTH_RADIUS_METERS
+)
+from app.services.spatial_index import SpatialGridIndex
+
 logger = logging.getLogger(__name__)
 
+# Nearest centers offered to each point in the capacitated assignment before
+# falling back to the complete point x center graph
+CAPACITY_CANDIDATE_CENTERS = 8
+
 
 class ClusteringService:
     """
@@ -36,30 +51,58 @@ class ClusteringService:
         """
         Calculate geodesic distance matrix between all points.
         
+        Uses the vectorized ellipsoidal kernel from distance_utils, which stays
+        within 1 mm of geopy's geodesic for pairs up to 2000 m apart.
+        
         Args:
             coordinates: Array of shape (n, 2) with [lat, lng] pairs
             
         Returns:
             Distance matrix in meters
         """
+        return ellipsoidal_distance_matrix(coordinates)
+    
+    def _calculate_neighborhood_graph(self, coordinates: np.ndarray) -> sp.csr_matrix:
+        """
+        Calculate a sparse distance graph holding only pairs within walking distance.
+        
+        A haversine BallTree finds candidate pairs with a slightly inflated
+        radius (the sphere differs from the ellipsoid by up to ~0.5%), then
+        candidates are filtered with the same ellipsoidal kernel used by the
+        dense matrix. Memory scales with the number of neighbors, not n².
+        
+        Args:
+            coordinates: Array of shape (n, 2) with [lat, lng] pairs
+            
+        Returns:
+            CSR matrix of distances in meters (explicit zeros kept for duplicates)
+        """
         n = len(coordinates)
-        distances = np.zeros((n, n))
-        
-        for i in range(n):
-            for j in range(i + 1, n):
-                dist = geodesic(
-                    (coordinates[i][0], coordinates[i][1]),
-                    (coordinates[j][0], coordinates[j][1])
-                ).meters
-                distances[i, j] = dist
-                distances[j, i] = dist
-        
-        return distances
+        radians = np.radians(coordinates)
+        tree = BallTree(radians, metric='haversine')
+        search_radius = self.max_walking_distance * 1.01 / EARTH_RADIUS_METERS
+        neighbors = tree.query_radius(radians, r=search_radius)
+        
+        counts = np.fromiter((len(nb) for nb in neighbors), dtype=np.int64, count=n)
+        rows = np.repeat(np.arange(n), counts)
+        cols = np.concatenate(neighbors) if n else np.array([], dtype=np.int64)
+        
+        distances = ellipsoidal_distance(
+            coordinates[rows, 0], coordinates[rows, 1],
+            coordinates[cols, 0], coordinates[cols, 1]
+        )
+        within = distances <= self.max_walking_distance
+        rows, cols, distances = rows[within], cols[within], distances[within]
+        
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return sp.csr_matrix((distances, cols, indptr), shape=(n, n))
     
     def cluster_with_dbscan(
         self, 
         employee_coordinates: List[Tuple[float, float]],
-        employee_ids: List[int]
+        employee_ids: List[int],
+        sparse: Optional[bool] = None
     ) -> Dict:
         """
         Cluster employees using DBSCAN algorithm.
@@ -72,6 +115,9 @@ class ClusteringService:
         Args:
             employee_coordinates: List of (lat, lng) tuples
             employee_ids: List of employee IDs corresponding to coordinates
+            sparse: Use a sparse radius-neighbors graph instead of the dense
+                n×n matrix. None selects it automatically above
+                settings.sparse_clustering_threshold employees.
             
         Returns:
             Dictionary with clusters, stops, and unclustered employees
@@ -84,11 +130,17 @@ class ClusteringService:
                 "total_clusters": 0
             }
         
-        coordinates = np.array(employee_coordinates)
+        coordinates = np.array(employee_coordinates, dtype=np.float64)
+        if sparse is None:
+            sparse = len(coordinates) > settings.sparse_clustering_threshold
         
-        # Calculate distance matrix in meters
-        logger.info(f"Calculating distance matrix for {len(coordinates)} employees...")
-        distance_matrix = self._calculate_distance_matrix(coordinates)
+        if sparse:
+            logger.info(f"Calculating neighborhood graph for {len(coordinates)} employees...")
+            distance_matrix = self._calculate_neighborhood_graph(coordinates)
+        else:
+            # Calculate distance matrix in meters
+            logger.info(f"Calculating distance matrix for {len(coordinates)} employees...")
+            distance_matrix = self._calculate_distance_matrix(coordinates)
         
         # DBSCAN with precomputed distances
         # eps = max walking distance, min_samples = at least 2 people per stop
@@ -100,6 +152,25 @@ class ClusteringService:
         
         labels = dbscan.fit_predict(distance_matrix)
         
+        return self._build_dbscan_result(labels, coordinates, employee_ids)
+    
+    def _build_dbscan_result(
+        self,
+        labels: np.ndarray,
+        coordinates: np.ndarray,
+        employee_ids: List[int]
+    ) -> Dict:
+        """
+        Convert DBSCAN labels into the clusters/stops/unclustered result shape.
+        
+        Args:
+            labels: Cluster label per employee (-1 for noise)
+            coordinates: Array of shape (n, 2) with [lat, lng] pairs
+            employee_ids: List of employee IDs corresponding to coordinates
+            
+        Returns:
+            Dictionary with clusters, stops, and unclustered employees
+        """
         # Process clustering results
         clusters = {}
         unclustered = []
@@ -135,13 +206,9 @@ class ClusteringService:
             centroid_lng = np.mean(lngs)
             
             # Verify all members are within walking distance of centroid
-            max_dist = 0
-            for member in members:
-                dist = geodesic(
-                    (centroid_lat, centroid_lng),
-                    (member["location"]["lat"], member["location"]["lng"])
-                ).meters
-                max_dist = max(max_dist, dist)
+            max_dist = float(np.max(ellipsoidal_distance(
+                centroid_lat, centroid_lng, np.array(lats), np.array(lngs)
+            )))
             
             stops.append({
                 "cluster_id": cluster_id,
@@ -174,8 +241,10 @@ class ClusteringService:
         
         This approach:
         1. First estimates number of clusters based on capacity
-        2. Runs K-Means to get initial clusters
-        3. Refines clusters to ensure all employees are within walking distance
+        2. Runs K-Means to get initial cluster centers
+        3. Assigns employees to centers with a min-cost flow so that no
+           cluster holds more than max_cluster_size employees
+        4. Refines clusters to ensure all employees are within walking distance
         
         Args:
             employee_coordinates: List of (lat, lng) tuples
@@ -208,19 +277,22 @@ class ClusteringService:
             n_init=10,
             max_iter=300
         )
-        labels = kmeans.fit_predict(coordinates)
+        kmeans.fit(coordinates)
         centroids = kmeans.cluster_centers_
+        labels = self._assign_with_capacity(coordinates, centroids, max_cluster_size)
         
         # Process results and validate walking distance constraint
         clusters = {}
         unclustered = []
         
+        member_centroids = centroids[labels]
+        distances_to_centroid = ellipsoidal_distance(
+            coordinates[:, 0], coordinates[:, 1],
+            member_centroids[:, 0], member_centroids[:, 1]
+        )
+        
         for idx, label in enumerate(labels):
-            centroid = centroids[label]
-            dist_to_centroid = geodesic(
-                (coordinates[idx][0], coordinates[idx][1]),
-                (centroid[0], centroid[1])
-            ).meters
+            dist_to_centroid = float(distances_to_centroid[idx])
             
             if dist_to_centroid > self.max_walking_distance:
                 # Employee too far from centroid, mark as unclustered
@@ -274,66 +346,238 @@ class ClusteringService:
             "total_clusters": len(stops)
         }
     
+    def _assign_with_capacity(
+        self,
+        coordinates: np.ndarray,
+        centers: np.ndarray,
+        capacity: int
+    ) -> np.ndarray:
+        """
+        Assign points to centers minimizing total distance with a size limit per center.
+        
+        Solved as a min-cost flow (points -> centers -> sink) with OR-Tools.
+        Each point is first offered only its nearest centers; if that sparse
+        network is infeasible the complete bipartite network is used.
+        
+        Args:
+            coordinates: Array of shape (n, 2) with [lat, lng] pairs
+            centers: Array of shape (k, 2) with [lat, lng] pairs, k * capacity >= n
+            capacity: Maximum number of points per center
+            
+        Returns:
+            Array of center indices, one per point
+        """
+        n, k = len(coordinates), len(centers)
+        if k * capacity < n:
+            raise ValueError(f"{k} centers of capacity {capacity} cannot hold {n} points")
+        
+        # Costs in decimeters keep sub-meter resolution with integer arcs
+        costs = np.rint(ellipsoidal_distance_matrix(coordinates, centers) * 10).astype(np.int64)
+        sink = n + k
+        
+        for candidates in sorted({min(k, CAPACITY_CANDIDATE_CENTERS), k}):
+            if candidates < k:
+                nearest = np.argpartition(costs, candidates - 1, axis=1)[:, :candidates]
+            else:
+                nearest = np.tile(np.arange(k), (n, 1))
+            
+            tails = np.repeat(np.arange(n), candidates)
+            heads = nearest.ravel()
+            
+            flow = min_cost_flow.SimpleMinCostFlow()
+            point_arcs = flow.add_arcs_with_capacity_and_unit_cost(
+                tails, n + heads, np.ones(len(tails), dtype=np.int64), costs[tails, heads]
+            )
+            flow.add_arcs_with_capacity_and_unit_cost(
+                n + np.arange(k), np.full(k, sink), np.full(k, capacity), np.zeros(k, dtype=np.int64)
+            )
+            supplies = np.zeros(n + k + 1, dtype=np.int64)
+            supplies[:n] = 1
+            supplies[sink] = -n
+            flow.set_nodes_supplies(np.arange(n + k + 1), supplies)
+            
+            if flow.solve() == flow.OPTIMAL:
+                used = flow.flows(point_arcs) > 0
+                labels = np.empty(n, dtype=np.int64)
+                labels[tails[used]] = heads[used]
+                return labels
+        
+        raise RuntimeError("Capacitated assignment failed")
+    
+    def _make_stop(self, cluster_id: int, employee_ids: List[int], coordinates: np.ndarray) -> Dict:
+        """Build a stop at the centroid of the given members."""
+        centroid_lat = float(np.mean(coordinates[:, 0]))
+        centroid_lng = float(np.mean(coordinates[:, 1]))
+        return {
+            "cluster_id": cluster_id,
+            "location": {
+                "lat": centroid_lat,
+                "lng": centroid_lng
+            },
+            "employee_count": len(employee_ids),
+            "employee_ids": list(employee_ids),
+            "max_distance_to_centroid": float(np.max(ellipsoidal_distance(
+                centroid_lat, centroid_lng, coordinates[:, 0], coordinates[:, 1]
+            )))
+        }
+    
+    def enforce_stop_capacity(
+        self,
+        stops: List[Dict],
+        employee_locations: Dict[int, Tuple[float, float]],
+        capacity: int
+    ) -> List[Dict]:
+        """
+        Split every stop with more employees than a vehicle can carry.
+        
+        An oversized stop of size s becomes ceil(s / capacity) stops: K-Means
+        picks the sub-stop centers and a capacitated assignment distributes
+        the members, so every resulting stop fits in the vehicle.
+        
+        Args:
+            stops: List of current stops
+            employee_locations: Employee ID -> (lat, lng)
+            capacity: Largest effective vehicle capacity
+            
+        Returns:
+            List of stops, none with employee_count above capacity
+        """
+        capacity = max(1, int(capacity))
+        if all(stop["employee_count"] <= capacity for stop in stops):
+            return stops
+        
+        next_cluster_id = max(int(stop["cluster_id"]) for stop in stops) + 1
+        result = []
+        
+        for stop in stops:
+            if stop["employee_count"] <= capacity:
+                result.append(stop)
+                continue
+            
+            member_ids = stop["employee_ids"]
+            coordinates = np.array([employee_locations[emp_id] for emp_id in member_ids], dtype=np.float64)
+            n_parts = math.ceil(len(member_ids) / capacity)
+            
+            kmeans = KMeans(n_clusters=n_parts, random_state=42, n_init=10)
+            kmeans.fit(coordinates)
+            labels = self._assign_with_capacity(coordinates, kmeans.cluster_centers_, capacity)
+            
+            first_part = True
+            for part in range(n_parts):
+                members = np.nonzero(labels == part)[0]
+                if len(members) == 0:
+                    continue
+                if first_part:
+                    cluster_id = stop["cluster_id"]
+                    first_part = False
+                else:
+                    cluster_id = next_cluster_id
+                    next_cluster_id += 1
+                result.append(self._make_stop(
+                    cluster_id,
+                    [member_ids[i] for i in members],
+                    coordinates[members]
+                ))
+            
+            logger.info(
+                f"Stop {stop['cluster_id']} with {stop['employee_count']} employees "
+                f"split into {n_parts} stops (capacity {capacity})"
+            )
+        
+        return result
+    
     def refine_clusters_for_walking_distance(
         self,
         stops: List[Dict],
-        unclustered: List[Dict]
+        unclustered: List[Dict],
+        max_stop_capacity: Optional[int] = None
     ) -> Tuple[List[Dict], List[Dict]]:
         """
         Tries to assign unclustered employees to nearby existing stops
         or creates new mini-stops for them.
         
+        Stop locations are put in a grid index with cells the size of the
+        walking distance, so each employee only checks stops in neighbouring
+        cells. The nearest stop within walking distance is chosen, skipping
+        stops that are already full when max_stop_capacity is given.
+        
         Args:
             stops: List of current stops
             unclustered: List of unclustered employees
+            max_stop_capacity: Maximum employees per stop (None for no limit)
             
         Returns:
             Tuple of (updated stops, still unclustered employees)
         """
         still_unclustered = []
         
+        stop_index = SpatialGridIndex(self.max_walking_distance)
+        stop_index.insert_many(
+            range(len(stops)),
+            [(stop["location"]["lat"], stop["location"]["lng"]) for stop in stops]
+        )
+        
         for emp in unclustered:
-            assigned = False
-            emp_loc = (emp["location"]["lat"], emp["location"]["lng"])
+            # Nearest existing stop within walking distance that has room
+            matches = [
+                (stop_idx, dist)
+                for stop_idx, dist in stop_index.query_radius(
+                    emp["location"]["lat"],
+                    emp["location"]["lng"],
+                    self.max_walking_distance
+                )
+                if max_stop_capacity is None or stops[stop_idx]["employee_count"] < max_stop_capacity
+            ]
             
-            # Try to find an existing stop within walking distance
-            for stop in stops:
-                stop_loc = (stop["location"]["lat"], stop["location"]["lng"])
-                dist = geodesic(emp_loc, stop_loc).meters
-                
-                if dist <= self.max_walking_distance:
-                    # Assign to this stop
-                    stop["employee_count"] += 1
-                    stop["employee_ids"].append(emp["employee_id"])
-                    stop["max_distance_to_centroid"] = max(
-                        stop["max_distance_to_centroid"],
-                        dist
-                    )
-                    assigned = True
-                    break
-            
-            if not assigned:
+            if matches:
+                stop_idx, dist = matches[0]
+                stop = stops[stop_idx]
+                stop["employee_count"] += 1
+                stop["employee_ids"].append(emp["employee_id"])
+                stop["max_distance_to_centroid"] = max(
+                    stop["max_distance_to_centroid"],
+                    dist
+                )
+            else:
                 still_unclustered.append(emp)
         
         # Create individual stops for remaining unclustered employees
         # (they'll have their own pickup point)
-        for idx, emp in enumerate(still_unclustered):
-            stops.append({
-                "cluster_id": 1000 + idx,  # High ID for individual stops
+        stops.extend(self.make_individual_stops(stops, still_unclustered))
+        
+        return stops, []
+    
+    def make_individual_stops(self, stops: List[Dict], employees: List[Dict]) -> List[Dict]:
+        """
+        One-employee stops for employees that could not join any stop.
+        
+        Args:
+            stops: Existing stops (their IDs are not reused)
+            employees: Unclustered employees with employee_id and location
+            
+        Returns:
+            New stops, to be appended to stops
+        """
+        # High IDs for individual stops, past any ID created by stop splitting
+        individual_base_id = max([1000] + [int(stop["cluster_id"]) + 1 for stop in stops])
+        return [
+            {
+                "cluster_id": individual_base_id + idx,
                 "location": emp["location"],
                 "employee_count": 1,
                 "employee_ids": [emp["employee_id"]],
                 "max_distance_to_centroid": 0,
                 "is_individual_stop": True
-            })
-        
-        return stops, []
+            }
+            for idx, emp in enumerate(employees)
+        ]
 
 
 def cluster_employees(
     employee_data: List[Dict],
     max_walking_distance: float = 200.0,
-    method: str = "dbscan"
+    method: str = "dbscan",
+    max_stop_capacity: Optional[int] = None
 ) -> Dict:
     """
     Main function to cluster employees into shuttle stops.
@@ -341,7 +585,9 @@ def cluster_employees(
     Args:
         employee_data: List of dicts with 'id', 'lat', 'lng' keys
         max_walking_distance: Maximum walking distance in meters
-        method: Clustering method ('dbscan' or 'kmeans')
+        method: Clustering method ('dbscan', 'dbscan_sparse' or 'kmeans')
+        max_stop_capacity: Largest effective vehicle capacity. When given,
+            no stop will hold more employees than this.
         
     Returns:
         Clustering results with stops and assignments
@@ -353,14 +599,27 @@ def cluster_employees(
     
     if method == "dbscan":
         result = service.cluster_with_dbscan(coordinates, ids)
+    elif method == "dbscan_sparse":
+        result = service.cluster_with_dbscan(coordinates, ids, sparse=True)
     else:
-        result = service.cluster_with_constrained_kmeans(coordinates, ids)
+        result = service.cluster_with_constrained_kmeans(
+            coordinates, ids, max_cluster_size=max_stop_capacity or 27
+        )
+    
+    # Split stops that no single vehicle could serve
+    if max_stop_capacity and result["stops"]:
+        result["stops"] = service.enforce_stop_capacity(
+            result["stops"],
+            dict(zip(ids, coordinates)),
+            max_stop_capacity
+        )
     
     # Refine to minimize unclustered
     if result["unclustered"]:
         result["stops"], result["unclustered"] = service.refine_clusters_for_walking_distance(
             result["stops"],
-            result["unclustered"]
+            result["unclustered"],
+            max_stop_capacity
         )
     
     return result
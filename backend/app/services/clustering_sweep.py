@@ -0,0 +1,186 @@
+"""
+Clustering Sweep - Stop counts for many walking distances from one OPTICS pass
+
+With min_samples=2, OPTICS reachability encodes every DBSCAN clustering up to
+max_eps: cutting the ordering at a given eps yields the same clusters as
+DBSCAN(eps, min_samples=2). One OPTICS run per employee set is cached, and
+each walking distance on the planner's slider is then a linear-time cut.
+
+Distances are measured in a local tangent plane (see project_to_plane), so
+pairs right at the threshold can occasionally differ from the ellipsoidal
+kernel used by cluster_employees. The sweep is meant for previews; the
+simulation itself still clusters with cluster_employees.
+"""
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from sklearn.cluster import OPTICS, cluster_optics_dbscan
+import logging
+
+from app.core.config import settings
+from app.services.clustering_cache import clustering_fingerprint
+from app.services.distance_utils import project_to_plane
+from app.services.spatial_index import SpatialGridIndex
+
+logger = logging.getLogger(__name__)
+
+# Largest walking distance the sweep can answer (SimulationCreate allows up to 2000 m)
+OPTICS_MAX_EPS = 2000.0
+
+
+class ReachabilityModel:
+    """
+    Cached OPTICS ordering for one employee set.
+    """
+
+    def __init__(self, employee_data: List[Dict]):
+        """
+        Run OPTICS on the employee set.
+
+        Args:
+            employee_data: List of dicts with 'id', 'lat', 'lng' keys
+        """
+        self.ids = [emp["id"] for emp in employee_data]
+        coordinates = np.array([(emp["lat"], emp["lng"]) for emp in employee_data], dtype=np.float64)
+        self.coordinates = coordinates.reshape(-1, 2)
+
+        if len(coordinates) < 2:
+            self.ordering = np.arange(len(coordinates))
+            self.reachability = np.full(len(coordinates), np.inf)
+            self.core_distances = np.full(len(coordinates), np.inf)
+            return
+
+        optics = OPTICS(
+            min_samples=2,
+            max_eps=OPTICS_MAX_EPS,
+            metric='euclidean',
+            cluster_method='dbscan',
+            eps=OPTICS_MAX_EPS
+        ).fit(project_to_plane(coordinates))
+        self.ordering = optics.ordering_
+        self.reachability = optics.reachability_
+        self.core_distances = optics.core_distances_
+
+    def labels(self, max_walking_distance: float) -> np.ndarray:
+        """DBSCAN(min_samples=2) labels for a walking distance; -1 is noise."""
+        if max_walking_distance > OPTICS_MAX_EPS:
+            raise ValueError(f"Walking distance {max_walking_distance} exceeds max_eps {OPTICS_MAX_EPS}")
+        if len(self.ids) < 2:
+            return np.full(len(self.ids), -1)
+        return cluster_optics_dbscan(
+            reachability=self.reachability,
+            core_distances=self.core_distances,
+            ordering=self.ordering,
+            eps=max_walking_distance
+        )
+
+    def summary(self, max_walking_distance: float, max_stop_capacity: Optional[int] = None) -> Dict:
+        """
+        Stop count and demand histogram for one walking distance.
+
+        Mirrors cluster_employees: clusters larger than max_stop_capacity are
+        counted as the ceil(size / capacity) stops enforce_stop_capacity would
+        produce, with their demand spread evenly across the parts. Employees
+        without a neighbour are then attached to the nearest cluster centroid
+        within walking distance that has room (as
+        refine_clusters_for_walking_distance does); the rest become
+        individual stops.
+        """
+        labels = self.labels(max_walking_distance)
+        clustered = labels[labels >= 0]
+        sizes = np.bincount(clustered) if len(clustered) else np.array([], dtype=np.int64)
+        cluster_labels = np.nonzero(sizes)[0]
+        sizes = sizes[cluster_labels].tolist()
+        parts = [
+            math.ceil(size / max_stop_capacity) if max_stop_capacity and size > max_stop_capacity else 1
+            for size in sizes
+        ]
+
+        # Attach noise points to cluster centroids (split clusters keep one
+        # centroid with the room of all their parts)
+        noise = np.nonzero(labels < 0)[0]
+        attached = 0
+        if len(noise) and sizes:
+            centroid_index = SpatialGridIndex(max_walking_distance)
+            centroid_index.insert_many(
+                range(len(sizes)),
+                [tuple(self.coordinates[labels == label].mean(axis=0)) for label in cluster_labels]
+            )
+            for i in noise:
+                for cluster, _ in centroid_index.query_radius(
+                    self.coordinates[i, 0], self.coordinates[i, 1], max_walking_distance
+                ):
+                    if max_stop_capacity is None or sizes[cluster] < parts[cluster] * max_stop_capacity:
+                        sizes[cluster] += 1
+                        attached += 1
+                        break
+        individual = len(noise) - attached
+
+        demand: Dict[int, int] = {}
+        for size, cluster_parts in zip(sizes, parts):
+            base, extra = divmod(size, cluster_parts)
+            for k in range(cluster_parts):
+                part_size = base + (1 if k < extra else 0)
+                demand[part_size] = demand.get(part_size, 0) + 1
+        if individual:
+            demand[1] = demand.get(1, 0) + individual
+
+        return {
+            "max_walking_distance": max_walking_distance,
+            "stop_count": sum(demand.values()),
+            "clustered_employees": int(len(clustered)) + attached,
+            "individual_stops": individual,
+            "split_stops": sum(1 for cluster_parts in parts if cluster_parts > 1),
+            "demand_histogram": [
+                {"employee_count": size, "stops": count}
+                for size, count in sorted(demand.items())
+            ]
+        }
+
+
+# OPTICS models per employee-set fingerprint, least recently used first
+_models: "OrderedDict[str, ReachabilityModel]" = OrderedDict()
+_models_lock = threading.Lock()
+
+
+def get_reachability_model(employee_data: List[Dict]) -> ReachabilityModel:
+    """Return the cached OPTICS model for an employee set, building it if needed."""
+    key = clustering_fingerprint(employee_data, OPTICS_MAX_EPS, "optics")
+
+    with _models_lock:
+        model = _models.get(key)
+        if model is not None:
+            _models.move_to_end(key)
+            return model
+
+    logger.info(f"Building OPTICS reachability for {len(employee_data)} employees...")
+    model = ReachabilityModel(employee_data)
+
+    with _models_lock:
+        _models[key] = model
+        while len(_models) > settings.optics_cache_max_entries:
+            _models.popitem(last=False)
+    return model
+
+
+def sweep_walking_distances(
+    employee_data: List[Dict],
+    walking_distances: List[float],
+    max_stop_capacity: Optional[int] = None
+) -> List[Dict]:
+    """
+    Summarize the clustering for several walking distances at once.
+
+    Args:
+        employee_data: List of dicts with 'id', 'lat', 'lng' keys
+        walking_distances: Walking distances in meters (each <= OPTICS_MAX_EPS)
+        max_stop_capacity: Largest effective vehicle capacity
+
+    Returns:
+        One summary per walking distance, in the given order
+    """
+    model = get_reachability_model(employee_data)
+    return [model.summary(distance, max_stop_capacity) for distance in walking_distances]
@@ -0,0 +1,593 @@
+"""
+Decomposition Solver - Partitioned CVRP for large instances
+
+A single OR-Tools model degrades quickly past a few hundred stops within the
+solver time limit. In decomposition mode the stops are split into partitions
+of about settings.solver_partition_size stops:
+
+- sweep: angular sectors around the depot, cut where the sectors carry equal demand
+- cluster: capacity-balanced geographic groups (recursive bisection along
+  the wider axis at the demand median)
+
+Each partition is solved as its own CVRP in the worker pool with its demand
+share of the requested fleet. Partitions that find no solution or exceed the
+route time limit are re-solved once with the requested vehicles the others
+left unused, split by demand, plus a share of the caller's optional pool;
+the re-solve is kept when its objective is lower. Vehicles count as optional
+only past the requested number of their type across all partitions.
+
+The stitched solution is then improved across partition borders: neighbouring
+routes from different partitions are re-solved pairwise and the result is
+kept when it uses fewer vehicles, exceeds the route time limit less, or
+drives less.
+
+solve_routes picks between this and the single-model portfolio solve
+(settings.solver_mode, 'auto' switches at settings.solver_decomposition_threshold).
+"""
+import asyncio
+import math
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.workers import attach_shared_array, process_pool_size, run_in_process, shared_arrays
+from app.services.optimization_service import (
+    DEFAULT_SEARCH_STRATEGY,
+    Matrix,
+    effective_capacity,
+    format_solution,
+    solve_cvrp,
+    vehicle_lower_bound,
+)
+from app.services.portfolio_solver import create_optimized_routes_portfolio
+
+logger = logging.getLogger(__name__)
+
+# Shares of the time limit spent on re-solving partitions with the spare
+# requested fleet and on the inter-partition improvement pass (which also
+# gets the repair share when no partition needs it)
+_REPAIR_TIME_SHARE = 0.2
+_IMPROVEMENT_TIME_SHARE = 0.2
+
+# Meters per degree for the local projection around the depot
+_METERS_PER_DEGREE_LAT = 110574.0
+_METERS_PER_DEGREE_LNG_EQUATOR = 111320.0
+
+
+def _project(stops: List[Dict], depot_location: Tuple[float, float]) -> np.ndarray:
+    """Stop locations as [x, y] meters relative to the depot."""
+    depot_lat, depot_lng = depot_location
+    lng_scale = _METERS_PER_DEGREE_LNG_EQUATOR * math.cos(math.radians(depot_lat))
+    return np.array([
+        (
+            (stop["location"]["lng"] - depot_lng) * lng_scale,
+            (stop["location"]["lat"] - depot_lat) * _METERS_PER_DEGREE_LAT
+        )
+        for stop in stops
+    ], dtype=np.float64).reshape(-1, 2)
+
+
+def _split_by_demand(order: np.ndarray, demands: np.ndarray, parts: int) -> List[np.ndarray]:
+    """Cut an ordered index array into `parts` contiguous runs of about equal demand."""
+    cumulative = np.cumsum(demands[order])
+    targets = cumulative[-1] * np.arange(1, parts) / parts
+    cuts = np.searchsorted(cumulative, targets, side="right")
+    # Keep every run non-empty
+    cuts = np.clip(cuts, np.arange(1, parts), len(order) - np.arange(parts - 1, 0, -1))
+    cuts = np.maximum.accumulate(cuts)
+    return [run for run in np.split(order, cuts) if len(run)]
+
+
+def partition_stops(
+    stops: List[Dict],
+    depot_location: Tuple[float, float],
+    partition_size: int,
+    method: str = "sweep"
+) -> List[List[int]]:
+    """
+    Split stops into demand-balanced geographic partitions.
+
+    Args:
+        stops: Stop dictionaries with location and employee_count
+        depot_location: (lat, lng) of the depot
+        partition_size: Target stops per partition (cuts balance demand, so
+            partitions may be somewhat larger)
+        method: 'sweep' (angular sectors around the depot) or 'cluster'
+            (recursive bisection at the demand median)
+
+    Returns:
+        Lists of stop indices (into stops), one per partition
+    """
+    if method not in ("sweep", "cluster"):
+        raise ValueError(f"Unknown partition method: {method}")
+    count = len(stops)
+    parts = max(1, math.ceil(count / max(1, partition_size)))
+    if parts == 1:
+        return [list(range(count))]
+
+    points = _project(stops, depot_location)
+    # Zero-passenger stops still have to be visited; give them a small weight
+    demands = np.array([max(stop["employee_count"], 1) for stop in stops], dtype=np.float64)
+
+    if method == "cluster":
+        groups = [(np.arange(count), parts)]
+        partitions = []
+        while groups:
+            members, group_parts = groups.pop()
+            if group_parts == 1 or len(members) <= 1:
+                partitions.append(members)
+                continue
+            extent = points[members].max(axis=0) - points[members].min(axis=0)
+            axis = int(np.argmax(extent))
+            order = members[np.argsort(points[members, axis], kind="stable")]
+            left_parts = group_parts // 2
+            cumulative = np.cumsum(demands[order])
+            cut = int(np.searchsorted(cumulative, cumulative[-1] * left_parts / group_parts, side="right"))
+            cut = min(max(cut, 1), len(order) - 1)
+            groups.append((order[:cut], left_parts))
+            groups.append((order[cut:], group_parts - left_parts))
+    else:
+        angles = np.arctan2(points[:, 1], points[:, 0])
+        order = np.argsort(angles, kind="stable")
+        # Start the sweep after the widest empty sector so no partition straddles it
+        sorted_angles = angles[order]
+        gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+        order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+        partitions = _split_by_demand(order, demands, parts)
+
+    return [sorted(int(index) for index in partition) for partition in partitions]
+
+
+def _share(total: int, weights: List[float]) -> List[int]:
+    """Split an integer total proportionally to weights (largest remainder)."""
+    weight_sum = sum(weights)
+    if total <= 0 or weight_sum <= 0:
+        return [0] * len(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    shares = [int(value) for value in exact]
+    remainders = sorted(range(len(weights)), key=lambda i: exact[i] - shares[i], reverse=True)
+    for i in remainders[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def _vehicles_used(result: Dict) -> Tuple[int, int]:
+    """(16-seaters, 27-seaters) with a non-empty route in a solve_cvrp result."""
+    used_16 = used_27 = 0
+    for vehicle_id, nodes in enumerate(result["routes"]):
+        if len(nodes) <= 2:
+            continue
+        if result["vehicle_types"][vehicle_id] == "16-seater":
+            used_16 += 1
+        else:
+            used_27 += 1
+    return used_16, used_27
+
+
+def _relabel_optional(routes: List[Dict], num_16_seaters: int, num_27_seaters: int):
+    """Flag routes optional only past the requested count of their vehicle type."""
+    remaining = {"16-seater": num_16_seaters, "27-seater": num_27_seaters}
+    # Routes already on requested vehicles claim the requested slots first
+    for route in sorted(routes, key=lambda route: route["optional"]):
+        route["optional"] = remaining[route["vehicle_type"]] <= 0
+        remaining[route["vehicle_type"]] -= 1
+
+
+def _attach_submatrices(
+    distance_ref: Dict,
+    duration_ref: Optional[Dict],
+    nodes: List[int]
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Copy the rows/columns of `nodes` out of the shared matrices."""
+    selector = np.ix_(nodes, nodes)
+    distance_block, distance_matrix = attach_shared_array(distance_ref)
+    duration_block, duration_matrix = attach_shared_array(duration_ref)
+    try:
+        distances = distance_matrix[selector]
+        durations = None if duration_matrix is None else duration_matrix[selector]
+    finally:
+        del distance_matrix, duration_matrix
+        for block in (distance_block, duration_block):
+            if block is not None:
+                block.close()
+    return distances, durations
+
+
+def _solve_subproblem(
+    distance_ref: Dict,
+    duration_ref: Optional[Dict],
+    nodes: List[int],
+    demands: List[int],
+    **kwargs
+) -> Dict:
+    """
+    Worker entry point: solve the CVRP over `nodes` (node 0 = depot first).
+
+    Returns the solve_cvrp result with routes and infeasible stops given as
+    node indices of the full matrix.
+    """
+    distances, durations = _attach_submatrices(distance_ref, duration_ref, nodes)
+    solution = solve_cvrp(
+        distance_matrix=distances,
+        demands=[demands[node] for node in nodes],
+        duration_matrix=durations,
+        **kwargs
+    )
+    solution["routes"] = [[nodes[local] for local in route] for route in solution["routes"]]
+    infeasibility = solution.get("infeasibility")
+    if infeasibility and "stops" in infeasibility:
+        infeasibility["stops"] = [nodes[local] for local in infeasibility["stops"]]
+    return solution
+
+
+class _RouteMetrics:
+    """Distance and time-limit overrun of routes on the full matrices."""
+
+    def __init__(self, distance_matrix: np.ndarray, duration_matrix: Optional[np.ndarray], max_route_duration: int):
+        self.distance_matrix = distance_matrix
+        self.duration_matrix = duration_matrix
+        self.max_route_duration = max_route_duration
+
+    def overruns(self, result: Dict) -> bool:
+        """Whether any route of a solve_cvrp result exceeds the route time limit."""
+        routes = [{"nodes": nodes, "optional": False} for nodes in result["routes"]]
+        return self.cost(routes)[2] > 0
+
+    def cost(self, routes: List[Dict]) -> Tuple[int, int, float, float]:
+        """(optional vehicles, vehicles, seconds over the time limit, distance); lower is better."""
+        optional = vehicles = 0
+        overrun = distance = 0.0
+        for route in routes:
+            nodes = route["nodes"]
+            if len(nodes) <= 2:
+                continue
+            vehicles += 1
+            optional += int(route["optional"])
+            distance += float(self.distance_matrix[nodes[:-1], nodes[1:]].sum())
+            if self.duration_matrix is not None:
+                duration = float(self.duration_matrix[nodes[:-1], nodes[1:]].sum())
+                overrun += max(0.0, duration - self.max_route_duration)
+        return optional, vehicles, overrun, distance
+
+
+def _route_pairs(routes: List[Dict], points: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Pair each route with the nearest unpaired route of another partition.
+
+    Distance between routes is measured between their stop centroids, closest
+    pairs first; every route appears in at most one pair.
+    """
+    centroids = np.array([points[[node - 1 for node in route["nodes"][1:-1]]].mean(axis=0) for route in routes])
+    gaps = np.linalg.norm(centroids[:, None, :] - centroids[None, :, :], axis=2)
+    candidates = sorted(
+        (gaps[i, j], i, j)
+        for i in range(len(routes)) for j in range(i + 1, len(routes))
+        if routes[i]["partition"] != routes[j]["partition"]
+    )
+    paired = set()
+    pairs = []
+    for _, i, j in candidates:
+        if i in paired or j in paired:
+            continue
+        paired.update((i, j))
+        pairs.append((i, j))
+    return pairs
+
+
+async def create_optimized_routes_decomposed(
+    stops: List[Dict],
+    depot_location: Tuple[float, float],
+    distance_matrix: Matrix,
+    duration_matrix: Optional[Matrix] = None,
+    num_16_seaters: int = 5,
+    num_27_seaters: int = 5,
+    time_limit_seconds: int = 30,
+    vehicle_priority: str = "auto",
+    max_route_duration: int = 3900,
+    buffer_seats: int = 0,
+    optional_16_seaters: int = 0,
+    optional_27_seaters: int = 0,
+    method: Optional[str] = None,
+    partition_size: Optional[int] = None,
+    **kwargs
+) -> Dict:
+    """
+    Solve a large CVRP by partitioning, parallel sub-solves and a border improvement pass.
+
+    Args:
+        stops, depot_location, distance_matrix, duration_matrix, num_16_seaters,
+            num_27_seaters, time_limit_seconds, vehicle_priority, max_route_duration,
+            buffer_seats, optional_16_seaters, optional_27_seaters: As for
+            create_optimized_routes; the optional pool is shared by the
+            partitions that need more than the requested fleet
+        method: 'sweep' or 'cluster' (default: settings.solver_partition_method)
+        partition_size: Target stops per partition (default: settings.solver_partition_size)
+        **kwargs: Ignored portfolio arguments (search_strategy, size)
+
+    Returns:
+        create_optimized_routes-style result with a 'decomposition' summary
+    """
+    method = method or settings.solver_partition_method
+    partition_size = partition_size or settings.solver_partition_size
+    distance_array = np.asarray(distance_matrix, dtype=np.float64)
+    duration_array = None if duration_matrix is None else np.asarray(duration_matrix, dtype=np.float64)
+    demands = [0] + [stop["employee_count"] for stop in stops]
+
+    partitions = partition_stops(stops, depot_location, partition_size, method)
+    workers = process_pool_size()
+    rounds = math.ceil(len(partitions) / workers)
+    partition_time_limit = max(
+        1, int(time_limit_seconds * (1 - _REPAIR_TIME_SHARE - _IMPROVEMENT_TIME_SHARE) / rounds)
+    )
+    logger.info(
+        f"Decomposition solve: {len(stops)} stops in {len(partitions)} {method} partitions, "
+        f"{partition_time_limit}s each"
+    )
+
+    # Requested fleet split by demand share
+    partition_demands = [sum(demands[index + 1] for index in partition) for partition in partitions]
+    fleets = [
+        {"num_16_seaters": share_16, "num_27_seaters": share_27}
+        for share_16, share_27 in zip(
+            _share(num_16_seaters, partition_demands), _share(num_27_seaters, partition_demands)
+        )
+    ]
+
+    common = {
+        "vehicle_priority": vehicle_priority,
+        "max_route_duration": max_route_duration,
+        "buffer_seats": buffer_seats
+    }
+    points = _project(stops, depot_location)
+    metrics = _RouteMetrics(distance_array, duration_array, max_route_duration)
+    partition_nodes = [[0] + [index + 1 for index in partition] for partition in partitions]
+
+    with shared_arrays(distance=distance_array, duration=duration_array) as refs:
+        results = await asyncio.gather(*[
+            run_in_process(
+                _solve_subproblem,
+                refs["distance"],
+                refs["duration"],
+                nodes,
+                demands,
+                time_limit_seconds=partition_time_limit,
+                **fleet,
+                **common
+            )
+            for nodes, fleet in zip(partition_nodes, fleets)
+        ])
+
+        # Repair: partitions that failed or overran their time limit get the
+        # requested vehicles the other partitions left unused, then the optional pool
+        failing = [
+            partition_id for partition_id, result in enumerate(results)
+            if result["status"] == "NO_SOLUTION" or metrics.overruns(result)
+        ]
+        repaired = []
+        if failing:
+            spare_16, spare_27 = num_16_seaters, num_27_seaters
+            for partition_id, result in enumerate(results):
+                if partition_id not in failing:
+                    used_16, used_27 = _vehicles_used(result)
+                    spare_16 -= used_16
+                    spare_27 -= used_27
+            failing_demands = [partition_demands[partition_id] for partition_id in failing]
+            repair_fleets = [
+                {
+                    "num_16_seaters": share_16,
+                    "num_27_seaters": share_27,
+                    "optional_16_seaters": optional_16,
+                    "optional_27_seaters": optional_27
+                }
+                for share_16, share_27, optional_16, optional_27 in zip(
+                    _share(max(0, spare_16), failing_demands),
+                    _share(max(0, spare_27), failing_demands),
+                    _share(optional_16_seaters, failing_demands),
+                    _share(optional_27_seaters, failing_demands)
+                )
+            ]
+            repair_time_limit = max(
+                1, int(time_limit_seconds * _REPAIR_TIME_SHARE / math.ceil(len(failing) / workers))
+            )
+            logger.info(
+                f"Decomposition repair: {len(failing)} partitions re-solved with "
+                f"{max(0, spare_16)}+{max(0, spare_27)} spare requested vehicles, {repair_time_limit}s each"
+            )
+            repair_results = await asyncio.gather(*[
+                run_in_process(
+                    _solve_subproblem,
+                    refs["distance"],
+                    refs["duration"],
+                    partition_nodes[partition_id],
+                    demands,
+                    time_limit_seconds=repair_time_limit,
+                    **fleet,
+                    **common
+                )
+                for partition_id, fleet in zip(failing, repair_fleets)
+            ])
+            for partition_id, result in zip(failing, repair_results):
+                if result["status"] == "NO_SOLUTION":
+                    continue
+                previous = results[partition_id]
+                if previous["status"] == "NO_SOLUTION" or result["objective"] < previous["objective"]:
+                    results[partition_id] = result
+                    repaired.append(partition_id)
+
+        failed = next((result for result in results if result["status"] == "NO_SOLUTION"), None)
+        if failed is not None:
+            logger.error(f"Decomposition partition has no solution: {failed['infeasibility']}")
+            return format_solution(failed, stops, depot_location)
+
+        # Stitch partition routes into one route list
+        routes = []
+        for partition_id, result in enumerate(results):
+            for vehicle_id, nodes in enumerate(result["routes"]):
+                if len(nodes) <= 2:
+                    continue
+                routes.append({
+                    "nodes": nodes,
+                    "partition": partition_id,
+                    "vehicle_type": result["vehicle_types"][vehicle_id],
+                    "vehicle_capacity": result["vehicle_capacities"][vehicle_id],
+                    "optional": result["vehicle_optional"][vehicle_id],
+                    "distance": result["distances"][vehicle_id],
+                    "load": result["loads"][vehicle_id]
+                })
+        _relabel_optional(routes, num_16_seaters, num_27_seaters)
+
+        # Improvement pass: re-solve pairs of neighbouring routes from different partitions
+        pairs = _route_pairs(routes, points) if len(partitions) > 1 else []
+        improved = 0
+        before = metrics.cost(routes)
+        if pairs:
+            # Closest pairs first, as many as fit in the improvement share of the time limit
+            improvement_budget = time_limit_seconds * (
+                _IMPROVEMENT_TIME_SHARE + (0 if failing else _REPAIR_TIME_SHARE)
+            )
+            pair_time_limit = max(1, int(improvement_budget / math.ceil(len(pairs) / workers)))
+            pairs = pairs[:max(1, int(improvement_budget // pair_time_limit)) * workers]
+            pair_results = await asyncio.gather(*[
+                run_in_process(
+                    _solve_subproblem,
+                    refs["distance"],
+                    refs["duration"],
+                    [0] + routes[i]["nodes"][1:-1] + routes[j]["nodes"][1:-1],
+                    demands,
+                    time_limit_seconds=pair_time_limit,
+                    **_pair_fleet(routes[i], routes[j]),
+                    **common
+                )
+                for i, j in pairs
+            ], return_exceptions=True)
+
+            for (i, j), result in zip(pairs, pair_results):
+                if isinstance(result, BaseException):
+                    logger.warning(f"Decomposition improvement of routes {i}, {j} failed: {result}")
+                    continue
+                if result["status"] == "NO_SOLUTION":
+                    continue
+                replacement = [
+                    {
+                        "nodes": nodes,
+                        "partition": routes[i]["partition"],
+                        "vehicle_type": result["vehicle_types"][vehicle_id],
+                        "vehicle_capacity": result["vehicle_capacities"][vehicle_id],
+                        "optional": result["vehicle_optional"][vehicle_id],
+                        "distance": result["distances"][vehicle_id],
+                        "load": result["loads"][vehicle_id]
+                    }
+                    for vehicle_id, nodes in enumerate(result["routes"])
+                    if len(nodes) > 2
+                ]
+                if metrics.cost(replacement) < metrics.cost([routes[i], routes[j]]):
+                    routes[i], routes[j] = replacement + [None] * (2 - len(replacement))
+                    improved += 1
+            routes = [route for route in routes if route is not None]
+            _relabel_optional(routes, num_16_seaters, num_27_seaters)
+    after = metrics.cost(routes)
+
+    logger.info(
+        f"Decomposition improvement: {improved}/{len(pairs)} route pairs improved, "
+        f"vehicles {before[1]} -> {after[1]}, distance {before[3]:.0f} -> {after[3]:.0f}m"
+    )
+
+    # Bound over the same fleet the portfolio solve sees (requested plus optional pool)
+    capacities = (
+        [effective_capacity(27, buffer_seats)] * (num_27_seaters + optional_27_seaters)
+        + [effective_capacity(16, buffer_seats)] * (num_16_seaters + optional_16_seaters)
+    )
+    solution = {
+        "routes": [route["nodes"] for route in routes],
+        "distances": [route["distance"] for route in routes],
+        "loads": [route["load"] for route in routes],
+        "total_distance": sum(route["distance"] for route in routes),
+        "vehicles_used": len(routes),
+        "objective": None,
+        "search_strategy": DEFAULT_SEARCH_STRATEGY,
+        "convergence": None,
+        "vehicle_lower_bound": vehicle_lower_bound(demands, capacities),
+        "infeasibility": None,
+        "vehicle_types": [route["vehicle_type"] for route in routes],
+        "vehicle_capacities": [route["vehicle_capacity"] for route in routes],
+        "vehicle_optional": [route["optional"] for route in routes],
+        "status": "FEASIBLE"
+    }
+    result = format_solution(solution, stops, depot_location)
+    result["decomposition"] = {
+        "method": method,
+        "partitions": [
+            {
+                "stops": len(partition),
+                "passengers": partition_demand,
+                "vehicles_used": partition_result["vehicles_used"],
+                "objective": partition_result["objective"],
+                "stopped_early": (partition_result.get("convergence") or {}).get("stopped_early"),
+                "repaired": partition_id in repaired
+            }
+            for partition_id, (partition, partition_demand, partition_result)
+            in enumerate(zip(partitions, partition_demands, results))
+        ],
+        "partitions_repaired": len(repaired),
+        "route_pairs_tried": len(pairs),
+        "route_pairs_improved": improved,
+        "vehicles_saved": before[1] - after[1],
+        "distance_saved": round(before[3] - after[3], 1)
+    }
+    return result
+
+
+def _pair_fleet(first: Dict, second: Dict) -> Dict:
+    """solve_cvrp fleet arguments for re-solving two routes with their own vehicles."""
+    fleet = {"num_16_seaters": 0, "num_27_seaters": 0, "optional_16_seaters": 0, "optional_27_seaters": 0}
+    for route in (first, second):
+        seats = "16" if route["vehicle_type"] == "16-seater" else "27"
+        prefix = "optional" if route["optional"] else "num"
+        fleet[f"{prefix}_{seats}_seaters"] += 1
+    return fleet
+
+
+async def solve_routes(
+    stops: List[Dict],
+    depot_location: Tuple[float, float],
+    distance_matrix: Matrix,
+    duration_matrix: Optional[Matrix] = None,
+    solver_mode: Optional[str] = None,
+    **kwargs
+) -> Dict:
+    """
+    Solve the CVRP with the configured solver mode.
+
+    Args:
+        stops, depot_location, distance_matrix, duration_matrix: As for
+            create_optimized_routes
+        solver_mode: 'portfolio' (single model), 'decomposition' (partitioned) or
+            'auto' (decomposition above settings.solver_decomposition_threshold stops);
+            default settings.solver_mode
+        **kwargs: Remaining create_optimized_routes arguments
+
+    Returns:
+        create_optimized_routes-style result
+    """
+    solver_mode = solver_mode or settings.solver_mode
+    if solver_mode not in ("portfolio", "decomposition", "auto"):
+        raise ValueError(f"Unknown solver mode: {solver_mode}")
+    if solver_mode == "decomposition" or (
+        solver_mode != "portfolio" and len(stops) > settings.solver_decomposition_threshold
+    ):
+        return await create_optimized_routes_decomposed(
+            stops=stops,
+            depot_location=depot_location,
+            distance_matrix=distance_matrix,
+            duration_matrix=duration_matrix,
+            **kwargs
+        )
+    return await create_optimized_routes_portfolio(
+        stops=stops,
+        depot_location=depot_location,
+        distance_matrix=distance_matrix,
+        duration_matrix=duration_matrix,
+        **kwargs
+    )
@@ -0,0 +1,434 @@
+"""
+Incremental Clustering - Keeps DBSCAN stops up to date as employees change
+
+With min_samples=2 every clustered employee is a DBSCAN core point, so the
+clusters are exactly the connected components of the graph that links
+employees within max_walking_distance of each other. This module keeps those
+components per shift and patches them when employees are inserted, moved or
+deleted:
+
+- Insert: the new employee merges the components found in its ε-neighbourhood
+- Delete: only the component that lost an employee is re-split
+- Move: a delete followed by an insert
+
+Stops are kept per component as well: capacity splitting runs again only
+for components that changed, and leftover single employees are re-attached
+only where the stops they could join changed. The work per update is
+proportional to the size of the touched components, not to the shift's
+headcount. The result has the same shape as cluster_employees(method="dbscan").
+"""
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy.sparse.csgraph import connected_components
+import logging
+
+from app.core.config import settings
+from app.services.clustering_service import ClusteringService
+from app.services.spatial_index import SpatialGridIndex
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalClusterer:
+    """
+    Connected components of the walking-distance graph for one employee set.
+    """
+
+    def __init__(self, max_walking_distance: float):
+        """
+        Initialize an empty clusterer.
+
+        Args:
+            max_walking_distance: Maximum walking distance in meters (DBSCAN eps)
+        """
+        self.max_walking_distance = max_walking_distance
+        self.service = ClusteringService(max_walking_distance)
+        self.index = SpatialGridIndex(max_walking_distance)
+        self.component_of: Dict[int, int] = {}
+        self.members: Dict[int, Set[int]] = {}
+        self._next_component = 0
+        self.built = False
+        # Serializes build/update/result of this employee set
+        self.lock = threading.Lock()
+        # Components changed since the last result()
+        self._dirty: Set[int] = set()
+        self._reset_stops(None)
+
+    def _reset_stops(self, capacity: Optional[int]):
+        """Forget all stops; the next result() recomputes every component."""
+        self._capacity = capacity
+        # Capacity-split stops of each multi-employee component; a part is
+        # keyed (component, part number)
+        self._parts: Dict[int, List[Dict]] = {}
+        self._part_index = SpatialGridIndex(self.max_walking_distance)
+        # Single-employee components: parts within walking distance (nearest
+        # first), the reverse map, and the employees each part picked up
+        self._candidates: Dict[int, List[Tuple[Tuple[int, int], float]]] = {}
+        self._considered_by: Dict[Tuple[int, int], Set[int]] = {}
+        self._attached: Dict[Tuple[int, int], List[Tuple[int, float]]] = {}
+        self._dirty = set(self.members)
+
+    def _new_component(self, member_ids) -> int:
+        component = self._next_component
+        self._next_component += 1
+        self.members[component] = set(member_ids)
+        for emp_id in member_ids:
+            self.component_of[emp_id] = component
+        self._dirty.add(component)
+        return component
+
+    def _drop_component(self, component: int):
+        self.members.pop(component, None)
+        self._dirty.add(component)
+
+    def build(self, employee_data: List[Dict]):
+        """
+        Cluster a full employee set from scratch.
+
+        Uses the sparse neighborhood graph and scipy's connected components,
+        which matches DBSCAN(min_samples=2) exactly.
+        """
+        self.index = SpatialGridIndex(self.max_walking_distance)
+        self.component_of = {}
+        self.members = {}
+        self._reset_stops(None)
+        self.built = True
+        if not employee_data:
+            return
+
+        ids = [emp["id"] for emp in employee_data]
+        coordinates = np.array([(emp["lat"], emp["lng"]) for emp in employee_data], dtype=np.float64)
+        graph = self.service._calculate_neighborhood_graph(coordinates)
+        _, labels = connected_components(graph, directed=False)
+
+        groups: Dict[int, List[int]] = {}
+        for emp_id, label in zip(ids, labels):
+            groups.setdefault(int(label), []).append(emp_id)
+        for member_ids in groups.values():
+            self._new_component(member_ids)
+
+        self.index.insert_many(ids, coordinates)
+
+    def _neighbours(self, emp_id: int) -> List[int]:
+        lat, lng = self.index.location(emp_id)
+        return [
+            key for key, _ in self.index.query_radius(lat, lng, self.max_walking_distance)
+            if key != emp_id
+        ]
+
+    def _delete(self, emp_id: int) -> Optional[int]:
+        """Remove an employee; returns the component that needs re-splitting."""
+        component = self.component_of.pop(emp_id, None)
+        self.index.remove(emp_id)
+        if component is None:
+            return None
+        self.members[component].discard(emp_id)
+        self._dirty.add(component)
+        if not self.members[component]:
+            self._drop_component(component)
+            return None
+        return component
+
+    def _resplit(self, component: int):
+        """Recompute connectivity inside one component after deletions."""
+        remaining = set(self.members.get(component, ()))
+        if len(remaining) <= 1:
+            return
+
+        parts: List[Set[int]] = []
+        while remaining:
+            seed = remaining.pop()
+            part = {seed}
+            queue = deque([seed])
+            while queue:
+                current = queue.popleft()
+                for neighbour in self._neighbours(current):
+                    if neighbour in remaining:
+                        remaining.discard(neighbour)
+                        part.add(neighbour)
+                        queue.append(neighbour)
+            parts.append(part)
+
+        if len(parts) == 1:
+            return
+
+        # Largest part keeps the component id, the rest get new ones
+        parts.sort(key=len, reverse=True)
+        self.members[component] = parts[0]
+        self._dirty.add(component)
+        for part in parts[1:]:
+            self._new_component(part)
+
+    def _insert(self, emp_id: int, lat: float, lng: float) -> int:
+        """Add an employee and merge the components it connects."""
+        self.index.insert(emp_id, lat, lng)
+        touched = {self.component_of[n] for n in self._neighbours(emp_id) if n in self.component_of}
+
+        if not touched:
+            return self._new_component([emp_id])
+
+        # Relabel the smaller components into the largest one
+        target = max(touched, key=lambda c: len(self.members[c]))
+        for component in touched - {target}:
+            for member in self.members[component]:
+                self.component_of[member] = target
+            self.members[target] |= self.members[component]
+            self._drop_component(component)
+
+        self.members[target].add(emp_id)
+        self.component_of[emp_id] = target
+        self._dirty.add(target)
+        return target
+
+    def update(self, employee_data: List[Dict]) -> Dict:
+        """
+        Patch the clustering to match a new employee set.
+
+        Args:
+            employee_data: Full current list of dicts with 'id', 'lat', 'lng' keys
+
+        Returns:
+            Counts of inserted, moved and deleted employees
+        """
+        current = {emp["id"]: (float(emp["lat"]), float(emp["lng"])) for emp in employee_data}
+
+        deleted = [emp_id for emp_id in self.component_of if emp_id not in current]
+        inserted = [emp_id for emp_id in current if emp_id not in self.component_of]
+        moved = [
+            emp_id for emp_id, location in current.items()
+            if emp_id in self.component_of and self.index.location(emp_id) != location
+        ]
+
+        # Deletions first, then re-split each touched component once
+        to_resplit = set()
+        for emp_id in deleted + moved:
+            component = self._delete(emp_id)
+            if component is not None:
+                to_resplit.add(component)
+        for component in to_resplit:
+            if component in self.members:
+                self._resplit(component)
+
+        for emp_id in moved + inserted:
+            self._insert(emp_id, *current[emp_id])
+
+        return {
+            "inserted": len(inserted),
+            "moved": len(moved),
+            "deleted": len(deleted)
+        }
+
+    def _split(self, component: int) -> List[Dict]:
+        """Stop(s) of one component, split to the vehicle capacity."""
+        member_ids = sorted(self.members[component])
+        coordinates = np.array([self.index.location(emp_id) for emp_id in member_ids])
+        stop = self.service._make_stop(component, member_ids, coordinates)
+        if not self._capacity:
+            return [stop]
+        return self.service.enforce_stop_capacity(
+            [stop],
+            dict(zip(member_ids, map(tuple, coordinates))),
+            self._capacity
+        )
+
+    def _refresh_stops(self):
+        """
+        Bring parts and attachments up to date with the dirty components.
+
+        Mirrors refine_clusters_for_walking_distance: single employees, in
+        employee ID order, join the nearest part within walking distance that
+        has room. Employees competing for the same parts are re-run together,
+        so the outcome equals a full pass.
+        """
+        dirty, self._dirty = self._dirty, set()
+        eps = self.max_walking_distance
+        affected_parts: Set[Tuple[int, int]] = set()
+        # Changed components may have been (or become) single employees
+        dirty_singles: Set[int] = set(dirty)
+
+        for component in dirty:
+            # Old parts go, along with what they picked up
+            for part in range(len(self._parts.pop(component, []))):
+                key = (component, part)
+                self._part_index.remove(key)
+                self._attached.pop(key, None)
+                dirty_singles |= self._considered_by.pop(key, set())
+
+            members = self.members.get(component)
+            if not members or len(members) == 1:
+                continue
+
+            self._parts[component] = self._split(component)
+            for part, stop in enumerate(self._parts[component]):
+                key = (component, part)
+                lat, lng = stop["location"]["lat"], stop["location"]["lng"]
+                self._part_index.insert(key, lat, lng)
+                self._considered_by[key] = set()
+                affected_parts.add(key)
+                # Single employees that can now walk to this part
+                for emp_id, _ in self.index.query_radius(lat, lng, eps):
+                    neighbour = self.component_of[emp_id]
+                    if len(self.members[neighbour]) == 1:
+                        dirty_singles.add(neighbour)
+
+        # New candidate parts for the changed single employees
+        for component in dirty_singles:
+            for key, _ in self._candidates.pop(component, []):
+                affected_parts.add(key)
+                if key in self._considered_by:
+                    self._considered_by[key].discard(component)
+            members = self.members.get(component)
+            if not members or len(members) != 1:
+                continue
+            lat, lng = self.index.location(next(iter(members)))
+            candidates = self._part_index.query_radius(lat, lng, eps)
+            self._candidates[component] = candidates
+            for key, _ in candidates:
+                self._considered_by[key].add(component)
+                affected_parts.add(key)
+
+        # Everyone competing for an affected part is re-run with it
+        queue = list(affected_parts)
+        while queue:
+            key = queue.pop()
+            for component in self._considered_by.get(key, ()):
+                if component in dirty_singles:
+                    continue
+                dirty_singles.add(component)
+                for other, _ in self._candidates[component]:
+                    if other not in affected_parts:
+                        affected_parts.add(other)
+                        queue.append(other)
+
+        for key in affected_parts:
+            self._attached.pop(key, None)
+        singles = sorted(
+            (next(iter(self.members[component])), component)
+            for component in dirty_singles if component in self._candidates
+        )
+        for emp_id, component in singles:
+            for key, dist in self._candidates[component]:
+                attached = self._attached.setdefault(key, [])
+                count = self._parts[key[0]][key[1]]["employee_count"] + len(attached)
+                if self._capacity is None or count < self._capacity:
+                    attached.append((emp_id, dist))
+                    break
+
+    def result(self, max_stop_capacity: Optional[int] = None) -> Dict:
+        """
+        Build a cluster_employees-shaped result from the current components.
+
+        Only components changed since the previous call are split and
+        refined again. Cached stops are copied, since callers mutate stops
+        in place.
+        """
+        capacity = max_stop_capacity or None
+        if capacity != self._capacity:
+            self._reset_stops(capacity)
+        self._refresh_stops()
+
+        clusters = {}
+        stops = []
+        placed = set()
+        next_cluster_id = self._next_component
+
+        for component in sorted(self._parts):
+            for part, cached in enumerate(self._parts[component]):
+                stop = dict(cached)
+                stop["location"] = dict(cached["location"])
+                stop["employee_ids"] = list(cached["employee_ids"])
+                if part:
+                    # Extra parts get IDs past every component
+                    stop["cluster_id"] = next_cluster_id
+                    next_cluster_id += 1
+                for emp_id, dist in self._attached.get((component, part), ()):
+                    stop["employee_count"] += 1
+                    stop["employee_ids"].append(emp_id)
+                    stop["max_distance_to_centroid"] = max(stop["max_distance_to_centroid"], dist)
+                    placed.add(emp_id)
+                stops.append(stop)
+            clusters[component] = []
+            for emp_id in sorted(self.members[component]):
+                lat, lng = self.index.location(emp_id)
+                clusters[component].append({
+                    "employee_id": emp_id,
+                    "location": {"lat": lat, "lng": lng}
+                })
+
+        # Single employees with no stop in reach get their own
+        leftovers = []
+        for component in sorted(self._candidates, key=lambda c: next(iter(self.members[c]))):
+            emp_id = next(iter(self.members[component]))
+            if emp_id not in placed:
+                lat, lng = self.index.location(emp_id)
+                leftovers.append({
+                    "employee_id": emp_id,
+                    "location": {"lat": lat, "lng": lng}
+                })
+        total_clusters = len(self._parts)
+        stops.extend(self.service.make_individual_stops(stops, leftovers))
+
+        return {
+            "clusters": clusters,
+            "stops": stops,
+            "unclustered": [],
+            "total_clusters": total_clusters
+        }
+
+
+# Previous clustering per (scope, walking distance), least recently used first
+_clusterers: "OrderedDict[Tuple[Hashable, float], IncrementalClusterer]" = OrderedDict()
+_clusterers_lock = threading.Lock()
+
+
+def cluster_employees_incremental(
+    employee_data: List[Dict],
+    max_walking_distance: float,
+    scope_key: Hashable,
+    max_stop_capacity: Optional[int] = None
+) -> Dict:
+    """
+    Cluster employees, patching the previous clustering of the same scope.
+
+    Args:
+        employee_data: List of dicts with 'id', 'lat', 'lng' keys
+        max_walking_distance: Maximum walking distance in meters
+        scope_key: Identifies the employee set across calls (e.g. the shift)
+        max_stop_capacity: Largest effective vehicle capacity (see cluster_employees)
+
+    Returns:
+        Clustering results with stops and assignments, plus an 'incremental'
+        entry describing what was recomputed
+    """
+    key = (scope_key, float(max_walking_distance))
+
+    # The global lock only guards the registry; each scope has its own lock
+    with _clusterers_lock:
+        clusterer = _clusterers.get(key)
+        if clusterer is None:
+            clusterer = IncrementalClusterer(max_walking_distance)
+            _clusterers[key] = clusterer
+            while len(_clusterers) > settings.incremental_clustering_max_scopes:
+                _clusterers.popitem(last=False)
+        else:
+            _clusterers.move_to_end(key)
+
+    with clusterer.lock:
+        if not clusterer.built:
+            clusterer.build(employee_data)
+            changes = {"inserted": len(employee_data), "moved": 0, "deleted": 0, "rebuilt": True}
+        else:
+            changes = clusterer.update(employee_data)
+            changes["rebuilt"] = False
+
+        result = clusterer.result(max_stop_capacity)
+
+    logger.info(
+        f"Incremental clustering ({scope_key}): +{changes['inserted']} "
+        f"~{changes['moved']} -{changes['deleted']} employees, {len(result['stops'])} stops"
+    )
+    result["incremental"] = changes
+    return result
@@ -0,0 +1,374 @@
+"""
+Matrix Cache - Pairwise OSRM distance/duration cache
+
+Snapped stop coordinates recur across simulations of the same shift, so most
+cells of a new distance matrix have been seen before. Cells are cached per
+(from point, to point, profile, exclude_tolls) with coordinates rounded to
+settings.matrix_cache_precision decimal places:
+
+- An in-process LRU of rows (one per from point, to points and costs as
+  sorted NumPy arrays) holds up to settings.matrix_cache_max_pairs cells;
+  the default fits one full 1000-point matrix
+- The osrm_pair_cache table keeps them across restarts (rows older than
+  settings.matrix_cache_ttl_days are ignored and pruned)
+
+Only the rows and columns that still have missing cells are sent to OSRM, as
+sources/destinations sub-tables.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy import text
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def plan_missing_fetch(missing: np.ndarray) -> Tuple[List[int], List[int]]:
+    """
+    Choose full rows and full columns that together cover every missing cell.
+
+    Greedily takes the row or column with the most uncovered cells. A new stop
+    (missing row and column) costs one row plus one column instead of the
+    whole matrix.
+
+    Args:
+        missing: Boolean matrix, True where a cell must be fetched
+
+    Returns:
+        (rows, cols) index lists; fetch rows × all and all × cols
+    """
+    remaining = missing.copy()
+    rows: List[int] = []
+    cols: List[int] = []
+    row_counts = remaining.sum(axis=1)
+    col_counts = remaining.sum(axis=0)
+
+    while row_counts.any():
+        best_row = int(row_counts.argmax())
+        best_col = int(col_counts.argmax())
+        if row_counts[best_row] >= col_counts[best_col]:
+            rows.append(best_row)
+            col_counts -= remaining[best_row]
+            remaining[best_row] = False
+            row_counts[best_row] = 0
+        else:
+            cols.append(best_col)
+            row_counts -= remaining[:, best_col]
+            remaining[:, best_col] = False
+            col_counts[best_col] = 0
+
+    return sorted(rows), sorted(cols)
+
+
+class _Row:
+    """Cached cells of one from point: to points (sorted) and their costs."""
+
+    __slots__ = ("to_points", "distances", "durations")
+
+    def __init__(self, to_points: np.ndarray, distances: np.ndarray, durations: np.ndarray):
+        self.to_points = to_points
+        self.distances = distances
+        self.durations = durations
+
+    def merge(self, to_points: np.ndarray, distances: np.ndarray, durations: np.ndarray) -> "_Row":
+        """New row with the given cells added (given values win over cached ones)."""
+        keys, first = np.unique(np.concatenate([to_points, self.to_points]), return_index=True)
+        return _Row(
+            keys,
+            np.concatenate([distances, self.distances])[first],
+            np.concatenate([durations, self.durations])[first]
+        )
+
+    def find(self, to_points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(hit mask, positions into this row) for the given to points."""
+        positions = np.searchsorted(self.to_points, to_points)
+        positions = np.minimum(positions, len(self.to_points) - 1)
+        return self.to_points[positions] == to_points, positions
+
+
+class PairCache:
+    """
+    LRU of (distance, duration) per point pair, backed by Postgres.
+
+    Cells are grouped into rows per (from point, profile, exclude_tolls), so
+    lookups and stores are a few array operations per matrix row.
+    """
+
+    def __init__(self, max_pairs: int = None, precision: int = None):
+        self.max_pairs = max_pairs or settings.matrix_cache_max_pairs
+        self.precision = precision if precision is not None else settings.matrix_cache_precision
+        self._scale = 10 ** self.precision
+        self._rows: "OrderedDict[Tuple[int, str, bool], _Row]" = OrderedDict()
+        self._cells = 0
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._table_lock = asyncio.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def point_keys(self, coordinates: List[Tuple[float, float]]) -> np.ndarray:
+        """Encode rounded (lat, lng) pairs as one int64 per point."""
+        coords = np.asarray(coordinates, dtype=np.float64)
+        lat = np.rint(coords[:, 0] * self._scale).astype(np.int64) + 90 * self._scale
+        lng = np.rint(coords[:, 1] * self._scale).astype(np.int64) + 180 * self._scale
+        return lat * (360 * self._scale + 1) + lng
+
+    async def _ensure_table(self, db):
+        if self._table_ready:
+            return
+        async with self._table_lock:
+            if self._table_ready:
+                return
+            await db.execute(text("""
+                CREATE TABLE IF NOT EXISTS osrm_pair_cache (
+                    from_point BIGINT NOT NULL,
+                    to_point BIGINT NOT NULL,
+                    profile VARCHAR(20) NOT NULL,
+                    exclude_tolls BOOLEAN NOT NULL,
+                    coord_precision SMALLINT NOT NULL,
+                    distance DOUBLE PRECISION NOT NULL,
+                    duration DOUBLE PRECISION NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (from_point, to_point, profile, exclude_tolls, coord_precision)
+                )
+            """))
+            # Road data changes over time; drop entries past their TTL once per process
+            await db.execute(text("""
+                DELETE FROM osrm_pair_cache
+                WHERE updated_at < CURRENT_TIMESTAMP - make_interval(days => :ttl)
+            """), {"ttl": settings.matrix_cache_ttl_days})
+            await db.commit()
+            self._table_ready = True
+
+    async def lookup(
+        self,
+        points: np.ndarray,
+        profile: str,
+        exclude_tolls: bool
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Fill a matrix from the cache.
+
+        Returns:
+            (distances, durations, found) n×n arrays; cells not found are NaN.
+            Pairs of identical points are always found with zero cost.
+        """
+        n = len(points)
+        distances = np.full((n, n), np.nan)
+        durations = np.full((n, n), np.nan)
+        found = points[:, None] == points[None, :]
+        distances[found] = 0.0
+        durations[found] = 0.0
+
+        # Work on distinct points; duplicates share their cells
+        unique_points, inverse = np.unique(points, return_inverse=True)
+        unique_distances = np.full((len(unique_points), len(unique_points)), np.nan)
+        unique_durations = np.full((len(unique_points), len(unique_points)), np.nan)
+        with self._lock:
+            for u, from_point in enumerate(unique_points.tolist()):
+                key = (from_point, profile, exclude_tolls)
+                row = self._rows.get(key)
+                if row is None:
+                    continue
+                self._rows.move_to_end(key)
+                hit, positions = row.find(unique_points)
+                unique_distances[u, hit] = row.distances[positions[hit]]
+                unique_durations[u, hit] = row.durations[positions[hit]]
+
+        expanded = np.ix_(inverse, inverse)
+        cached = ~np.isnan(unique_distances[expanded]) & ~found
+        distances[cached] = unique_distances[expanded][cached]
+        durations[cached] = unique_durations[expanded][cached]
+        found |= cached
+        memory_hits = int(cached.sum())
+        self.memory_hits += memory_hits
+
+        if settings.matrix_cache_persist and not found.all():
+            db_hits = await self._lookup_db(points, profile, exclude_tolls, distances, durations, found)
+            self.db_hits += db_hits
+
+        return distances, durations, found
+
+    async def _lookup_db(
+        self,
+        points: np.ndarray,
+        profile: str,
+        exclude_tolls: bool,
+        distances: np.ndarray,
+        durations: np.ndarray,
+        found: np.ndarray
+    ) -> int:
+        """Fill missing cells from Postgres; returns the number of cells filled."""
+        missing_rows, missing_cols = np.nonzero(~found)
+        from_points = np.unique(points[missing_rows]).tolist()
+        to_points = np.unique(points[missing_cols]).tolist()
+
+        try:
+            from app.core.database import async_session
+
+            async with async_session() as db:
+                await self._ensure_table(db)
+                result = await db.execute(text("""
+                    SELECT from_point, to_point, distance, duration
+                    FROM osrm_pair_cache
+                    WHERE from_point = ANY(CAST(:from_points AS BIGINT[]))
+                      AND to_point = ANY(CAST(:to_points AS BIGINT[]))
+                      AND profile = :profile
+                      AND exclude_tolls = :exclude_tolls
+                      AND coord_precision = :precision
+                      AND updated_at >= CURRENT_TIMESTAMP - make_interval(days => :ttl)
+                """), {
+                    "from_points": from_points,
+                    "to_points": to_points,
+                    "profile": profile,
+                    "exclude_tolls": exclude_tolls,
+                    "precision": self.precision,
+                    "ttl": settings.matrix_cache_ttl_days
+                })
+                rows = result.fetchall()
+        except Exception as e:
+            logger.warning(f"Matrix cache lookup failed, continuing without it: {e}")
+            return 0
+
+        if not rows:
+            return 0
+
+        from_points = np.array([row.from_point for row in rows], dtype=np.int64)
+        to_points = np.array([row.to_point for row in rows], dtype=np.int64)
+        row_distances = np.array([row.distance for row in rows], dtype=np.float64)
+        row_durations = np.array([row.duration for row in rows], dtype=np.float64)
+        self._put_cells(from_points, to_points, row_distances, row_durations, profile, exclude_tolls)
+
+        # Scatter the fetched pairs into the matrix through the distinct points
+        unique_points, inverse = np.unique(points, return_inverse=True)
+        from_index = np.searchsorted(unique_points, from_points)
+        to_index = np.searchsorted(unique_points, to_points)
+        unique_distances = np.full((len(unique_points), len(unique_points)), np.nan)
+        unique_durations = np.full((len(unique_points), len(unique_points)), np.nan)
+        unique_distances[from_index, to_index] = row_distances
+        unique_durations[from_index, to_index] = row_durations
+
+        expanded = np.ix_(inverse, inverse)
+        filled = ~np.isnan(unique_distances[expanded]) & ~found
+        distances[filled] = unique_distances[expanded][filled]
+        durations[filled] = unique_durations[expanded][filled]
+        found |= filled
+        return int(filled.sum())
+
+    def _put_cells(
+        self,
+        from_points: np.ndarray,
+        to_points: np.ndarray,
+        distances: np.ndarray,
+        durations: np.ndarray,
+        profile: str,
+        exclude_tolls: bool
+    ):
+        """Merge cells into their rows and evict least recently used rows."""
+        order = np.argsort(from_points, kind="stable")
+        from_points, to_points = from_points[order], to_points[order]
+        distances, durations = distances[order], durations[order]
+        starts = np.flatnonzero(np.r_[True, from_points[1:] != from_points[:-1]])
+        ends = np.r_[starts[1:], len(from_points)]
+
+        with self._lock:
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                key = (int(from_points[start]), profile, exclude_tolls)
+                row = self._rows.pop(key, None)
+                if row is None:
+                    row = _Row(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+                else:
+                    self._cells -= len(row.to_points)
+                row = row.merge(to_points[start:end], distances[start:end], durations[start:end])
+                self._rows[key] = row
+                self._cells += len(row.to_points)
+            while self._cells > self.max_pairs and len(self._rows) > 1:
+                _, evicted = self._rows.popitem(last=False)
+                self._cells -= len(evicted.to_points)
+
+    async def store(
+        self,
+        points: np.ndarray,
+        distances: np.ndarray,
+        durations: np.ndarray,
+        cells: np.ndarray,
+        profile: str,
+        exclude_tolls: bool
+    ):
+        """
+        Cache freshly fetched cells.
+
+        Args:
+            points: Point keys of the matrix
+            distances, durations: Matrices holding the fetched values
+            cells: Boolean mask of cells to store (unreachable cells excluded)
+        """
+        # Duplicate points would give the same pair more than once; keep the
+        # first row/column of each point
+        _, first = np.unique(points, return_index=True)
+        sub = np.ix_(first, first)
+        rows, cols = np.nonzero(cells[sub] & ~np.eye(len(first), dtype=bool))
+        if not len(rows):
+            return
+        from_points, to_points = points[first][rows], points[first][cols]
+        pair_distances = distances[sub][rows, cols].astype(np.float64)
+        pair_durations = durations[sub][rows, cols].astype(np.float64)
+
+        self._put_cells(from_points, to_points, pair_distances, pair_durations, profile, exclude_tolls)
+
+        if not settings.matrix_cache_persist:
+            return
+
+        try:
+            from app.core.database import async_session
+
+            async with async_session() as db:
+                await self._ensure_table(db)
+                await db.execute(text("""
+                    INSERT INTO osrm_pair_cache
+                    (from_point, to_point, profile, exclude_tolls, coord_precision, distance, duration)
+                    SELECT f, t, :profile, :exclude_tolls, :precision, d, u
+                    FROM unnest(
+                        CAST(:from_points AS BIGINT[]),
+                        CAST(:to_points AS BIGINT[]),
+                        CAST(:distances AS DOUBLE PRECISION[]),
+                        CAST(:durations AS DOUBLE PRECISION[])
+                    ) AS fetched(f, t, d, u)
+                    ON CONFLICT (from_point, to_point, profile, exclude_tolls, coord_precision) DO UPDATE
+                    SET distance = EXCLUDED.distance,
+                        duration = EXCLUDED.duration,
+                        updated_at = CURRENT_TIMESTAMP
+                """), {
+                    "profile": profile,
+                    "exclude_tolls": exclude_tolls,
+                    "precision": self.precision,
+                    "from_points": from_points.tolist(),
+                    "to_points": to_points.tolist(),
+                    "distances": pair_distances.tolist(),
+                    "durations": pair_durations.tolist()
+                })
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Matrix cache store failed: {e}")
+
+    def stats(self) -> Dict:
+        """Hit counters since process start."""
+        total = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.memory_hits + self.db_hits) / total, 4) if total else None,
+            "cached_pairs": self._cells
+        }
+
+
+# Shared by all OSRMService instances (keys include the profile)
+pair_cache = PairCache()
@@ -8,12 +8,236 @@ This module uses Google OR-Tools to solve the CVRP:
 """
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Union
 import logging
+import time
 import numpy as np
 
+from app.core.config import settings
+
 logger = logging.getLogger(__name__)
 
+# Distance/duration matrices: nested lists or 2-D NumPy arrays
+Matrix = Union[List[List[float]], np.ndarray]
+
+# Arc cost for pairs without a route (None/NaN); exceeds every dimension capacity
+UNREACHABLE_ARC_COST = 10_000_000
+
+# Search configuration used when none is given
+DEFAULT_SEARCH_STRATEGY = {
+    "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+    "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH"
+}
+
+# Diverse search configurations for portfolio solving (see portfolio_solver);
+# the first entry is the default single-search configuration
+PORTFOLIO_STRATEGIES = [
+    DEFAULT_SEARCH_STRATEGY,
+    {"first_solution_strategy": "SAVINGS", "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "PATH_CHEAPEST_ARC", "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION", "local_search_metaheuristic": "SIMULATED_ANNEALING"},
+    {"first_solution_strategy": "SAVINGS", "local_search_metaheuristic": "TABU_SEARCH"},
+    {"first_solution_strategy": "CHRISTOFIDES", "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "LOCAL_CHEAPEST_INSERTION", "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "PATH_MOST_CONSTRAINED_ARC", "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH"},
+]
+
+# Guided local search penalty factors cycled through when the portfolio is
+# larger than PORTFOLIO_STRATEGIES (OR-Tools routing has no random seed)
+_PORTFOLIO_LAMBDAS = [0.1, 0.05, 0.2, 0.3]
+
+
+def portfolio_strategies(size: int) -> List[Dict]:
+    """
+    Search configurations for a portfolio of the given size.
+    
+    Configurations repeat with a different guided local search lambda once
+    PORTFOLIO_STRATEGIES is exhausted.
+    """
+    strategies = []
+    for member in range(size):
+        strategy = dict(PORTFOLIO_STRATEGIES[member % len(PORTFOLIO_STRATEGIES)])
+        round_ = member // len(PORTFOLIO_STRATEGIES)
+        if round_ and strategy["local_search_metaheuristic"] == "GUIDED_LOCAL_SEARCH":
+            strategy["guided_local_search_lambda_coefficient"] = _PORTFOLIO_LAMBDAS[round_ % len(_PORTFOLIO_LAMBDAS)]
+        strategies.append(strategy)
+    return strategies
+
+
+def _solver_matrix(matrix: Matrix) -> np.ndarray:
+    """
+    Integer matrix for the routing model's native transit evaluators.
+    
+    Values are truncated to whole meters/seconds. Unreachable pairs (None from
+    OSRM, NaN in arrays) get UNREACHABLE_ARC_COST so the solver never uses them.
+    """
+    array = np.asarray(matrix, dtype=np.float64)
+    return np.where(np.isfinite(array), np.trunc(array), UNREACHABLE_ARC_COST).astype(np.int64)
+
+
+def effective_capacity(seats: int, buffer_seats: int = 0) -> int:
+    """Seats available for passengers after leaving buffer seats empty."""
+    return max(1, seats - buffer_seats)
+
+
+def max_effective_capacity(
+    num_16_seaters: int,
+    num_27_seaters: int,
+    buffer_seats: int = 0
+) -> int:
+    """
+    Largest effective capacity in the fleet.
+    
+    Stops must not exceed this many passengers, otherwise no vehicle can
+    serve them and the CVRP has no feasible solution.
+    """
+    if num_27_seaters > 0 or num_16_seaters <= 0:
+        return effective_capacity(27, buffer_seats)
+    return effective_capacity(16, buffer_seats)
+
+
+# Fixed cost of vehicles from the optional pool; high enough that they are only
+# used when the requested fleet cannot serve every stop within the route limits
+OPTIONAL_VEHICLE_COST = 5_000_000
+
+# The Time dimension caps routes at this multiple of max_route_duration
+# (up to max_route_duration itself the limit is soft)
+HARD_ROUTE_DURATION_FACTOR = 3
+
+
+def vehicle_lower_bound(demands: List[int], vehicle_capacities: List[int]) -> int:
+    """
+    Bin-packing lower bound on the number of vehicles needed.
+    
+    The larger of:
+    - the fewest vehicles whose combined capacity covers the total demand
+      (largest vehicles first)
+    - the number of stops with more than half of the largest capacity, since
+      no two of them fit in one vehicle
+    
+    Returns:
+        Lower bound, or len(vehicle_capacities) + 1 if the fleet cannot hold the demand
+    """
+    total_demand = sum(demands)
+    if total_demand <= 0:
+        return 0
+    capacities = sorted(vehicle_capacities, reverse=True)
+    if not capacities:
+        return 1
+    
+    by_capacity = len(capacities) + 1
+    covered = 0
+    for count, capacity in enumerate(capacities, start=1):
+        covered += capacity
+        if covered >= total_demand:
+            by_capacity = count
+            break
+    
+    large_stops = sum(1 for demand in demands if demand * 2 > capacities[0])
+    return max(by_capacity, large_stops)
+
+
+def optional_vehicle_pool(
+    num_16_seaters: int,
+    num_27_seaters: int,
+    vehicle_priority: str,
+    demands: List[int],
+    buffer_seats: int = 0
+) -> Tuple[int, int]:
+    """
+    Size of the optional vehicle pool offered to the solver next to the requested fleet.
+    
+    Starts from what the former retry loop could add over four retries (2 of the
+    preferred type per retry, or 1 of each in auto mode) and grows the preferred
+    type until the fleet holds the demand with at least one vehicle to spare;
+    with no headroom the first solution heuristic often fails outright.
+    
+    Returns:
+        (optional 16-seaters, optional 27-seaters)
+    """
+    if vehicle_priority == "small":
+        optional_16, optional_27 = 8, 0
+    elif vehicle_priority == "large":
+        optional_16, optional_27 = 0, 8
+    else:
+        optional_16, optional_27 = 4, 4
+    
+    capacity_16 = effective_capacity(16, buffer_seats)
+    capacity_27 = effective_capacity(27, buffer_seats)
+    while True:
+        capacities = (
+            [capacity_16] * (num_16_seaters + optional_16)
+            + [capacity_27] * (num_27_seaters + optional_27)
+        )
+        if vehicle_lower_bound(demands, capacities) < len(capacities):
+            return optional_16, optional_27
+        if vehicle_priority == "small":
+            optional_16 += 1
+        else:
+            optional_27 += 1
+
+
+class _ConvergenceMonitor:
+    """
+    Solution callback that records the best objective over time.
+    
+    Stops the search once the best objective improved by less than
+    min_improvement during the last window_seconds, relative to the variable
+    cost (objective minus the fixed cost of the vehicles in use). Fixed
+    vehicle costs dwarf distances, so a relative change of the whole objective
+    would look like a plateau while routes are still getting shorter. The
+    check runs whenever the search reports a solution, so a search that finds
+    nothing new still ends at its time limit.
+    """
+    
+    def __init__(self, routing: pywrapcp.RoutingModel, window_seconds: float, min_improvement: float):
+        self.routing = routing
+        self.window_seconds = window_seconds
+        self.min_improvement = min_improvement
+        # (seconds, best objective, its variable cost) at each improvement
+        self.trace: List[Tuple[float, int, int]] = []
+        self.solutions = 0
+        self.stopped_early = False
+        self._start = time.monotonic()
+    
+    def start(self):
+        self._start = time.monotonic()
+    
+    def _fixed_cost(self) -> int:
+        """Fixed cost of the vehicles used by the current solution."""
+        routing = self.routing
+        return sum(
+            routing.GetFixedCostOfVehicle(vehicle)
+            for vehicle in range(routing.vehicles())
+            if routing.NextVar(routing.Start(vehicle)).Value() != routing.End(vehicle)
+        )
+    
+    def __call__(self):
+        elapsed = time.monotonic() - self._start
+        objective = self.routing.CostVar().Value()
+        self.solutions += 1
+        if not self.trace or objective < self.trace[-1][1]:
+            self.trace.append((round(elapsed, 3), objective, objective - self._fixed_cost()))
+        
+        if self.window_seconds <= 0 or elapsed < self.window_seconds:
+            return
+        # Best solution as of one window ago
+        cutoff = elapsed - self.window_seconds
+        best_then = next((point for point in reversed(self.trace) if point[0] <= cutoff), None)
+        if not best_then or best_then[2] <= 0:
+            return
+        if (best_then[1] - self.trace[-1][1]) / best_then[2] < self.min_improvement:
+            self.stopped_early = True
+            self.routing.solver().FinishCurrentSearch()
+    
+    def summary(self) -> Dict:
+        return {
+            "trace": [list(point) for point in self.trace],
+            "solutions": self.solutions,
+            "elapsed_seconds": round(time.monotonic() - self._start, 3),
+            "stopped_early": self.stopped_early
+        }
+
 
 class CVRPSolver:
     """
@@ -29,14 +253,18 @@ class CVRPSolver:
     
     def __init__(
         self,
-        distance_matrix: List[List[float]],
+        distance_matrix: Matrix,
         demands: List[int],
         vehicle_capacities: List[int],
         depot_index: int = 0,
         time_limit_seconds: int = 30,
         priority_vehicle_count: int = 0,
-        duration_matrix: List[List[float]] = None,
-        max_route_duration: int = 3900  # 65 minutes in seconds
+        duration_matrix: Optional[Matrix] = None,
+        max_route_duration: int = 3900,  # 65 minutes in seconds
+        search_strategy: Optional[Dict] = None,
+        plateau_window_seconds: Optional[float] = None,
+        plateau_min_improvement: Optional[float] = None,
+        optional_vehicle_count: int = 0
     ):
         """
         Initialize the CVRP solver.
@@ -50,8 +278,16 @@ class CVRPSolver:
             priority_vehicle_count: Number of priority vehicles (first N in the list)
             duration_matrix: Matrix of travel times between all locations (in seconds)
             max_route_duration: Maximum time for a route (first pickup to last pickup) in seconds
+            search_strategy: First solution strategy / metaheuristic names (and an
+                optional guided_local_search_lambda_coefficient); see PORTFOLIO_STRATEGIES
+            plateau_window_seconds: Stop early when the objective improves by less than
+                plateau_min_improvement over this many seconds (0 = run to the time limit)
+            plateau_min_improvement: Improvement threshold for early stopping, relative
+                to the variable (non-fixed) cost
+            optional_vehicle_count: Number of optional vehicles (last N in the list),
+                which carry OPTIONAL_VEHICLE_COST as their fixed cost
         """
-        self.distance_matrix = distance_matrix
+        self.distance_matrix = _solver_matrix(distance_matrix)
         self.demands = demands
         self.vehicle_capacities = vehicle_capacities
         self.depot_index = depot_index
@@ -60,17 +296,78 @@ class CVRPSolver:
         self.num_locations = len(distance_matrix)
         self.priority_vehicle_count = priority_vehicle_count
         # Use duration matrix if provided, otherwise estimate from distance
-        self.duration_matrix = duration_matrix if duration_matrix else self._estimate_duration_matrix()
+        if duration_matrix is not None:
+            self.duration_matrix = _solver_matrix(duration_matrix)
+        else:
+            self.duration_matrix = self._estimate_duration_matrix()
         self.max_route_duration = max_route_duration
+        self.search_strategy = search_strategy or DEFAULT_SEARCH_STRATEGY
+        self.plateau_window_seconds = (
+            plateau_window_seconds if plateau_window_seconds is not None
+            else settings.solver_plateau_window_seconds
+        )
+        self.plateau_min_improvement = (
+            plateau_min_improvement if plateau_min_improvement is not None
+            else settings.solver_plateau_min_improvement
+        )
+        self.optional_vehicle_count = optional_vehicle_count
     
-    def _estimate_duration_matrix(self) -> List[List[float]]:
+    def _estimate_duration_matrix(self) -> np.ndarray:
         """Estimate duration from distance assuming 30 km/h average speed"""
         avg_speed_ms = 30 * 1000 / 3600  # 30 km/h in m/s
-        return [
-            [int(d / avg_speed_ms) for d in row]
-            for row in self.distance_matrix
+        return (self.distance_matrix / avg_speed_ms).astype(np.int64)
+        
+    def check_feasibility(self) -> Optional[Dict]:
+        """
+        Detect instances that no search can solve.
+        
+        Returns:
+            None, or a dict with 'reason' and details:
+            - stop_exceeds_capacity: a stop has more passengers than any vehicle seats
+            - insufficient_capacity: total demand exceeds the whole fleet
+            - route_duration: depot -> stop -> depot alone exceeds the hard time limit
+        """
+        max_capacity = max(self.vehicle_capacities, default=0)
+        oversized = [
+            node for node, demand in enumerate(self.demands)
+            if node != self.depot_index and demand > max_capacity
         ]
+        if oversized:
+            return {"reason": "stop_exceeds_capacity", "stops": oversized, "max_capacity": max_capacity}
         
+        total_demand = sum(self.demands)
+        total_capacity = sum(self.vehicle_capacities)
+        if total_demand > total_capacity:
+            return {
+                "reason": "insufficient_capacity",
+                "total_demand": total_demand,
+                "total_capacity": total_capacity
+            }
+        
+        hard_limit = self.max_route_duration * HARD_ROUTE_DURATION_FACTOR
+        depot = self.depot_index
+        round_trips = self.duration_matrix[depot, :] + self.duration_matrix[:, depot]
+        too_far = [int(node) for node in np.nonzero(round_trips > hard_limit)[0] if node != depot]
+        if too_far:
+            return {"reason": "route_duration", "stops": too_far, "hard_limit_seconds": hard_limit}
+        
+        return None
+    
+    def _no_solution(self, infeasibility: Dict, convergence: Optional[Dict] = None) -> Dict:
+        return {
+            "routes": [],
+            "distances": [],
+            "loads": [],
+            "total_distance": 0,
+            "vehicles_used": 0,
+            "objective": None,
+            "search_strategy": self.search_strategy,
+            "convergence": convergence,
+            "vehicle_lower_bound": vehicle_lower_bound(self.demands, self.vehicle_capacities),
+            "infeasibility": infeasibility,
+            "status": "NO_SOLUTION"
+        }
+    
     def solve(self) -> Dict:
         """
         Solve the CVRP and return the optimal routes.
@@ -82,11 +379,21 @@ class CVRPSolver:
             - loads: Load of each vehicle
             - total_distance: Sum of all route distances
             - vehicles_used: Number of vehicles with non-empty routes
+            - objective: Solver objective (comparable between strategies)
+            - convergence: Best objective over time and whether the search stopped early
+            - vehicle_lower_bound: Bin-packing lower bound on the vehicle count
+            - infeasibility: Reason when there is no solution (see check_feasibility,
+              or 'no_solution_found' when the search itself came up empty)
         """
         logger.info(f"Solving CVRP with {self.num_locations} locations and {self.num_vehicles} vehicles")
         logger.info(f"Vehicle capacities: {self.vehicle_capacities}")
         logger.info(f"Priority vehicle count: {self.priority_vehicle_count}")
         
+        infeasibility = self.check_feasibility()
+        if infeasibility:
+            logger.error(f"CVRP is infeasible: {infeasibility}")
+            return self._no_solution(infeasibility)
+        
         # Create routing index manager
         manager = pywrapcp.RoutingIndexManager(
             self.num_locations,
@@ -97,23 +404,15 @@ class CVRPSolver:
         # Create routing model
         routing = pywrapcp.RoutingModel(manager)
         
-        # Define distance callback
-        def distance_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return int(self.distance_matrix[from_node][to_node])
-        
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+        # Distance, time and demand are registered as native matrices/vectors
+        # (indexed by node), so the search never calls back into Python
+        transit_callback_index = routing.RegisterTransitMatrix(self.distance_matrix.tolist())
         
         # Set cost of travel
         routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
         
         # Add capacity constraint
-        def demand_callback(from_index):
-            from_node = manager.IndexToNode(from_index)
-            return self.demands[from_node]
-        
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        demand_callback_index = routing.RegisterUnaryTransitVector([int(d) for d in self.demands])
         
         routing.AddDimensionWithVehicleCapacity(
             demand_callback_index,
@@ -128,8 +427,12 @@ class CVRPSolver:
         PRIORITY_VEHICLE_COST = 100000  # Base cost for priority vehicles
         NON_PRIORITY_VEHICLE_COST = 500000  # Higher cost for non-priority vehicles
         
+        first_optional = self.num_vehicles - self.optional_vehicle_count
         for vehicle_id in range(self.num_vehicles):
-            if self.priority_vehicle_count > 0 and vehicle_id < self.priority_vehicle_count:
+            if vehicle_id >= first_optional:
+                # Optional pool: only used when the requested fleet is not enough
+                routing.SetFixedCostOfVehicle(OPTIONAL_VEHICLE_COST, vehicle_id)
+            elif self.priority_vehicle_count > 0 and vehicle_id < self.priority_vehicle_count:
                 # Priority vehicles (first N in list)
                 routing.SetFixedCostOfVehicle(PRIORITY_VEHICLE_COST, vehicle_id)
             else:
@@ -146,19 +449,14 @@ class CVRPSolver:
         )
         
         # Add time dimension with max route duration constraint
-        def time_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return int(self.duration_matrix[from_node][to_node])
-        
-        time_callback_index = routing.RegisterTransitCallback(time_callback)
+        time_callback_index = routing.RegisterTransitMatrix(self.duration_matrix.tolist())
         
         # Max route duration: use a larger upper bound but add soft constraint
         # This allows the solver to find solutions even when time constraints are tight
         routing.AddDimension(
             time_callback_index,
             0,  # no slack
-            self.max_route_duration * 3,  # max time per vehicle (3x buffer to allow solutions)
+            self.max_route_duration * HARD_ROUTE_DURATION_FACTOR,  # max time per vehicle (3x buffer to allow solutions)
             True,  # start cumul to zero
             'Time'
         )
@@ -180,33 +478,45 @@ class CVRPSolver:
         # The fixed cost per vehicle will naturally minimize the number of vehicles used
         
         # Set search parameters
+        # Default: PARALLEL_CHEAPEST_INSERTION for better initial solutions with
+        # many locations, improved by GUIDED_LOCAL_SEARCH
         search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        # Use PARALLEL_CHEAPEST_INSERTION for better initial solutions with many locations
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
+        search_parameters.first_solution_strategy = getattr(
+            routing_enums_pb2.FirstSolutionStrategy, self.search_strategy["first_solution_strategy"]
         )
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        search_parameters.local_search_metaheuristic = getattr(
+            routing_enums_pb2.LocalSearchMetaheuristic, self.search_strategy["local_search_metaheuristic"]
         )
+        if "guided_local_search_lambda_coefficient" in self.search_strategy:
+            search_parameters.guided_local_search_lambda_coefficient = (
+                self.search_strategy["guided_local_search_lambda_coefficient"]
+            )
         search_parameters.time_limit.seconds = self.time_limit_seconds
         search_parameters.log_search = False
         
+        # Track convergence and stop once the objective plateaus
+        monitor = _ConvergenceMonitor(routing, self.plateau_window_seconds, self.plateau_min_improvement)
+        routing.AddAtSolutionCallback(monitor)
+        
         # Solve the problem
         logger.info("Starting CVRP optimization...")
+        monitor.start()
         solution = routing.SolveWithParameters(search_parameters)
+        convergence = monitor.summary()
+        logger.info(
+            f"CVRP search finished after {convergence['elapsed_seconds']}s "
+            f"({convergence['solutions']} solutions, stopped early: {convergence['stopped_early']})"
+        )
         
         if solution:
-            return self._extract_solution(manager, routing, solution)
+            result = self._extract_solution(manager, routing, solution)
+            result["convergence"] = convergence
+            result["vehicle_lower_bound"] = vehicle_lower_bound(self.demands, self.vehicle_capacities)
+            result["infeasibility"] = None
+            return result
         else:
             logger.error("No solution found for CVRP")
-            return {
-                "routes": [],
-                "distances": [],
-                "loads": [],
-                "total_distance": 0,
-                "vehicles_used": 0,
-                "status": "NO_SOLUTION"
-            }
+            return self._no_solution({"reason": "no_solution_found"}, convergence)
     
     def _extract_solution(
         self,
@@ -271,6 +581,8 @@ class CVRPSolver:
             "loads": loads,
             "total_distance": total_distance,
             "vehicles_used": vehicles_used,
+            "objective": solution.ObjectiveValue(),
+            "search_strategy": self.search_strategy,
             "status": "OPTIMAL" if routing.status() == 1 else "FEASIBLE"
         }
 
@@ -287,7 +599,9 @@ class FleetOptimizer:
         time_limit_seconds: int = 30,
         vehicle_priority: str = "auto",
         max_route_duration: int = 3900,  # 65 minutes in seconds
-        buffer_seats: int = 0
+        buffer_seats: int = 0,
+        optional_16_seaters: int = 0,
+        optional_27_seaters: int = 0
     ):
         """
         Initialize fleet optimizer.
@@ -299,6 +613,8 @@ class FleetOptimizer:
             vehicle_priority: 'large' (27 first), 'small' (16 first), or 'auto'
             max_route_duration: Maximum time for a route (first to last pickup) in seconds
             buffer_seats: Number of seats to leave empty per vehicle for comfort
+            optional_16_seaters: Extra 16-seaters the solver may add at OPTIONAL_VEHICLE_COST
+            optional_27_seaters: Extra 27-seaters the solver may add at OPTIONAL_VEHICLE_COST
         """
         self.num_16_seaters = num_16_seaters
         self.num_27_seaters = num_27_seaters
@@ -308,8 +624,8 @@ class FleetOptimizer:
         self.buffer_seats = buffer_seats
         
         # Apply buffer seats to reduce effective capacity
-        effective_16_capacity = max(1, 16 - buffer_seats)
-        effective_27_capacity = max(1, 27 - buffer_seats)
+        effective_16_capacity = effective_capacity(16, buffer_seats)
+        effective_27_capacity = effective_capacity(27, buffer_seats)
         
         logger.info(f"Buffer seats: {buffer_seats} - Effective capacities: 16-seater={effective_16_capacity}, 27-seater={effective_27_capacity}")
         
@@ -347,13 +663,29 @@ class FleetOptimizer:
                 ["16-seater"] * num_16_seaters
             )
             self.priority_vehicle_count = 0  # All same priority in auto mode
+        
+        # Optional pool goes after the requested fleet
+        self.vehicle_optional = [False] * len(self.vehicle_capacities)
+        self.vehicle_capacities = (
+            self.vehicle_capacities +
+            [effective_27_capacity] * optional_27_seaters +
+            [effective_16_capacity] * optional_16_seaters
+        )
+        self.vehicle_types = (
+            self.vehicle_types +
+            ["27-seater"] * optional_27_seaters +
+            ["16-seater"] * optional_16_seaters
+        )
+        self.optional_vehicle_count = optional_16_seaters + optional_27_seaters
+        self.vehicle_optional += [True] * self.optional_vehicle_count
     
     def optimize(
         self,
-        distance_matrix: List[List[float]],
+        distance_matrix: Matrix,
         stop_demands: List[int],
         depot_index: int = 0,
-        duration_matrix: List[List[float]] = None
+        duration_matrix: Optional[Matrix] = None,
+        search_strategy: Optional[Dict] = None
     ) -> Dict:
         """
         Optimize fleet routes.
@@ -363,6 +695,7 @@ class FleetOptimizer:
             stop_demands: Number of passengers at each stop
             depot_index: Index of depot in distance matrix
             duration_matrix: Duration matrix including depot (in seconds)
+            search_strategy: Solver search configuration (default: DEFAULT_SEARCH_STRATEGY)
             
         Returns:
             Optimization result with routes and statistics
@@ -390,7 +723,9 @@ class FleetOptimizer:
             time_limit_seconds=self.time_limit_seconds,
             priority_vehicle_count=self.priority_vehicle_count,
             duration_matrix=duration_matrix,
-            max_route_duration=self.max_route_duration
+            max_route_duration=self.max_route_duration,
+            search_strategy=search_strategy,
+            optional_vehicle_count=self.optional_vehicle_count
         )
         
         solution = solver.solve()
@@ -398,20 +733,24 @@ class FleetOptimizer:
         # Add vehicle type information
         solution["vehicle_types"] = self.vehicle_types
         solution["vehicle_capacities"] = self.vehicle_capacities
+        solution["vehicle_optional"] = self.vehicle_optional
         
         return solution
 
 
 def solve_cvrp(
-    distance_matrix: List[List[float]],
+    distance_matrix: Matrix,
     demands: List[int],
     num_16_seaters: int = 5,
     num_27_seaters: int = 5,
     time_limit_seconds: int = 30,
     vehicle_priority: str = "auto",
-    duration_matrix: List[List[float]] = None,
+    duration_matrix: Optional[Matrix] = None,
     max_route_duration: int = 3900,
-    buffer_seats: int = 0
+    buffer_seats: int = 0,
+    search_strategy: Optional[Dict] = None,
+    optional_16_seaters: int = 0,
+    optional_27_seaters: int = 0
 ) -> Dict:
     """
     Convenience function to solve CVRP.
@@ -426,6 +765,9 @@ def solve_cvrp(
         duration_matrix: Duration matrix (in seconds)
         max_route_duration: Max route time in seconds (default 65 min)
         buffer_seats: Buffer seats to leave empty per vehicle
+        search_strategy: Solver search configuration (default: DEFAULT_SEARCH_STRATEGY)
+        optional_16_seaters: Extra 16-seaters available at a high fixed cost
+        optional_27_seaters: Extra 27-seaters available at a high fixed cost
         
     Returns:
         Optimization solution
@@ -436,28 +778,34 @@ def solve_cvrp(
         time_limit_seconds=time_limit_seconds,
         vehicle_priority=vehicle_priority,
         max_route_duration=max_route_duration,
-        buffer_seats=buffer_seats
+        buffer_seats=buffer_seats,
+        optional_16_seaters=optional_16_seaters,
+        optional_27_seaters=optional_27_seaters
     )
     
     return optimizer.optimize(
         distance_matrix=distance_matrix,
         stop_demands=demands,
         depot_index=0,
-        duration_matrix=duration_matrix
+        duration_matrix=duration_matrix,
+        search_strategy=search_strategy
     )
 
 
 def create_optimized_routes(
     stops: List[Dict],
     depot_location: Tuple[float, float],
-    distance_matrix: List[List[float]],
+    distance_matrix: Matrix,
     num_16_seaters: int = 5,
     num_27_seaters: int = 5,
     time_limit_seconds: int = 30,
     vehicle_priority: str = "auto",
-    duration_matrix: List[List[float]] = None,
+    duration_matrix: Optional[Matrix] = None,
     max_route_duration: int = 3900,  # 65 minutes in seconds
-    buffer_seats: int = 0
+    buffer_seats: int = 0,
+    search_strategy: Optional[Dict] = None,
+    optional_16_seaters: int = 0,
+    optional_27_seaters: int = 0
 ) -> Dict:
     """
     Create optimized routes from clustered stops.
@@ -475,6 +823,9 @@ def create_optimized_routes(
         duration_matrix: Pre-computed duration matrix from OSRM (in seconds)
         max_route_duration: Max time for route (first to last pickup) in seconds
         buffer_seats: Buffer seats to leave empty per vehicle
+        search_strategy: Solver search configuration (default: DEFAULT_SEARCH_STRATEGY)
+        optional_16_seaters: Extra 16-seaters available at a high fixed cost
+        optional_27_seaters: Extra 27-seaters available at a high fixed cost
         
     Returns:
         Complete optimization result with routes
@@ -494,9 +845,27 @@ def create_optimized_routes(
         vehicle_priority=vehicle_priority,
         duration_matrix=duration_matrix,
         max_route_duration=max_route_duration,
-        buffer_seats=buffer_seats
+        buffer_seats=buffer_seats,
+        search_strategy=search_strategy,
+        optional_16_seaters=optional_16_seaters,
+        optional_27_seaters=optional_27_seaters
     )
     
+    return format_solution(solution, stops, depot_location)
+
+
+def format_solution(solution: Dict, stops: List[Dict], depot_location: Tuple[float, float]) -> Dict:
+    """
+    Map a solve_cvrp solution back to stop data (create_optimized_routes format).
+    
+    Args:
+        solution: solve_cvrp result; node k > 0 is stops[k - 1]
+        stops: Stop dictionaries in matrix order (depot excluded)
+        depot_location: (lat, lng) of the depot/workplace
+    """
+    demands = [0]
+    demands.extend([stop["employee_count"] for stop in stops])
+    
     # Map route indices back to stop data
     formatted_routes = []
     for vehicle_id, route in enumerate(solution["routes"]):
@@ -539,6 +908,7 @@ def create_optimized_routes(
             "vehicle_id": vehicle_id,
             "vehicle_type": solution["vehicle_types"][vehicle_id],
             "vehicle_capacity": solution["vehicle_capacities"][vehicle_id],
+            "optional_vehicle": solution["vehicle_optional"][vehicle_id],
             "distance": solution["distances"][vehicle_id],
             "load": solution["loads"][vehicle_id],
             "stops": route_stops
@@ -548,6 +918,12 @@ def create_optimized_routes(
         "routes": formatted_routes,
         "total_distance": solution["total_distance"],
         "vehicles_used": solution["vehicles_used"],
+        "optional_vehicles_used": sum(1 for route in formatted_routes if route["optional_vehicle"]),
         "status": solution["status"],
+        "objective": solution["objective"],
+        "search_strategy": solution["search_strategy"],
+        "convergence": solution["convergence"],
+        "vehicle_lower_bound": solution["vehicle_lower_bound"],
+        "infeasibility": solution["infeasibility"],
         "total_passengers": sum(demands)
     }
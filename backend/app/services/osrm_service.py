@@ -8,14 +8,42 @@ Provides:
 """
 import httpx
 import asyncio
-from typing import List, Tuple, Dict, Optional
+import copy
+from typing import Any, Awaitable, Callable, List, Tuple, Dict, Optional
 import logging
 import numpy as np
 
 from app.core.config import settings
+from app.core.circuit_breaker import CircuitBreaker
+from app.services.matrix_cache import pair_cache, plan_missing_fetch
+from app.services.route_cache import route_cache, leg_cache, stitch_legs
+from app.services.snap_cache import snap_cache
+from app.services.road_index import get_road_index, is_main_road_name, is_small_street_name
+from app.services.distance_utils import distance_matrix, ellipsoidal_distance
 
 logger = logging.getLogger(__name__)
 
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Straight-line fallback when OSRM is unavailable: road network detour factor
+# and assumed average speed (30 km/h)
+FALLBACK_DETOUR_FACTOR = 1.4
+FALLBACK_SPEED_MS = 30 * 1000 / 3600
+
+
+class _Flight:
+    """One in-flight OSRM call shared by concurrent identical callers."""
+    
+    __slots__ = ("task", "followers")
+    
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.followers = 0
+
 
 class OSRMService:
     """
@@ -36,6 +64,100 @@ class OSRMService:
         """
         self.base_url = base_url or settings.osrm_url
         self.timeout = httpx.Timeout(60.0, connect=10.0)
+        self.limits = httpx.Limits(
+            max_connections=settings.osrm_max_connections,
+            max_keepalive_connections=settings.osrm_max_keepalive_connections,
+            keepalive_expiry=settings.osrm_keepalive_expiry
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        # Identical concurrent calls share one request (single flight)
+        self._inflight: Dict[Tuple, _Flight] = {}
+        self.coalesced: Dict[str, int] = {}
+        # Bounds concurrent OSRM nearest queries (each asks for up to 100 candidates)
+        self._snap_semaphore: Optional[asyncio.Semaphore] = None
+        # Fails calls fast (straight to the fallbacks) while OSRM is down
+        self.breaker = CircuitBreaker(f"OSRM {self.base_url}")
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Shared HTTP client with a bounded keep-alive connection pool.
+        
+        Created on first use and closed by aclose() on application shutdown.
+        Requests beyond the pool limit wait for a free connection instead of
+        opening new ones.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=settings.osrm_http2 and HTTP2_AVAILABLE
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the shared HTTP client and its pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _request(self, url: str, params: Dict = None) -> httpx.Response:
+        """
+        GET an OSRM endpoint through the circuit breaker.
+        
+        Timeouts, connection errors and 5xx responses count as failures;
+        4xx answers (e.g. NoRoute) mean OSRM itself is healthy.
+        
+        Raises:
+            CircuitOpenError: OSRM is considered down; callers fall back
+        """
+        await self.breaker.before_call(self.check_health)
+        try:
+            response = await self.client.get(url, params=params)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+    
+    async def _coalesce(self, key: Tuple, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run call() once for all concurrent callers with the same key.
+        
+        The first caller starts the request; callers arriving while it is in
+        flight await the same task. When a result was shared, every caller gets
+        its own deep copy, since callers mutate routes and matrices in place.
+        The task is shielded so a cancelled caller does not cancel it for the
+        others.
+        
+        Args:
+            key: Hashable request identity; key[0] names the method for metrics
+            call: Zero-argument coroutine function performing the request
+        """
+        flight = self._inflight.get(key)
+        if flight is not None:
+            flight.followers += 1
+            self.coalesced[key[0]] = self.coalesced.get(key[0], 0) + 1
+            return copy.deepcopy(await asyncio.shield(flight.task))
+        
+        flight = _Flight(asyncio.ensure_future(call()))
+        self._inflight[key] = flight
+        try:
+            result = await asyncio.shield(flight.task)
+        finally:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+        return copy.deepcopy(result) if flight.followers else result
+    
+    def inflight_stats(self) -> Dict:
+        """Single-flight counters since process start."""
+        return {
+            "in_flight": len(self._inflight),
+            "coalesced": dict(self.coalesced)
+        }
     
     async def get_distance_matrix(
         self,
@@ -47,6 +169,8 @@ class OSRMService:
         Get distance and duration matrix between all coordinates.
         
         This is used by the VRP solver to know travel costs between stops.
+        Cells already in the pair cache are not requested again; only rows and
+        columns with missing cells go to OSRM as sources/destinations tables.
         
         Args:
             coordinates: List of (lat, lng) tuples
@@ -54,49 +178,200 @@ class OSRMService:
             exclude_tolls: Whether to exclude toll roads
             
         Returns:
-            Dictionary with 'distances' and 'durations' matrices
+            Dictionary with 'distances' and 'durations' as NumPy arrays
+            (NaN where OSRM found no route)
         """
         if len(coordinates) < 2:
             return {
-                "distances": [[0]],
-                "durations": [[0]],
+                "distances": np.zeros((1, 1)),
+                "durations": np.zeros((1, 1)),
                 "valid": True
             }
         
-        # OSRM expects coordinates in lng,lat format (GeoJSON order)
+        key = ("get_distance_matrix", profile, exclude_tolls, tuple(map(tuple, coordinates)))
+        return await self._coalesce(
+            key, lambda: self._fetch_distance_matrix(coordinates, profile, exclude_tolls)
+        )
+    
+    async def _fetch_distance_matrix(
+        self,
+        coordinates: List[Tuple[float, float]],
+        profile: str,
+        exclude_tolls: bool
+    ) -> Dict:
+        """Build the matrix from the pair cache and OSRM (see get_distance_matrix)."""
+        # Serve known cells from the pair cache, fetch only rows/columns with gaps
+        points = pair_cache.point_keys(coordinates)
+        distances, durations, found = await pair_cache.lookup(points, profile, exclude_tolls)
+        missing_count = int((~found).sum())
+        
+        if missing_count:
+            rows, cols = plan_missing_fetch(~found)
+            everything = list(range(len(coordinates)))
+            fetched = np.zeros_like(found)
+            
+            for sources, destinations in [(rows, everything), (everything, cols)]:
+                if not sources or not destinations:
+                    continue
+                tiles = await self.get_table_tiled(
+                    coordinates, sources, destinations, profile, exclude_tolls=exclude_tolls
+                )
+                if tiles is None:
+                    return self._fallback_distance_matrix(coordinates)
+                
+                block = np.ix_(sources, destinations)
+                distances[block], durations[block] = tiles
+                fetched[block] = True
+            
+            pair_cache.misses += missing_count
+            reachable = fetched & ~np.isnan(distances) & ~np.isnan(durations)
+            await pair_cache.store(points, distances, durations, reachable, profile, exclude_tolls)
+        
+        total = len(coordinates) * len(coordinates)
+        logger.info(f"Distance matrix: {total - missing_count}/{total} cells from cache")
+        
+        return {
+            "distances": distances,
+            "durations": durations,
+            "valid": True
+        }
+    
+    async def get_table_tiled(
+        self,
+        coordinates: List[Tuple[float, float]],
+        sources: List[int],
+        destinations: List[int],
+        profile: str = "driving",
+        exclude_tolls: bool = False
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Get a sources × destinations table of any size as tiled requests.
+        
+        OSRM rejects tables above its max-table-size (default 100), so the
+        table is split into blocks of at most settings.osrm_max_table_size
+        coordinates. Each block only sends its own coordinates, which also
+        keeps URLs short. Blocks are fetched concurrently, bounded by
+        settings.osrm_table_concurrency, and stitched together.
+        
+        Args:
+            coordinates: List of (lat, lng) tuples referenced by the indices
+            sources: Indices into coordinates used as rows
+            destinations: Indices into coordinates used as columns
+            profile: Routing profile
+            exclude_tolls: Whether to exclude toll roads
+            
+        Returns:
+            (distances, durations) arrays of shape (len(sources), len(destinations))
+            with NaN for unreachable pairs, or None if any block failed
+        """
+        max_size = max(2, settings.osrm_max_table_size)
+        half = max_size // 2
+        if len(sources) + len(destinations) <= max_size:
+            source_step, destination_step = len(sources), len(destinations)
+        elif len(sources) < half:
+            source_step, destination_step = len(sources), max_size - len(sources)
+        elif len(destinations) < half:
+            source_step, destination_step = max_size - len(destinations), len(destinations)
+        else:
+            source_step, destination_step = half, max_size - half
+        
+        semaphore = asyncio.Semaphore(settings.osrm_table_concurrency)
+        
+        async def fetch_block(row: int, col: int) -> Dict:
+            block_sources = sources[row:row + source_step]
+            block_destinations = destinations[col:col + destination_step]
+            locations = list(dict.fromkeys(block_sources + block_destinations))
+            position = {index: k for k, index in enumerate(locations)}
+            async with semaphore:
+                return await self.get_table(
+                    [coordinates[k] for k in locations],
+                    [position[i] for i in block_sources],
+                    [position[j] for j in block_destinations],
+                    profile,
+                    exclude_tolls=exclude_tolls
+                )
+        
+        offsets = [
+            (row, col)
+            for row in range(0, len(sources), source_step)
+            for col in range(0, len(destinations), destination_step)
+        ]
+        tables = await asyncio.gather(*[fetch_block(row, col) for row, col in offsets])
+        
+        if len(offsets) > 1:
+            logger.info(f"OSRM table {len(sources)}x{len(destinations)} fetched in {len(offsets)} blocks")
+        
+        distances = np.empty((len(sources), len(destinations)))
+        durations = np.empty((len(sources), len(destinations)))
+        for (row, col), table in zip(offsets, tables):
+            if not table.get("valid"):
+                return None
+            # Unreachable pairs come back as None -> NaN
+            block_distances = np.array(table["distances"], dtype=np.float64)
+            block_durations = np.array(table["durations"], dtype=np.float64)
+            rows, cols = block_distances.shape
+            distances[row:row + rows, col:col + cols] = block_distances
+            durations[row:row + rows, col:col + cols] = block_durations
+        
+        return distances, durations
+    
+    async def get_table(
+        self,
+        coordinates: List[Tuple[float, float]],
+        sources: List[int],
+        destinations: List[int],
+        profile: str = "driving",
+        annotations: str = "distance,duration",
+        exclude_tolls: bool = False
+    ) -> Dict:
+        """
+        Get a rectangular sources × destinations block of the table.
+        
+        Unlike get_distance_matrix this does not fall back to straight-line
+        distances; callers decide what to do when 'valid' is False.
+        
+        Args:
+            coordinates: List of (lat, lng) tuples referenced by the indices
+            sources: Indices into coordinates used as rows
+            destinations: Indices into coordinates used as columns
+            profile: Routing profile
+            annotations: OSRM annotations to request
+            exclude_tolls: Whether to exclude toll roads
+        
+        Returns:
+            Dictionary with 'distances' and/or 'durations' blocks (entries may
+            be None for unreachable pairs) and 'valid'
+        """
         coords_str = ";".join([f"{lng},{lat}" for lat, lng in coordinates])
         
         url = f"{self.base_url}/table/v1/{profile}/{coords_str}"
         params = {
-            "annotations": "distance,duration"
+            "sources": ";".join(str(i) for i in sources),
+            "destinations": ";".join(str(i) for i in destinations),
+            "annotations": annotations
         }
         
-        # Add toll exclusion if requested
         if exclude_tolls:
             params["exclude"] = "toll"
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                
-                if data.get("code") != "Ok":
-                    logger.error(f"OSRM error: {data.get('message', 'Unknown error')}")
-                    return self._fallback_distance_matrix(coordinates)
-                
-                return {
-                    "distances": data.get("distances", []),
-                    "durations": data.get("durations", []),
-                    "valid": True
-                }
-                
-        except httpx.HTTPError as e:
-            logger.error(f"OSRM HTTP error: {e}")
-            return self._fallback_distance_matrix(coordinates)
+            response = await self._request(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            
+            if data.get("code") != "Ok":
+                logger.error(f"OSRM table error: {data.get('message', 'Unknown error')}")
+                return {"valid": False, "error": data.get("message")}
+            
+            return {
+                "distances": data.get("distances"),
+                "durations": data.get("durations"),
+                "valid": True
+            }
+        
         except Exception as e:
-            logger.error(f"OSRM error: {e}")
-            return self._fallback_distance_matrix(coordinates)
+            logger.error(f"OSRM table error: {e}")
+            return {"valid": False, "error": str(e)}
     
     def _fallback_distance_matrix(
         self,
@@ -105,30 +380,20 @@ class OSRMService:
         """
         Calculate straight-line distance matrix as fallback when OSRM is unavailable.
         
-        Uses Haversine formula for geodesic distance.
-        """
-        from geopy.distance import geodesic
-        
-        n = len(coordinates)
-        distances = np.zeros((n, n))
-        durations = np.zeros((n, n))
-        
-        # Assume average speed of 30 km/h for duration estimation
-        avg_speed_ms = 30 * 1000 / 3600  # m/s
+        Uses the vectorized ellipsoidal kernel from distance_utils; durations
+        assume the road detour factor at the fallback average speed.
         
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    dist = geodesic(coordinates[i], coordinates[j]).meters
-                    distances[i][j] = dist
-                    # Multiply by 1.4 to account for road network vs straight line
-                    durations[i][j] = (dist * 1.4) / avg_speed_ms
+        Returns:
+            Dictionary with 'distances' and 'durations' as NumPy arrays
+        """
+        distances = distance_matrix(np.asarray(coordinates, dtype=np.float64))
+        durations = distances * (FALLBACK_DETOUR_FACTOR / FALLBACK_SPEED_MS)
         
         logger.warning("Using fallback distance matrix (straight-line distances)")
         
         return {
-            "distances": distances.tolist(),
-            "durations": durations.tolist(),
+            "distances": distances,
+            "durations": durations,
             "valid": False,
             "fallback": True
         }
@@ -157,6 +422,143 @@ class OSRMService:
                 "duration": 0
             }
         
+        # Same sequence routed before: serve a fresh copy from the route cache
+        cache_key = route_cache.key(coordinates, profile, exclude_tolls)
+        cached = await route_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        async def fetch() -> Dict:
+            route = await self._fetch_route(coordinates, profile, exclude_tolls)
+            if not route.get("fallback"):
+                await route_cache.put(cache_key, route, profile, exclude_tolls)
+            return route
+        
+        return await self._coalesce(("get_route", cache_key), fetch)
+    
+    async def get_route_preview(
+        self,
+        coordinates: List[Tuple[float, float]],
+        profile: str = "driving",
+        exclude_tolls: bool = False
+    ) -> Dict:
+        """
+        Get an approximate route through all coordinates for edit previews.
+        
+        A route already cached by get_route is returned as is. Otherwise the
+        route is stitched from cached legs and only the missing legs are
+        requested. Legs are routed without continue_straight (so they do not
+        depend on the approach heading), which may differ slightly from the
+        route get_route returns; results are not put in the route cache.
+        
+        Args:
+            coordinates: List of (lat, lng) tuples in visit order
+            profile: Routing profile
+            exclude_tolls: Whether to exclude toll roads
+            
+        Returns:
+            Route data including geometry, distance, duration
+        """
+        if len(coordinates) < 2:
+            return {
+                "geometry": [],
+                "distance": 0,
+                "duration": 0
+            }
+        
+        cache_key = route_cache.key(coordinates, profile, exclude_tolls)
+        cached = await route_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        return await self._coalesce(
+            ("get_route_preview", cache_key),
+            lambda: self._route_from_legs(coordinates, profile, exclude_tolls)
+        )
+    
+    async def get_multiple_routes(
+        self,
+        coordinate_lists: List[List[Tuple[float, float]]],
+        profile: str = "driving",
+        exclude_tolls: bool = False
+    ) -> List[Dict]:
+        """
+        Get routes for several coordinate sequences concurrently.
+        
+        At most settings.osrm_route_concurrency routes are requested at a time.
+        
+        Args:
+            coordinate_lists: One list of (lat, lng) tuples per route, in visit order
+            profile: Routing profile
+            exclude_tolls: Whether to exclude toll roads
+            
+        Returns:
+            get_route results in the order of coordinate_lists
+        """
+        semaphore = asyncio.Semaphore(settings.osrm_route_concurrency)
+        
+        async def fetch(coordinates: List[Tuple[float, float]]) -> Dict:
+            async with semaphore:
+                return await self.get_route(coordinates, profile, exclude_tolls)
+        
+        return await asyncio.gather(*[fetch(coordinates) for coordinates in coordinate_lists])
+    
+    async def _route_from_legs(
+        self,
+        coordinates: List[Tuple[float, float]],
+        profile: str,
+        exclude_tolls: bool
+    ) -> Dict:
+        """
+        Assemble a route from cached legs, routing only the missing ones.
+        
+        Consecutive missing legs are fetched as one OSRM request per run, and
+        runs are fetched concurrently.
+        """
+        keys = [
+            leg_cache.key(coordinates[i], coordinates[i + 1], profile, exclude_tolls)
+            for i in range(len(coordinates) - 1)
+        ]
+        legs = [leg_cache.get(key) for key in keys]
+        
+        # Contiguous runs of missing legs as [first_leg, last_leg]
+        runs = []
+        for i, leg in enumerate(legs):
+            if leg is None:
+                if runs and runs[-1][1] == i - 1:
+                    runs[-1][1] = i
+                else:
+                    runs.append([i, i])
+        
+        if runs:
+            fetched = await asyncio.gather(*[
+                self._fetch_route(coordinates[first:last + 2], profile, exclude_tolls, continue_straight=False)
+                for first, last in runs
+            ])
+            for (first, last), route in zip(runs, fetched):
+                if route.get("fallback") or len(route.get("legs", [])) != last - first + 1:
+                    return self._fallback_route(coordinates)
+                for offset, leg in enumerate(route["legs"]):
+                    legs[first + offset] = leg_cache.put(keys[first + offset], leg)
+            
+            missing = sum(last - first + 1 for first, last in runs)
+            logger.info(f"Route: {len(legs) - missing}/{len(legs)} legs from cache, {len(runs)} OSRM requests")
+        
+        return stitch_legs(legs)
+    
+    async def _fetch_route(
+        self,
+        coordinates: List[Tuple[float, float]],
+        profile: str,
+        exclude_tolls: bool,
+        continue_straight: Optional[bool] = None
+    ) -> Dict:
+        """
+        Request a route from OSRM (straight-line fallback on failure).
+        
+        continue_straight=None keeps OSRM's profile default; legs meant for the
+        leg cache pass False so they do not depend on the previous leg's heading.
+        """
         # OSRM expects lng,lat format
         coords_str = ";".join([f"{lng},{lat}" for lat, lng in coordinates])
         
@@ -166,33 +568,34 @@ class OSRMService:
             "geometries": "geojson",
             "steps": "true"
         }
+        if continue_straight is not None:
+            params["continue_straight"] = str(continue_straight).lower()
         
         # Add toll exclusion if requested
         if exclude_tolls:
             params["exclude"] = "toll"
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                
-                if data.get("code") != "Ok":
-                    logger.error(f"OSRM route error: {data.get('message')}")
-                    return self._fallback_route(coordinates)
-                
-                route = data.get("routes", [{}])[0]
-                geometry = route.get("geometry", {}).get("coordinates", [])
-                
-                # Convert from [lng, lat] to [lat, lng]
-                polyline = [{"lat": coord[1], "lng": coord[0]} for coord in geometry]
-                
-                return {
-                    "geometry": polyline,
-                    "distance": route.get("distance", 0),
-                    "duration": route.get("duration", 0),
-                    "legs": route.get("legs", [])
-                }
+            response = await self._request(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            
+            if data.get("code") != "Ok":
+                logger.error(f"OSRM route error: {data.get('message')}")
+                return self._fallback_route(coordinates)
+            
+            route = data.get("routes", [{}])[0]
+            geometry = route.get("geometry", {}).get("coordinates", [])
+            
+            # Convert from [lng, lat] to [lat, lng]
+            polyline = [{"lat": coord[1], "lng": coord[0]} for coord in geometry]
+            
+            return {
+                "geometry": polyline,
+                "distance": route.get("distance", 0),
+                "duration": route.get("duration", 0),
+                "legs": route.get("legs", [])
+            }
                 
         except httpx.HTTPError as e:
             logger.error(f"OSRM route HTTP error: {e}")
@@ -208,32 +611,31 @@ class OSRMService:
         """
         Create a simple straight-line route as fallback.
         """
-        from geopy.distance import geodesic
-        
         polyline = [{"lat": lat, "lng": lng} for lat, lng in coordinates]
         
-        total_distance = 0
-        for i in range(len(coordinates) - 1):
-            total_distance += geodesic(coordinates[i], coordinates[i + 1]).meters
-        
-        # Estimate duration at 30 km/h average
-        total_duration = (total_distance * 1.4) / (30 * 1000 / 3600)
+        points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        total_distance = float(ellipsoidal_distance(
+            points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1]
+        ).sum())
         
         return {
             "geometry": polyline,
-            "distance": total_distance * 1.4,  # Account for roads
-            "duration": total_duration,
+            "distance": total_distance * FALLBACK_DETOUR_FACTOR,  # Account for roads
+            "duration": total_distance * FALLBACK_DETOUR_FACTOR / FALLBACK_SPEED_MS,
             "fallback": True
         }
     
     async def check_health(self) -> bool:
-        """Check if OSRM service is available."""
+        """
+        Check if OSRM service is available.
+        
+        Bypasses the circuit breaker; it is the breaker's half-open probe.
+        """
         try:
             # Simple request to check if OSRM is responding
             url = f"{self.base_url}/route/v1/driving/0,0;1,1"
-            async with httpx.AsyncClient(timeout=httpx.Timeout(5.0)) as client:
-                response = await client.get(url)
-                return response.status_code in [200, 400]  # 400 means it's responding but invalid coords
+            response = await self.client.get(url, timeout=5.0)
+            return response.status_code in [200, 400]  # 400 means it's responding but invalid coords
         except Exception:
             return False
     
@@ -274,10 +676,9 @@ class OSRMService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                return response.json()
+            response = await self._request(url, params=params)
+            response.raise_for_status()
+            return response.json()
         except Exception as e:
             logger.error(f"OSRM trip error: {e}")
             return {"waypoints": [], "trips": [], "error": str(e)}
@@ -294,6 +695,9 @@ class OSRMService:
         
         Uses OSRM's nearest service to find the closest point on a road.
         Prefers main roads over small residential streets (Sokak) when possible.
+        Road points already selected for the same snap cache cell are reused
+        without querying OSRM. With a road index (settings.road_index_path) the
+        driving profile is snapped locally by highway class and name.
         
         Args:
             coordinate: (lat, lng) tuple
@@ -304,95 +708,94 @@ class OSRMService:
         Returns:
             Dictionary with snapped location and walking distance
         """
+        cell = snap_cache.key(coordinate, profile, prefer_main_roads, max_distance)
+        cached = snap_cache.get(cell, coordinate)
+        if cached is not None:
+            return cached
+        
+        road_index = get_road_index() if profile == "driving" else None
+        if road_index is not None:
+            result = road_index.snap(coordinate, prefer_main_roads, max_distance)
+            if result is not None:
+                snap_cache.put(cell, result)
+                return result
+        
+        key = ("snap_to_road", profile, prefer_main_roads, max_distance, coordinate[0], coordinate[1])
+        result = await self._coalesce(
+            key, lambda: self._snap_to_road(coordinate, profile, prefer_main_roads, max_distance)
+        )
+        snap_cache.put(cell, result)
+        return result
+    
+    async def _snap_to_road(
+        self,
+        coordinate: Tuple[float, float],
+        profile: str,
+        prefer_main_roads: bool,
+        max_distance: float
+    ) -> Dict:
+        """Query OSRM nearest and pick a road point (see snap_to_road)."""
         lat, lng = coordinate
         url = f"{self.base_url}/nearest/v1/{profile}/{lng},{lat}"
         # Get many results to find main roads
         params = {"number": 100 if prefer_main_roads else 1}
         
-        # Turkish road naming convention:
-        # Main roads: Cadde, Bulvar, Bağlantı Yolu (connector roads)
-        # Small residential streets: Sokak, Sokağı, Sk., Sok.
-        main_road_keywords = [
-            "cadde", "caddesi", "cad.", "cad ", 
-            "bulvar", "bulvarı", "blv.", "blv ",
-            "bağlantı", "ana yol", "anayol",
-            "otoyol", "devlet yolu", "d-", "e-", "o-"
-        ]
-        # Small residential street patterns - these are NOT suitable for bus stops
-        small_street_patterns = [
-            "sokak", "sokağı", "sokaği", 
-            " sk.", " sk ", "sk.", 
-            " sok.", " sok ", "sok.",
-            "ara yol", "arayol"
-        ]
+        if self._snap_semaphore is None:
+            self._snap_semaphore = asyncio.Semaphore(settings.osrm_snap_concurrency)
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
+            async with self._snap_semaphore:
+                response = await self._request(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            
+            if data.get("code") == "Ok" and data.get("waypoints"):
+                waypoints = data["waypoints"]
+                
+                selected_waypoint = waypoints[0]  # Default to closest
                 
-                if data.get("code") == "Ok" and data.get("waypoints"):
-                    waypoints = data["waypoints"]
+                if prefer_main_roads:
+                    # Extended search radius for main roads - allow much farther for cadde
+                    main_road_max_distance = max_distance * 3.0  # Allow 3x distance (1.5km) for main roads
                     
-                    selected_waypoint = waypoints[0]  # Default to closest
+                    # Priority 1: Find named main roads (Cadde/Bulvar/Bağlantı)
+                    main_road_waypoints = [
+                        wp for wp in waypoints 
+                        if is_main_road_name(wp.get("name")) and wp.get("distance", float("inf")) <= main_road_max_distance
+                    ]
                     
-                    if prefer_main_roads:
-                        # Extended search radius for main roads - allow much farther for cadde
-                        main_road_max_distance = max_distance * 3.0  # Allow 3x distance (1.5km) for main roads
-                        
-                        # Helper to check if road is a small residential street
-                        def is_small_street(name):
-                            if not name:
-                                return False
-                            name_lower = name.lower()
-                            return any(pattern in name_lower for pattern in small_street_patterns)
-                        
-                        # Helper to check if road is a main road
-                        def is_main_road(name):
-                            if not name:
-                                return False
-                            name_lower = name.lower()
-                            return any(keyword in name_lower for keyword in main_road_keywords)
-                        
-                        # Priority 1: Find named main roads (Cadde/Bulvar/Bağlantı)
-                        main_road_waypoints = [
-                            wp for wp in waypoints 
-                            if is_main_road(wp.get("name")) and wp.get("distance", float("inf")) <= main_road_max_distance
+                    if main_road_waypoints:
+                        selected_waypoint = min(main_road_waypoints, key=lambda w: w.get("distance", float("inf")))
+                        logger.info(f"✓ Ana cadde tercih edildi: {selected_waypoint.get('name')} ({selected_waypoint.get('distance'):.0f}m uzakta)")
+                    else:
+                        # Priority 2: Find any road that's NOT a small residential street
+                        non_sokak_waypoints = [
+                            wp for wp in waypoints
+                            if not is_small_street_name(wp.get("name")) and wp.get("distance", float("inf")) <= main_road_max_distance
                         ]
                         
-                        if main_road_waypoints:
-                            selected_waypoint = min(main_road_waypoints, key=lambda w: w.get("distance", float("inf")))
-                            logger.info(f"✓ Ana cadde tercih edildi: {selected_waypoint.get('name')} ({selected_waypoint.get('distance'):.0f}m uzakta)")
+                        if non_sokak_waypoints:
+                            selected_waypoint = min(non_sokak_waypoints, key=lambda w: w.get("distance", float("inf")))
+                            road_name = selected_waypoint.get('name') or '(isimsiz yol)'
+                            logger.info(f"✓ Sokak olmayan yol seçildi: {road_name} ({selected_waypoint.get('distance'):.0f}m)")
                         else:
-                            # Priority 2: Find any road that's NOT a small residential street
-                            non_sokak_waypoints = [
-                                wp for wp in waypoints
-                                if not is_small_street(wp.get("name")) and wp.get("distance", float("inf")) <= main_road_max_distance
-                            ]
-                            
-                            if non_sokak_waypoints:
-                                selected_waypoint = min(non_sokak_waypoints, key=lambda w: w.get("distance", float("inf")))
-                                road_name = selected_waypoint.get('name') or '(isimsiz yol)'
-                                logger.info(f"✓ Sokak olmayan yol seçildi: {road_name} ({selected_waypoint.get('distance'):.0f}m)")
-                            else:
-                                # Priority 3: Use nearest road but log warning
-                                for wp in waypoints:
-                                    if wp.get("distance", float("inf")) <= max_distance:
-                                        selected_waypoint = wp
-                                        break
-                                logger.warning(f"⚠ Ana yol bulunamadı, en yakın kullanıldı: {selected_waypoint.get('name')} ({selected_waypoint.get('distance'):.0f}m)")
-                    
-                    snapped_lng, snapped_lat = selected_waypoint["location"]
-                    distance = selected_waypoint.get("distance", 0)
-                    
-                    return {
-                        "original": {"lat": lat, "lng": lng},
-                        "snapped": {"lat": snapped_lat, "lng": snapped_lng},
-                        "walking_distance": distance,
-                        "road_name": selected_waypoint.get("name", ""),
-                        "valid": True
-                    }
+                            # Priority 3: Use nearest road but log warning
+                            for wp in waypoints:
+                                if wp.get("distance", float("inf")) <= max_distance:
+                                    selected_waypoint = wp
+                                    break
+                            logger.warning(f"⚠ Ana yol bulunamadı, en yakın kullanıldı: {selected_waypoint.get('name')} ({selected_waypoint.get('distance'):.0f}m)")
+                
+                snapped_lng, snapped_lat = selected_waypoint["location"]
+                distance = selected_waypoint.get("distance", 0)
+                
+                return {
+                    "original": {"lat": lat, "lng": lng},
+                    "snapped": {"lat": snapped_lat, "lng": snapped_lng},
+                    "walking_distance": distance,
+                    "road_name": selected_waypoint.get("name", ""),
+                    "valid": True
+                }
                     
         except Exception as e:
             logger.error(f"OSRM nearest error: {e}")
@@ -410,28 +813,57 @@ class OSRMService:
         self,
         coordinates: List[Tuple[float, float]],
         profile: str = "driving",
-        prefer_main_roads: bool = True
+        prefer_main_roads: bool = True,
+        max_distance: float = 500
     ) -> List[Dict]:
         """
         Snap multiple coordinates to the road network.
         
+        Coordinates sharing a snap cache cell are queried once (again, all at
+        once, only if the cell's first snap was invalid); at most
+        settings.osrm_snap_concurrency nearest requests run at a time.
+        
         Args:
             coordinates: List of (lat, lng) tuples
             profile: Routing profile
             prefer_main_roads: Whether to prefer main roads (Cadde) over small streets (Sokak)
+            max_distance: Maximum acceptable distance to snap point (meters)
             
         Returns:
             List of snapped results with walking distances
         """
-        # Process in parallel for better performance
-        tasks = [self.snap_to_road(coord, profile, prefer_main_roads) for coord in coordinates]
-        results = await asyncio.gather(*tasks)
+        # One OSRM query per distinct cell; the others are served from the snap cache
+        first_in_cell: Dict[Tuple, int] = {}
+        for index, coord in enumerate(coordinates):
+            first_in_cell.setdefault(snap_cache.key(coord, profile, prefer_main_roads, max_distance), index)
+        leaders = sorted(first_in_cell.values())
+        
+        results: List[Optional[Dict]] = [None] * len(coordinates)
+        snapped = await asyncio.gather(*[
+            self.snap_to_road(coordinates[index], profile, prefer_main_roads, max_distance)
+            for index in leaders
+        ])
+        for index, result in zip(leaders, snapped):
+            results[index] = result
+        
+        # Cells whose leader got no valid snap are not cached; their other
+        # coordinates are queried concurrently (bounded by the snap semaphore)
+        rest = [index for index, result in enumerate(results) if result is None]
+        snapped = await asyncio.gather(*[
+            self.snap_to_road(coordinates[index], profile, prefer_main_roads, max_distance)
+            for index in rest
+        ])
+        for index, result in zip(rest, snapped):
+            results[index] = result
         return results
 
 
 # Singleton instance
 osrm_service = OSRMService()
 
+# Foot-profile instance used for walking-network clustering
+osrm_foot_service = OSRMService(settings.osrm_foot_url)
+
 
 async def get_distance_matrix(coordinates: List[Tuple[float, float]]) -> Dict:
     """Convenience function to get distance matrix."""
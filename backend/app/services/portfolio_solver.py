@@ -0,0 +1,149 @@
+"""
+Portfolio Solver - Parallel CVRP searches with different strategies
+
+A single OR-Tools search uses one core. In portfolio mode the same problem
+is solved by several worker processes at once, each with a different first
+solution strategy / metaheuristic (see portfolio_strategies), and the result
+with the lowest objective wins. All members share the same model, so their
+objectives are directly comparable.
+
+The distance and duration matrices are placed in shared memory once; each
+member attaches to them instead of receiving its own pickled copy.
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.workers import attach_shared_array, process_pool_size, run_in_process, shared_arrays
+from app.services.optimization_service import Matrix, create_optimized_routes, portfolio_strategies
+
+logger = logging.getLogger(__name__)
+
+
+def portfolio_size() -> int:
+    """
+    Configured number of portfolio members, capped at the worker pool size.
+
+    The default leaves one worker free, so clustering and other solves are
+    not queued behind a portfolio for its whole time limit.
+    """
+    pool = process_pool_size()
+    size = settings.solver_portfolio_size or pool - 1
+    return max(1, min(size, pool))
+
+
+def _solve_member(
+    distance_ref: Dict,
+    duration_ref: Optional[Dict],
+    stops: List[Dict],
+    depot_location: Tuple[float, float],
+    **kwargs
+) -> Dict:
+    """Worker entry point: attach to the shared matrices and solve."""
+    distance_block, distance_matrix = attach_shared_array(distance_ref)
+    duration_block, duration_matrix = attach_shared_array(duration_ref)
+    try:
+        return create_optimized_routes(
+            stops=stops,
+            depot_location=depot_location,
+            distance_matrix=distance_matrix,
+            duration_matrix=duration_matrix,
+            **kwargs
+        )
+    finally:
+        # The solver keeps its own integer copies; release the views first
+        del distance_matrix, duration_matrix
+        for block in (distance_block, duration_block):
+            if block is not None:
+                block.close()
+
+
+async def create_optimized_routes_portfolio(
+    stops: List[Dict],
+    depot_location: Tuple[float, float],
+    distance_matrix: Matrix,
+    duration_matrix: Optional[Matrix] = None,
+    size: Optional[int] = None,
+    **kwargs
+) -> Dict:
+    """
+    Run create_optimized_routes as a portfolio and return the best result.
+
+    With a portfolio size of 1 this is a single search in the process pool.
+
+    Args:
+        stops, depot_location, distance_matrix, duration_matrix: As for
+            create_optimized_routes
+        size: Number of parallel searches (default: portfolio_size())
+        **kwargs: Remaining create_optimized_routes arguments
+
+    Returns:
+        create_optimized_routes result of the best member, with a 'portfolio'
+        list summarizing every member
+    """
+    size = size or portfolio_size()
+    if size <= 1:
+        return await run_in_process(
+            create_optimized_routes,
+            stops=stops,
+            depot_location=depot_location,
+            distance_matrix=distance_matrix,
+            duration_matrix=duration_matrix,
+            **kwargs
+        )
+
+    strategies = portfolio_strategies(size)
+    logger.info(f"Portfolio solve: {size} parallel searches")
+
+    with shared_arrays(
+        distance=np.asarray(distance_matrix, dtype=np.float64),
+        duration=None if duration_matrix is None else np.asarray(duration_matrix, dtype=np.float64)
+    ) as refs:
+        results = await asyncio.gather(*[
+            run_in_process(
+                _solve_member,
+                refs["distance"],
+                refs["duration"],
+                stops,
+                depot_location,
+                search_strategy=strategy,
+                **kwargs
+            )
+            for strategy in strategies
+        ], return_exceptions=True)
+
+    members = []
+    best = None
+    for strategy, result in zip(strategies, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Portfolio member {strategy} failed: {result}")
+            members.append({"search_strategy": strategy, "status": "ERROR", "objective": None})
+            continue
+        members.append({
+            "search_strategy": strategy,
+            "status": result["status"],
+            "objective": result["objective"],
+            "vehicles_used": result["vehicles_used"],
+            "total_distance": result["total_distance"]
+        })
+        if result["status"] == "NO_SOLUTION" or result["objective"] is None:
+            continue
+        if best is None or result["objective"] < best["objective"]:
+            best = result
+
+    if best is None:
+        # Every member failed; re-raise the first error, else report no solution
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if len(errors) == len(results):
+            raise errors[0]
+        best = next(r for r in results if not isinstance(r, BaseException))
+
+    logger.info(
+        f"Portfolio best: {best['search_strategy']} objective={best['objective']} "
+        f"(of {[m['objective'] for m in members]})"
+    )
+    best["portfolio"] = members
+    return best
@@ -0,0 +1,272 @@
+"""
+Road Index - Offline road-class index for main-road stop snapping
+
+snap_to_road asks OSRM nearest for 100 candidates per stop and then picks a
+main road (Cadde/Bulvar) over residential streets (Sokak) by name. The same
+decision can be made locally from the OSM extract that osrm-prepare consumes:
+drivable ways are stored with their highway class, name and geometry, and a
+shapely STRtree answers "nearest main road within r meters" without an HTTP
+round-trip.
+
+Build the index once per extract (needs pyosmium: pip install osmium):
+
+    python -m app.services.road_index /data/map.osm.pbf /data/road_index.npz
+
+and point settings.road_index_path at the output. Without an index file,
+snap_to_road keeps using OSRM nearest.
+"""
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+import logging
+
+from app.core.config import settings
+from app.services.distance_utils import ellipsoidal_distance
+
+logger = logging.getLogger(__name__)
+
+# Drivable highway classes (car.lua), indexed by their stored class code
+HIGHWAY_CLASSES = [
+    "motorway", "trunk", "primary", "secondary", "tertiary",
+    "motorway_link", "trunk_link", "primary_link", "secondary_link", "tertiary_link",
+    "unclassified", "residential", "living_street", "service"
+]
+_CLASS_CODES = {highway: code for code, highway in enumerate(HIGHWAY_CLASSES)}
+
+# Classes that count as main roads / small streets regardless of the name
+MAIN_ROAD_CLASSES = {
+    "motorway", "trunk", "primary", "secondary", "tertiary",
+    "trunk_link", "primary_link", "secondary_link", "tertiary_link"
+}
+SMALL_STREET_CLASSES = {"residential", "living_street", "service"}
+
+# Turkish road naming convention:
+# Main roads: Cadde, Bulvar, Bağlantı Yolu (connector roads)
+# Small residential streets: Sokak, Sokağı, Sk., Sok.
+MAIN_ROAD_KEYWORDS = [
+    "cadde", "caddesi", "cad.", "cad ",
+    "bulvar", "bulvarı", "blv.", "blv ",
+    "bağlantı", "ana yol", "anayol",
+    "otoyol", "devlet yolu", "d-", "e-", "o-"
+]
+# Small residential street patterns - these are NOT suitable for bus stops
+SMALL_STREET_PATTERNS = [
+    "sokak", "sokağı", "sokaği",
+    " sk.", " sk ", "sk.",
+    " sok.", " sok ", "sok.",
+    "ara yol", "arayol"
+]
+
+# Meters per degree used by the index's local equirectangular projection
+_METERS_PER_DEGREE_LAT = 110574.0
+_METERS_PER_DEGREE_LNG_EQUATOR = 111320.0
+
+
+def is_main_road_name(name: Optional[str]) -> bool:
+    """True if the road name looks like a Cadde/Bulvar/connector road."""
+    if not name:
+        return False
+    name_lower = name.lower()
+    return any(keyword in name_lower for keyword in MAIN_ROAD_KEYWORDS)
+
+
+def is_small_street_name(name: Optional[str]) -> bool:
+    """True if the road name looks like a residential street (Sokak)."""
+    if not name:
+        return False
+    name_lower = name.lower()
+    return any(pattern in name_lower for pattern in SMALL_STREET_PATTERNS)
+
+
+class RoadIndex:
+    """
+    STRtree over drivable road ways with their highway class and name.
+    """
+
+    def __init__(
+        self,
+        coordinates: np.ndarray,
+        offsets: np.ndarray,
+        classes: np.ndarray,
+        names: np.ndarray
+    ):
+        """
+        Build the tree from flat way arrays.
+
+        Args:
+            coordinates: Array of shape (n, 2) with [lat, lng] of all way nodes
+            offsets: Way k uses coordinates[offsets[k]:offsets[k + 1]]
+            classes: Class code (index into HIGHWAY_CLASSES) per way
+            names: Road name per way ('' if unnamed)
+        """
+        self.classes = classes
+        self.names = names
+        self.reference_lat = float(coordinates[:, 0].mean()) if len(coordinates) else 0.0
+        self._lng_scale = float(_METERS_PER_DEGREE_LNG_EQUATOR * np.cos(np.radians(self.reference_lat)))
+
+        projected = self._project(coordinates)
+        self.ways = shapely.linestrings(
+            projected,
+            indices=np.repeat(np.arange(len(classes)), np.diff(offsets))
+        )
+        self.tree = STRtree(self.ways)
+
+        class_names = np.array(HIGHWAY_CLASSES)[classes]
+        self.main_road = np.isin(class_names, list(MAIN_ROAD_CLASSES)) | np.array(
+            [is_main_road_name(name) for name in names.tolist()], dtype=bool
+        )
+        self.small_street = (
+            np.isin(class_names, list(SMALL_STREET_CLASSES))
+            | np.array([is_small_street_name(name) for name in names.tolist()], dtype=bool)
+        ) & ~self.main_road
+
+    def __len__(self) -> int:
+        return len(self.classes)
+
+    def _project(self, coordinates: np.ndarray) -> np.ndarray:
+        """[lat, lng] degrees to local [x, y] meters."""
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack([
+            coordinates[:, 1] * self._lng_scale,
+            coordinates[:, 0] * _METERS_PER_DEGREE_LAT
+        ])
+
+    def _unproject(self, x: float, y: float) -> Tuple[float, float]:
+        return y / _METERS_PER_DEGREE_LAT, x / self._lng_scale
+
+    @classmethod
+    def load(cls, path: str) -> "RoadIndex":
+        """Load an index written by build_road_index."""
+        with np.load(path) as data:
+            return cls(data["coordinates"], data["offsets"], data["classes"], data["names"])
+
+    def snap(
+        self,
+        coordinate: Tuple[float, float],
+        prefer_main_roads: bool = True,
+        max_distance: float = 500
+    ) -> Optional[Dict]:
+        """
+        Pick a road point with the same priorities as snap_to_road.
+
+        1. Nearest main road (by class or name) within 3 × max_distance
+        2. Nearest road that is not a small street within 3 × max_distance
+        3. Nearest road within max_distance
+
+        Returns:
+            snap_to_road-style result, or None if no road is within range
+        """
+        lat, lng = coordinate
+        search_distance = max_distance * 3.0 if prefer_main_roads else max_distance
+        point = shapely.points(self._project([(lat, lng)])[0])
+
+        candidates = self.tree.query(point, predicate="dwithin", distance=search_distance)
+        if len(candidates) == 0:
+            return None
+        distances = shapely.distance(self.ways[candidates], point)
+
+        choice = None
+        if prefer_main_roads:
+            for mask in (self.main_road[candidates], ~self.small_street[candidates]):
+                if mask.any():
+                    choice = candidates[mask][np.argmin(distances[mask])]
+                    break
+        if choice is None:
+            nearest = int(np.argmin(distances))
+            if distances[nearest] > max_distance:
+                return None
+            choice = candidates[nearest]
+
+        way = self.ways[choice]
+        snapped = way.interpolate(way.project(point))
+        snapped_lat, snapped_lng = self._unproject(snapped.x, snapped.y)
+
+        return {
+            "original": {"lat": lat, "lng": lng},
+            "snapped": {"lat": snapped_lat, "lng": snapped_lng},
+            "walking_distance": float(ellipsoidal_distance(lat, lng, snapped_lat, snapped_lng)),
+            "road_name": str(self.names[choice]),
+            "road_class": HIGHWAY_CLASSES[int(self.classes[choice])],
+            "valid": True
+        }
+
+
+_index: Optional[RoadIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_road_index() -> Optional[RoadIndex]:
+    """Return the road index from settings.road_index_path, or None if not configured."""
+    global _index, _index_loaded
+    with _index_lock:
+        if not _index_loaded:
+            _index_loaded = True
+            if settings.road_index_path:
+                try:
+                    _index = RoadIndex.load(settings.road_index_path)
+                    logger.info(f"Road index loaded: {len(_index)} ways from {settings.road_index_path}")
+                except Exception as e:
+                    logger.warning(f"Road index unavailable, snapping via OSRM nearest: {e}")
+        return _index
+
+
+def build_road_index(pbf_path: str, output_path: str) -> int:
+    """
+    Extract drivable ways from an OSM extract into an index file.
+
+    Args:
+        pbf_path: OSM extract (.osm.pbf), the same file osrm-prepare uses
+        output_path: Target .npz file
+
+    Returns:
+        Number of ways written
+    """
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("Building the road index needs pyosmium: pip install osmium")
+
+    coordinates: List[Tuple[float, float]] = []
+    offsets = [0]
+    classes: List[int] = []
+    names: List[str] = []
+
+    class WayHandler(osmium.SimpleHandler):
+        def way(self, way):
+            code = _CLASS_CODES.get(way.tags.get("highway"))
+            if code is None:
+                return
+            try:
+                points = [(node.lat, node.lon) for node in way.nodes]
+            except osmium.InvalidLocationError:
+                return
+            if len(points) < 2:
+                return
+            coordinates.extend(points)
+            offsets.append(len(coordinates))
+            classes.append(code)
+            names.append(way.tags.get("name", ""))
+
+    WayHandler().apply_file(pbf_path, locations=True)
+
+    np.savez_compressed(
+        output_path,
+        coordinates=np.array(coordinates, dtype=np.float64).reshape(-1, 2),
+        offsets=np.array(offsets, dtype=np.int64),
+        classes=np.array(classes, dtype=np.int8),
+        names=np.array(names, dtype=str)
+    )
+    return len(classes)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m app.services.road_index <map.osm.pbf> <road_index.npz>")
+        sys.exit(1)
+    way_count = build_road_index(sys.argv[1], sys.argv[2])
+    print(f"Wrote {way_count} ways to {sys.argv[2]}")
@@ -0,0 +1,342 @@
+"""
+Route Cache - Content-addressed caches of OSRM route results
+
+Previews, commits and re-optimizations often route the exact same stop
+sequence. Results of get_route are cached under a hash of (coordinate
+sequence, profile, exclude_tolls):
+
+- In process, an LRU bounded by settings.route_cache_max_bytes. Geometry is
+  kept as a compact NumPy array and legs as JSON, so every hit hands out a
+  fresh copy; callers mutate polylines in place (e.g. depot insertion).
+- Optionally in the osrm_route_cache table (settings.route_cache_persist),
+  kept to settings.route_cache_max_rows rows by evicting the least
+  recently used routes.
+
+Edits change only one or two legs of a route, so legs (A -> B geometry,
+distance, duration) are cached as well, bounded by
+settings.leg_cache_max_bytes. Edit previews (get_route_preview) assemble a
+new sequence from cached legs and request only the missing legs from OSRM;
+legs are routed without continue_straight, so a stitched route approximates
+the full route get_route returns.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Coordinates are rounded to 1e-6 degrees (~0.1 m) when building keys
+_KEY_DECIMALS = 6
+
+
+class _Entry:
+    """Compact stored form of one route result."""
+
+    __slots__ = ("geometry", "legs_json", "distance", "duration", "size")
+
+    def __init__(self, route: Dict):
+        self.geometry = np.array(
+            [(p["lat"], p["lng"]) for p in route.get("geometry", [])],
+            dtype=np.float64
+        ).reshape(-1, 2)
+        self.legs_json = json.dumps(route.get("legs", []))
+        self.distance = route.get("distance", 0)
+        self.duration = route.get("duration", 0)
+        self.size = self.geometry.nbytes + len(self.legs_json)
+
+    def to_route(self) -> Dict:
+        return {
+            "geometry": [{"lat": lat, "lng": lng} for lat, lng in self.geometry.tolist()],
+            "distance": self.distance,
+            "duration": self.duration,
+            "legs": json.loads(self.legs_json)
+        }
+
+
+class RouteCache:
+    """
+    Byte-bounded LRU of route results, optionally persisted to Postgres.
+    """
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = max_bytes or settings.route_cache_max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._table_lock = asyncio.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(coordinates: List[Tuple[float, float]], profile: str, exclude_tolls: bool) -> str:
+        """Content address of a routing request."""
+        digest = hashlib.sha256(f"{profile}|{int(bool(exclude_tolls))}".encode())
+        for lat, lng in coordinates:
+            digest.update(f"|{lat:.{_KEY_DECIMALS}f},{lng:.{_KEY_DECIMALS}f}".encode())
+        return digest.hexdigest()
+
+    def _put_memory(self, key: str, entry: _Entry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Return a fresh copy of a cached route, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            self.hits += 1
+            return entry.to_route()
+
+        if settings.route_cache_persist:
+            route = await self._get_db(key)
+            if route is not None:
+                self.db_hits += 1
+                self._put_memory(key, _Entry(route))
+                return route
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, route: Dict, profile: str, exclude_tolls: bool):
+        """Cache a route result (callers must not pass fallback routes)."""
+        entry = _Entry(route)
+        self._put_memory(key, entry)
+        if settings.route_cache_persist:
+            await self._put_db(key, entry, profile, exclude_tolls)
+
+    async def _ensure_table(self, db):
+        if self._table_ready:
+            return
+        async with self._table_lock:
+            if self._table_ready:
+                return
+            await db.execute(text("""
+                CREATE TABLE IF NOT EXISTS osrm_route_cache (
+                    route_key VARCHAR(64) PRIMARY KEY,
+                    profile VARCHAR(20) NOT NULL,
+                    exclude_tolls BOOLEAN NOT NULL,
+                    route JSONB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            # Tables created before eviction existed lack the usage column
+            await db.execute(text(
+                "ALTER TABLE osrm_route_cache "
+                "ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+            ))
+            await db.execute(text(
+                "CREATE INDEX IF NOT EXISTS idx_osrm_route_cache_last_used ON osrm_route_cache (last_used_at)"
+            ))
+            await db.commit()
+            self._table_ready = True
+
+    async def _get_db(self, key: str) -> Optional[Dict]:
+        try:
+            from app.core.database import async_session
+
+            async with async_session() as db:
+                await self._ensure_table(db)
+                result = await db.execute(text("""
+                    UPDATE osrm_route_cache
+                    SET last_used_at = CURRENT_TIMESTAMP
+                    WHERE route_key = :key
+                    RETURNING route
+                """), {"key": key})
+                row = result.fetchone()
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Route cache lookup failed: {e}")
+            return None
+
+        if not row:
+            return None
+        stored = json.loads(row.route) if isinstance(row.route, str) else row.route
+        return {
+            "geometry": [{"lat": lat, "lng": lng} for lat, lng in stored["geometry"]],
+            "distance": stored["distance"],
+            "duration": stored["duration"],
+            "legs": stored["legs"]
+        }
+
+    async def _put_db(self, key: str, entry: _Entry, profile: str, exclude_tolls: bool):
+        stored = {
+            "geometry": entry.geometry.tolist(),
+            "distance": entry.distance,
+            "duration": entry.duration,
+            "legs": json.loads(entry.legs_json)
+        }
+        try:
+            from app.core.database import async_session
+
+            async with async_session() as db:
+                await self._ensure_table(db)
+                await db.execute(text("""
+                    INSERT INTO osrm_route_cache (route_key, profile, exclude_tolls, route)
+                    VALUES (:key, :profile, :exclude_tolls, :route)
+                    ON CONFLICT (route_key) DO UPDATE
+                    SET route = EXCLUDED.route, last_used_at = CURRENT_TIMESTAMP
+                """), {
+                    "key": key,
+                    "profile": profile,
+                    "exclude_tolls": exclude_tolls,
+                    "route": json.dumps(stored)
+                })
+                await db.execute(text("""
+                    DELETE FROM osrm_route_cache
+                    WHERE route_key IN (
+                        SELECT route_key FROM osrm_route_cache
+                        ORDER BY last_used_at DESC
+                        OFFSET :max_rows
+                    )
+                """), {"max_rows": settings.route_cache_max_rows})
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Route cache store failed: {e}")
+
+    def stats(self) -> Dict:
+        """Hit counters since process start."""
+        total = self.hits + self.db_hits + self.misses
+        return {
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.db_hits) / total, 4) if total else None,
+            "cached_routes": len(self._entries),
+            "cached_bytes": self._bytes
+        }
+
+
+class CachedLeg:
+    """One routed leg: geometry from its steps plus the leg summary."""
+
+    __slots__ = ("geometry", "distance", "duration", "weight", "summary", "size")
+
+    def __init__(self, leg: Dict):
+        points = []
+        for step in leg.get("steps", []):
+            coordinates = step.get("geometry", {}).get("coordinates", [])
+            # Consecutive steps share their junction point
+            if points and coordinates and coordinates[0] == points[-1]:
+                coordinates = coordinates[1:]
+            points.extend(coordinates)
+        # OSRM uses [lng, lat]; store [lat, lng]
+        self.geometry = np.array(points, dtype=np.float64).reshape(-1, 2)[:, ::-1].copy()
+        self.distance = leg.get("distance", 0)
+        self.duration = leg.get("duration", 0)
+        self.weight = leg.get("weight", 0)
+        self.summary = leg.get("summary", "")
+        self.size = self.geometry.nbytes + len(self.summary)
+
+    def to_leg(self) -> Dict:
+        return {
+            "distance": self.distance,
+            "duration": self.duration,
+            "weight": self.weight,
+            "summary": self.summary
+        }
+
+
+class LegCache:
+    """
+    Byte-bounded LRU of routed legs keyed by (from, to, profile, exclude_tolls).
+    """
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = max_bytes or settings.leg_cache_max_bytes
+        self._legs: "OrderedDict[str, CachedLeg]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        profile: str,
+        exclude_tolls: bool
+    ) -> str:
+        return (
+            f"{profile}|{int(bool(exclude_tolls))}|"
+            f"{origin[0]:.{_KEY_DECIMALS}f},{origin[1]:.{_KEY_DECIMALS}f}|"
+            f"{destination[0]:.{_KEY_DECIMALS}f},{destination[1]:.{_KEY_DECIMALS}f}"
+        )
+
+    def get(self, key: str) -> Optional[CachedLeg]:
+        with self._lock:
+            leg = self._legs.get(key)
+            if leg is None:
+                self.misses += 1
+                return None
+            self._legs.move_to_end(key)
+            self.hits += 1
+            return leg
+
+    def put(self, key: str, leg: Dict) -> CachedLeg:
+        """Cache a raw OSRM leg (requested with steps) and return its cached form."""
+        cached = CachedLeg(leg)
+        with self._lock:
+            previous = self._legs.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._legs[key] = cached
+            self._bytes += cached.size
+            while self._bytes > self.max_bytes and len(self._legs) > 1:
+                _, evicted = self._legs.popitem(last=False)
+                self._bytes -= evicted.size
+        return cached
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+            "cached_legs": len(self._legs),
+            "cached_bytes": self._bytes
+        }
+
+
+def stitch_legs(legs: List[CachedLeg]) -> Dict:
+    """Assemble a get_route result from consecutive cached legs."""
+    parts = []
+    for leg in legs:
+        geometry = leg.geometry
+        # Each leg starts where the previous one ended
+        if parts and len(geometry) and len(parts[-1]) and np.array_equal(geometry[0], parts[-1][-1]):
+            geometry = geometry[1:]
+        parts.append(geometry)
+    points = np.concatenate(parts) if parts else np.empty((0, 2))
+
+    return {
+        "geometry": [{"lat": lat, "lng": lng} for lat, lng in points.tolist()],
+        "distance": sum(leg.distance for leg in legs),
+        "duration": sum(leg.duration for leg in legs),
+        "legs": [leg.to_leg() for leg in legs]
+    }
+
+
+# Shared by all OSRMService instances (keys include the profile)
+route_cache = RouteCache()
+leg_cache = LegCache()
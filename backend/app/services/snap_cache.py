@@ -0,0 +1,93 @@
+"""
+Snap Cache - Reuse road points selected for nearby stop locations
+
+Snapping a stop asks OSRM nearest for up to 100 candidates and then applies
+the main-road preference rules, which is the most expensive per-stop call of
+a simulation. Cluster centroids of the same shift land in almost the same
+place from one simulation to the next, so the selected road point is cached
+per grid cell (lat/lng rounded to settings.snap_cache_decimals places).
+
+A hit reuses the cached road point and recomputes the walking distance from
+the actual stop location.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.distance_utils import ellipsoidal_distance
+
+
+class SnapCache:
+    """
+    LRU of selected road points keyed by grid cell and snapping options.
+    """
+
+    def __init__(self, max_entries: int = None, decimals: int = None):
+        self.max_entries = max_entries or settings.snap_cache_max_entries
+        self.decimals = decimals if decimals is not None else settings.snap_cache_decimals
+        self._cells: "OrderedDict[Tuple, Tuple[float, float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(
+        self,
+        coordinate: Tuple[float, float],
+        profile: str,
+        prefer_main_roads: bool,
+        max_distance: float
+    ) -> Tuple:
+        lat, lng = coordinate
+        return (
+            profile,
+            prefer_main_roads,
+            max_distance,
+            round(lat, self.decimals),
+            round(lng, self.decimals)
+        )
+
+    def get(self, key: Tuple, coordinate: Tuple[float, float]) -> Optional[Dict]:
+        """Return a snap result for coordinate from its cell, or None."""
+        with self._lock:
+            cell = self._cells.get(key)
+            if cell is None:
+                self.misses += 1
+                return None
+            self._cells.move_to_end(key)
+            self.hits += 1
+
+        lat, lng = coordinate
+        snapped_lat, snapped_lng, road_name = cell
+        return {
+            "original": {"lat": lat, "lng": lng},
+            "snapped": {"lat": snapped_lat, "lng": snapped_lng},
+            "walking_distance": float(ellipsoidal_distance(lat, lng, snapped_lat, snapped_lng)),
+            "road_name": road_name,
+            "valid": True
+        }
+
+    def put(self, key: Tuple, result: Dict):
+        """Remember the road point of a valid snap result."""
+        if not result.get("valid"):
+            return
+        snapped = result["snapped"]
+        with self._lock:
+            self._cells[key] = (snapped["lat"], snapped["lng"], result.get("road_name", ""))
+            self._cells.move_to_end(key)
+            while len(self._cells) > self.max_entries:
+                self._cells.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """Hit counters since process start."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+            "cached_cells": len(self._cells)
+        }
+
+
+# Shared by all OSRMService instances (keys include the profile)
+snap_cache = SnapCache()
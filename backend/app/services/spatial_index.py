@@ -0,0 +1,119 @@
+"""
+Spatial Index - Uniform lat/lng grid for fixed-radius neighbour queries
+
+Points are bucketed into cells of roughly cell_size_meters. A radius query only
+visits the cells that can contain points within the radius, then filters the
+candidates with the ellipsoidal distance kernel. Points can be inserted and
+removed at any time, so the index can follow incremental changes.
+"""
+import math
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.distance_utils import ellipsoidal_distance
+
+# Lower bounds of the length of one degree on the WGS-84 ellipsoid (meters)
+_MIN_METERS_PER_DEGREE_LAT = 110574.0
+_METERS_PER_DEGREE_LNG_EQUATOR = 111320.0
+
+
+class SpatialGridIndex:
+    """
+    Grid index over (lat, lng) points keyed by arbitrary hashable ids.
+    """
+
+    def __init__(self, cell_size_meters: float):
+        """
+        Initialize an empty grid.
+
+        Args:
+            cell_size_meters: Approximate cell edge length; use the typical query radius
+        """
+        self.cell_size_meters = cell_size_meters
+        self.cell_lat = cell_size_meters / _MIN_METERS_PER_DEGREE_LAT
+        self.cell_lng = cell_size_meters / _METERS_PER_DEGREE_LNG_EQUATOR
+        self._cells: Dict[Tuple[int, int], set] = defaultdict(set)
+        self._points: Dict[Hashable, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._points
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_lat), math.floor(lng / self.cell_lng))
+
+    def insert(self, key: Hashable, lat: float, lng: float):
+        """Insert or move a point."""
+        if key in self._points:
+            self.remove(key)
+        self._points[key] = (float(lat), float(lng))
+        self._cells[self._cell(lat, lng)].add(key)
+
+    def insert_many(self, keys: Iterable[Hashable], coordinates: Iterable[Tuple[float, float]]):
+        """Insert several points at once."""
+        for key, (lat, lng) in zip(keys, coordinates):
+            self.insert(key, lat, lng)
+
+    def remove(self, key: Hashable):
+        """Remove a point if present."""
+        location = self._points.pop(key, None)
+        if location is None:
+            return
+        cell = self._cell(*location)
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._cells[cell]
+
+    def location(self, key: Hashable) -> Optional[Tuple[float, float]]:
+        """Return the stored (lat, lng) of a point."""
+        return self._points.get(key)
+
+    def candidates(self, lat: float, lng: float, radius_meters: float) -> List[Hashable]:
+        """
+        Keys in every cell that may hold a point within radius_meters.
+
+        The longitude reach is sized for the highest latitude in the search
+        window, so no point within the radius is ever missed.
+        """
+        reach_lat = radius_meters / _MIN_METERS_PER_DEGREE_LAT
+        worst_lat = min(abs(lat) + reach_lat, 89.9)
+        reach_lng = radius_meters / (_METERS_PER_DEGREE_LNG_EQUATOR * math.cos(math.radians(worst_lat)))
+
+        row0, col0 = self._cell(lat - reach_lat, lng - reach_lng)
+        row1, col1 = self._cell(lat + reach_lat, lng + reach_lng)
+
+        keys = []
+        cells = self._cells
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                bucket = cells.get((row, col))
+                if bucket:
+                    keys.extend(bucket)
+        return keys
+
+    def query_radius(
+        self,
+        lat: float,
+        lng: float,
+        radius_meters: float
+    ) -> List[Tuple[Hashable, float]]:
+        """
+        Return (key, distance) for every point within radius_meters, nearest first.
+        """
+        keys = self.candidates(lat, lng, radius_meters)
+        if not keys:
+            return []
+        points = np.array([self._points[k] for k in keys])
+        distances = ellipsoidal_distance(lat, lng, points[:, 0], points[:, 1])
+        order = np.argsort(distances, kind="stable")
+        return [
+            (keys[i], float(distances[i]))
+            for i in order
+            if distances[i] <= radius_meters
+        ]
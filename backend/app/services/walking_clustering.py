@@ -0,0 +1,432 @@
+"""
+Walking Clustering - DBSCAN on real walking distances from the OSRM foot profile
+
+Straight-line distance ignores barriers: two employees on opposite sides of a
+motorway or rail line can be 150 m apart but 2 km apart on foot. Walking
+distance is never shorter than the geodesic distance, so only pairs within
+max_walking_distance in a straight line can be neighbours. Those candidate
+pairs come from the sparse neighborhood graph and are checked against the
+foot network in batched OSRM table requests:
+
+- Sources are taken in spatial order and grouped with their candidate
+  neighbours until a block reaches settings.walking_table_max_size coordinates
+- Each block is one sources × destinations table request; blocks run
+  concurrently up to settings.walking_table_concurrency
+- DBSCAN then runs on the graph of pairs whose walking distance is within eps
+- Employees left without a neighbour join a stop only if it is within eps on
+  foot too, checked the same way (employee -> stop pairs)
+
+Each employee appears as a source once and as a destination in a bounded
+number of blocks, so the number of requests grows linearly with headcount.
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse as sp
+from sklearn.cluster import DBSCAN
+import logging
+
+from app.core.config import settings
+from app.core.workers import run_in_process
+from app.services.clustering_service import ClusteringService
+from app.services.osrm_service import OSRMService, osrm_foot_service
+from app.services.spatial_index import SpatialGridIndex
+
+logger = logging.getLogger(__name__)
+
+# Sources are ordered by ~1 km latitude strips, then longitude, so that
+# consecutive sources share most of their candidate neighbours
+_ORDER_STRIP_DEGREES = 0.01
+
+
+def plan_table_blocks(
+    candidates: sp.csr_matrix,
+    coordinates: np.ndarray,
+    max_size: int
+) -> List[Tuple[List[int], List[int]]]:
+    """
+    Group candidate pairs (i, j) with i < j into bounded table requests.
+
+    Args:
+        candidates: CSR matrix whose structure holds the candidate pairs
+        coordinates: Array of shape (n, 2) with [lat, lng] pairs
+        max_size: Maximum number of distinct coordinates per request
+
+    Returns:
+        List of (sources, destinations) employee index lists. Every candidate
+        pair is covered by exactly one block.
+    """
+    upper = sp.triu(candidates, k=1, format="csr")
+    strips = np.floor(coordinates[:, 0] / _ORDER_STRIP_DEGREES)
+    order = np.lexsort((coordinates[:, 1], strips))
+
+    blocks = []
+    sources: List[int] = []
+    destinations: Dict[int, None] = {}
+    max_destinations = max(1, max_size - 1)
+
+    def flush():
+        if sources:
+            blocks.append((list(sources), list(destinations)))
+        sources.clear()
+        destinations.clear()
+
+    for i in order:
+        neighbours = upper.indices[upper.indptr[i]:upper.indptr[i + 1]]
+        if len(neighbours) == 0:
+            continue
+
+        if len(neighbours) > max_destinations:
+            # Very dense spot: this source gets blocks of its own
+            flush()
+            for start in range(0, len(neighbours), max_destinations):
+                blocks.append(([int(i)], [int(j) for j in neighbours[start:start + max_destinations]]))
+            continue
+
+        locations = set(sources) | set(destinations)
+        added = {int(i)} | {int(j) for j in neighbours}
+        if len(locations | added) > max_size:
+            flush()
+
+        sources.append(int(i))
+        for j in neighbours:
+            destinations[int(j)] = None
+
+    flush()
+    return blocks
+
+
+async def _walking_block(
+    osrm: OSRMService,
+    coordinates: np.ndarray,
+    sources: List[int],
+    destinations: List[int],
+    semaphore: asyncio.Semaphore
+) -> Optional[List[List[Optional[float]]]]:
+    """Fetch one sources × destinations block of foot distances."""
+    locations = list(dict.fromkeys(sources + destinations))
+    position = {emp_index: k for k, emp_index in enumerate(locations)}
+
+    async with semaphore:
+        table = await osrm.get_table(
+            [(float(coordinates[k, 0]), float(coordinates[k, 1])) for k in locations],
+            sources=[position[i] for i in sources],
+            destinations=[position[j] for j in destinations],
+            profile="foot",
+            annotations="distance"
+        )
+
+    if not table.get("valid") or table.get("distances") is None:
+        return None
+    return table["distances"]
+
+
+async def fetch_walking_tables(
+    osrm: OSRMService,
+    coordinates: np.ndarray,
+    blocks: List[Tuple[List[int], List[int]]]
+) -> List[Optional[List[List[Optional[float]]]]]:
+    """Fetch the foot distances of every block (None where OSRM did not answer)."""
+    semaphore = asyncio.Semaphore(settings.walking_table_concurrency)
+    return await asyncio.gather(*[
+        _walking_block(osrm, coordinates, sources, destinations, semaphore)
+        for sources, destinations in blocks
+    ])
+
+
+def build_walking_graph(
+    candidates: sp.csr_matrix,
+    blocks: List[Tuple[List[int], List[int]]],
+    tables: List[Optional[List[List[Optional[float]]]]],
+    eps: float
+) -> Tuple[sp.csr_matrix, int]:
+    """
+    Sparse graph of candidate pairs within eps on the foot network.
+
+    Blocks that OSRM cannot answer keep their straight-line distances, so an
+    unavailable foot server degrades to ordinary DBSCAN instead of failing.
+
+    Args:
+        candidates: CSR matrix of straight-line distances of the candidate pairs
+        blocks: plan_table_blocks(candidates, ...) result
+        tables: Foot distances per block (fetch_walking_tables)
+        eps: Maximum walking distance in meters
+
+    Returns:
+        (graph, fallback_blocks): symmetric CSR matrix of walking distances in
+        meters, diagonal included as explicit zeros (DBSCAN counts each point
+        as its own neighbour), and the number of blocks that fell back to
+        straight-line distances
+    """
+    n = candidates.shape[0]
+    rows, cols, values = [], [], []
+    fallback_blocks = 0
+    for (sources, destinations), table in zip(blocks, tables):
+        if table is None:
+            fallback_blocks += 1
+        destination_column = {j: c for c, j in enumerate(destinations)}
+        for r, i in enumerate(sources):
+            start, end = candidates.indptr[i], candidates.indptr[i + 1]
+            for j, straight in zip(candidates.indices[start:end], candidates.data[start:end]):
+                column = destination_column.get(int(j))
+                if j <= i or column is None:
+                    continue
+                if table is None:
+                    distance = straight
+                else:
+                    distance = table[r][column]
+                    if distance is None:
+                        continue
+                if distance <= eps:
+                    rows.append(i)
+                    cols.append(int(j))
+                    values.append(float(distance))
+
+    if fallback_blocks:
+        logger.warning(
+            f"Foot network unavailable for {fallback_blocks}/{len(blocks)} blocks, "
+            f"using straight-line distances there"
+        )
+    logger.info(
+        f"Walking check: {sp.triu(candidates, k=1).nnz} candidate pairs -> {len(rows)} "
+        f"within {eps:.0f}m on foot ({len(blocks)} table requests)"
+    )
+
+    # Symmetric pairs plus the diagonal, built straight into CSR so explicit zeros survive
+    diagonal = np.arange(n, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    all_rows = np.concatenate([diagonal, rows, cols])
+    all_cols = np.concatenate([diagonal, cols, rows])
+    all_values = np.concatenate([np.zeros(n), values, values])
+
+    order = np.lexsort((all_cols, all_rows))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_rows, minlength=n), out=indptr[1:])
+    graph = sp.csr_matrix((all_values[order], all_cols[order], indptr), shape=(n, n))
+    return graph, fallback_blocks
+
+
+def attachment_candidates(
+    service: ClusteringService,
+    stops: List[Dict],
+    unclustered: List[Dict]
+) -> Tuple[np.ndarray, sp.csr_matrix]:
+    """
+    Pair unclustered employees with the stops within walking distance in a straight line.
+
+    Employees and stops form one point set (employees first, then stops) so
+    the pairs can be checked with plan_table_blocks and build_walking_graph.
+
+    Returns:
+        (coordinates, candidates): [lat, lng] of the point set and a CSR matrix
+        of straight-line employee -> stop distances
+    """
+    eps = service.max_walking_distance
+    employee_count = len(unclustered)
+    stop_index = SpatialGridIndex(eps)
+    stop_index.insert_many(
+        range(len(stops)),
+        [(stop["location"]["lat"], stop["location"]["lng"]) for stop in stops]
+    )
+
+    rows, cols, values = [], [], []
+    for i, emp in enumerate(unclustered):
+        for stop_idx, distance in stop_index.query_radius(emp["location"]["lat"], emp["location"]["lng"], eps):
+            rows.append(i)
+            cols.append(employee_count + stop_idx)
+            values.append(distance)
+
+    coordinates = np.array(
+        [(emp["location"]["lat"], emp["location"]["lng"]) for emp in unclustered]
+        + [(stop["location"]["lat"], stop["location"]["lng"]) for stop in stops],
+        dtype=np.float64
+    ).reshape(-1, 2)
+    n = len(coordinates)
+    candidates = sp.csr_matrix((values, (rows, cols)), shape=(n, n), dtype=np.float64)
+    return coordinates, candidates
+
+
+def attach_on_foot(
+    service: ClusteringService,
+    stops: List[Dict],
+    unclustered: List[Dict],
+    foot_graph: sp.csr_matrix,
+    max_stop_capacity: Optional[int] = None
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Walking-network counterpart of refine_clusters_for_walking_distance.
+
+    Each unclustered employee joins the stop nearest on foot that has room;
+    employees with no stop within walking distance on foot get their own stop.
+
+    Args:
+        stops: List of current stops
+        unclustered: List of unclustered employees
+        foot_graph: build_walking_graph over attachment_candidates(stops, unclustered)
+        max_stop_capacity: Maximum employees per stop (None for no limit)
+
+    Returns:
+        Tuple of (updated stops, still unclustered employees)
+    """
+    employee_count = len(unclustered)
+    still_unclustered = []
+
+    for i, emp in enumerate(unclustered):
+        start, end = foot_graph.indptr[i], foot_graph.indptr[i + 1]
+        options = sorted(
+            (float(distance), int(j) - employee_count)
+            for j, distance in zip(foot_graph.indices[start:end], foot_graph.data[start:end])
+            if j >= employee_count
+        )
+        for distance, stop_idx in options:
+            stop = stops[stop_idx]
+            if max_stop_capacity is None or stop["employee_count"] < max_stop_capacity:
+                stop["employee_count"] += 1
+                stop["employee_ids"].append(emp["employee_id"])
+                stop["max_distance_to_centroid"] = max(stop["max_distance_to_centroid"], distance)
+                break
+        else:
+            still_unclustered.append(emp)
+
+    stops.extend(service.make_individual_stops(stops, still_unclustered))
+    return stops, []
+
+
+def _plan_employee_tables(
+    coordinates: np.ndarray,
+    max_walking_distance: float
+) -> Tuple[sp.csr_matrix, List[Tuple[List[int], List[int]]]]:
+    """Worker step: straight-line candidate pairs and their table blocks."""
+    candidates = ClusteringService(max_walking_distance)._calculate_neighborhood_graph(coordinates)
+    return candidates, plan_table_blocks(candidates, coordinates, settings.walking_table_max_size)
+
+
+def _cluster_walking_graph(
+    coordinates: np.ndarray,
+    ids: List[int],
+    candidates: sp.csr_matrix,
+    blocks: List[Tuple[List[int], List[int]]],
+    tables: List[Optional[List[List[Optional[float]]]]],
+    max_walking_distance: float,
+    max_stop_capacity: Optional[int]
+) -> Tuple[Dict, int, np.ndarray, sp.csr_matrix, List[Tuple[List[int], List[int]]]]:
+    """
+    Worker step: DBSCAN on the walking graph and capacity enforcement.
+
+    Returns:
+        (result, fallback_blocks, points, candidates, blocks); the last three
+        describe the employee -> stop pairs to check on foot for attach_on_foot
+    """
+    service = ClusteringService(max_walking_distance)
+    graph, fallback_blocks = build_walking_graph(candidates, blocks, tables, max_walking_distance)
+    labels = DBSCAN(
+        eps=max_walking_distance,
+        min_samples=2,
+        metric='precomputed'
+    ).fit_predict(graph)
+
+    result = service._build_dbscan_result(labels, coordinates, ids)
+
+    if max_stop_capacity and result["stops"]:
+        result["stops"] = service.enforce_stop_capacity(
+            result["stops"],
+            dict(zip(ids, map(tuple, coordinates))),
+            max_stop_capacity
+        )
+
+    points, attach_candidates = attachment_candidates(service, result["stops"], result["unclustered"])
+    attach_blocks = plan_table_blocks(attach_candidates, points, settings.walking_table_max_size)
+    return result, fallback_blocks, points, attach_candidates, attach_blocks
+
+
+def _attach_walking(
+    result: Dict,
+    candidates: sp.csr_matrix,
+    blocks: List[Tuple[List[int], List[int]]],
+    tables: List[Optional[List[List[Optional[float]]]]],
+    max_walking_distance: float,
+    max_stop_capacity: Optional[int]
+) -> Tuple[Dict, int]:
+    """Worker step: attach unclustered employees by foot distance."""
+    service = ClusteringService(max_walking_distance)
+    foot_graph, fallback_blocks = build_walking_graph(candidates, blocks, tables, max_walking_distance)
+    result["stops"], result["unclustered"] = attach_on_foot(
+        service,
+        result["stops"],
+        result["unclustered"],
+        foot_graph,
+        max_stop_capacity
+    )
+    return result, fallback_blocks
+
+
+async def cluster_employees_walking(
+    employee_data: List[Dict],
+    max_walking_distance: float = 200.0,
+    max_stop_capacity: Optional[int] = None,
+    osrm: OSRMService = None
+) -> Dict:
+    """
+    Cluster employees into stops using walking distances on the foot network.
+
+    Employees left without a neighbour are attached to a stop only when the
+    stop is within walking distance on foot as well (attach_on_foot).
+
+    Only the foot table requests run on the event loop; graph building,
+    DBSCAN, capacity enforcement and attachment run in the process pool.
+
+    Args:
+        employee_data: List of dicts with 'id', 'lat', 'lng' keys
+        max_walking_distance: Maximum walking distance in meters
+        max_stop_capacity: Largest effective vehicle capacity (see cluster_employees)
+        osrm: OSRM service with a foot profile (default: osrm_foot_service)
+
+    Returns:
+        Clustering results with the same shape as cluster_employees, plus
+        'walking_fallback' (True when some pairs were judged by straight-line
+        distance because the foot server did not answer)
+    """
+    osrm = osrm or osrm_foot_service
+    if not employee_data:
+        return {
+            "clusters": [],
+            "stops": [],
+            "unclustered": [],
+            "total_clusters": 0,
+            "walking_fallback": False
+        }
+
+    coordinates = np.array([(emp["lat"], emp["lng"]) for emp in employee_data], dtype=np.float64)
+    ids = [emp["id"] for emp in employee_data]
+
+    candidates, blocks = await run_in_process(_plan_employee_tables, coordinates, max_walking_distance)
+    tables = await fetch_walking_tables(osrm, coordinates, blocks)
+    result, fallback_blocks, points, attach_candidates, attach_blocks = await run_in_process(
+        _cluster_walking_graph,
+        coordinates,
+        ids,
+        candidates,
+        blocks,
+        tables,
+        max_walking_distance,
+        max_stop_capacity
+    )
+
+    if result["unclustered"]:
+        attach_tables = await fetch_walking_tables(osrm, points, attach_blocks)
+        result, attach_fallback_blocks = await run_in_process(
+            _attach_walking,
+            result,
+            attach_candidates,
+            attach_blocks,
+            attach_tables,
+            max_walking_distance,
+            max_stop_capacity
+        )
+        fallback_blocks += attach_fallback_blocks
+
+    result["walking_fallback"] = fallback_blocks > 0
+    return result
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from app.core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def _probe(healthy):
+    async def probe():
+        return healthy
+    return probe
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CLOSED
+
+
+def test_open_breaker_rejects_before_reset_timeout():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(breaker.before_call(_probe(True)))
+    assert breaker.rejected == 1
+
+
+def test_healthy_probe_closes_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    asyncio.run(breaker.before_call(_probe(True)))
+
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(breaker.before_call(_probe(False)))
+    assert breaker.state == OPEN
+    assert breaker.rejected == 1
+
+
+def test_failure_while_half_open_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=60)
+    breaker.state = HALF_OPEN
+
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
@@ -0,0 +1,102 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.services.decomposition_solver import (
+    _pair_fleet,
+    _relabel_optional,
+    _share,
+    partition_stops,
+)
+
+DEPOT = (41.0, 29.0)
+
+
+def _stops(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "cluster_id": i,
+            "location": {"lat": DEPOT[0] + rng.normal() * 0.05, "lng": DEPOT[1] + rng.normal() * 0.05},
+            "employee_count": int(rng.integers(1, 10))
+        }
+        for i in range(count)
+    ]
+
+
+def test_share_largest_remainder():
+    assert _share(10, [1, 1, 1]) == [4, 3, 3]
+    assert _share(7, [3, 1]) == [5, 2]
+    assert sum(_share(47, [120, 95, 133])) == 47
+
+
+def test_share_of_nothing():
+    assert _share(0, [1, 2]) == [0, 0]
+    assert _share(5, [0, 0]) == [0, 0]
+
+
+def test_single_partition_when_small():
+    assert partition_stops(_stops(30), DEPOT, 100) == [list(range(30))]
+
+
+@pytest.mark.parametrize("method", ["sweep", "cluster"])
+def test_partitions_cover_every_stop_once(method):
+    stops = _stops(350)
+
+    partitions = partition_stops(stops, DEPOT, 100, method)
+
+    assert len(partitions) == math.ceil(350 / 100)
+    assert sorted(index for partition in partitions for index in partition) == list(range(350))
+    assert all(partition == sorted(partition) for partition in partitions)
+
+
+@pytest.mark.parametrize("method", ["sweep", "cluster"])
+def test_partitions_balance_demand(method):
+    stops = _stops(400, seed=1)
+
+    partitions = partition_stops(stops, DEPOT, 100, method)
+
+    demands = [sum(stops[index]["employee_count"] for index in partition) for partition in partitions]
+    assert max(demands) - min(demands) <= 2 * max(stop["employee_count"] for stop in stops)
+
+
+def test_sweep_partitions_are_angular_sectors():
+    stops = _stops(300, seed=2)
+
+    partitions = partition_stops(stops, DEPOT, 100, "sweep")
+
+    # Each sector spans less than half a turn when there are three of them
+    for partition in partitions:
+        angles = np.sort([
+            math.atan2(stops[i]["location"]["lat"] - DEPOT[0], stops[i]["location"]["lng"] - DEPOT[1])
+            for i in partition
+        ])
+        widest_gap = max(np.diff(np.append(angles, angles[0] + 2 * math.pi)))
+        assert 2 * math.pi - widest_gap < math.pi
+
+
+def test_unknown_partition_method():
+    with pytest.raises(ValueError):
+        partition_stops(_stops(300), DEPOT, 100, "sweeep")
+
+
+def test_pair_fleet_keeps_route_vehicles():
+    fleet = _pair_fleet(
+        {"vehicle_type": "16-seater", "optional": False},
+        {"vehicle_type": "27-seater", "optional": True}
+    )
+    assert fleet == {"num_16_seaters": 1, "num_27_seaters": 0, "optional_16_seaters": 0, "optional_27_seaters": 1}
+
+
+def test_relabel_optional_only_past_requested_count():
+    routes = [
+        {"vehicle_type": "27-seater", "optional": True},
+        {"vehicle_type": "27-seater", "optional": False},
+        {"vehicle_type": "27-seater", "optional": True},
+        {"vehicle_type": "16-seater", "optional": True}
+    ]
+
+    _relabel_optional(routes, num_16_seaters=1, num_27_seaters=2)
+
+    assert [route["optional"] for route in routes] == [False, False, True, False]
@@ -0,0 +1,96 @@
+import numpy as np
+
+from app.services.clustering_service import ClusteringService
+from app.services.incremental_clustering import IncrementalClusterer
+
+WALKING_DISTANCE = 200.0
+
+
+def _employees(rng, count, start_id=0):
+    return [
+        {"id": start_id + i, "lat": 41.0 + rng.normal() * 0.015, "lng": 29.0 + rng.normal() * 0.015}
+        for i in range(count)
+    ]
+
+
+def _partition(members):
+    return sorted(sorted(group) for group in members)
+
+
+def _dbscan_partition(employee_data):
+    """Employee-id groups of a fresh DBSCAN run, noise as singletons."""
+    result = ClusteringService(WALKING_DISTANCE).cluster_with_dbscan(
+        [(emp["lat"], emp["lng"]) for emp in employee_data],
+        [emp["id"] for emp in employee_data],
+        sparse=True
+    )
+    groups = [stop["employee_ids"] for stop in result["stops"]]
+    groups += [[emp["employee_id"]] for emp in result["unclustered"]]
+    return _partition(groups)
+
+
+def test_build_matches_dbscan():
+    employees = _employees(np.random.default_rng(1), 300)
+    clusterer = IncrementalClusterer(WALKING_DISTANCE)
+    clusterer.build(employees)
+
+    assert _partition(clusterer.members.values()) == _dbscan_partition(employees)
+
+
+def test_updates_match_fresh_dbscan():
+    rng = np.random.default_rng(2)
+    employees = _employees(rng, 300)
+    clusterer = IncrementalClusterer(WALKING_DISTANCE)
+    clusterer.build(employees)
+
+    for step in range(5):
+        # Delete some, move some, add some
+        employees = employees[15:]
+        for emp in employees[:20]:
+            emp["lat"] += rng.normal() * 0.003
+            emp["lng"] += rng.normal() * 0.003
+        employees = employees + _employees(rng, 15, start_id=1000 + step * 100)
+
+        changes = clusterer.update(employees)
+
+        assert changes == {"inserted": 15, "moved": 20, "deleted": 15}
+        assert _partition(clusterer.members.values()) == _dbscan_partition(employees)
+
+
+def test_result_respects_stop_capacity():
+    employees = _employees(np.random.default_rng(3), 200)
+    clusterer = IncrementalClusterer(WALKING_DISTANCE)
+    clusterer.build(employees)
+
+    result = clusterer.result(max_stop_capacity=10)
+
+    assert all(stop["employee_count"] <= 10 for stop in result["stops"])
+    assert sorted(emp_id for stop in result["stops"] for emp_id in stop["employee_ids"]) == list(range(200))
+
+
+def _stop_groups(result):
+    return sorted(sorted(stop["employee_ids"]) for stop in result["stops"])
+
+
+def test_incremental_result_matches_fresh_result():
+    rng = np.random.default_rng(4)
+    employees = _employees(rng, 400)
+    clusterer = IncrementalClusterer(WALKING_DISTANCE)
+    clusterer.build(employees)
+    clusterer.result(max_stop_capacity=8)
+
+    for step in range(4):
+        employees = employees[10:]
+        for emp in employees[:15]:
+            emp["lat"] += rng.normal() * 0.002
+            emp["lng"] += rng.normal() * 0.002
+        employees = employees + _employees(rng, 10, start_id=1000 + step * 100)
+        clusterer.update(employees)
+
+        fresh = IncrementalClusterer(WALKING_DISTANCE)
+        fresh.build(employees)
+
+        result = clusterer.result(max_stop_capacity=8)
+        assert _stop_groups(result) == _stop_groups(fresh.result(max_stop_capacity=8))
+        assert sum(stop["employee_count"] for stop in result["stops"]) == len(employees)
+        assert len({stop["cluster_id"] for stop in result["stops"]}) == len(result["stops"])
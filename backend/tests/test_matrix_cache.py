@@ -0,0 +1,95 @@
+import asyncio
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.matrix_cache import PairCache, plan_missing_fetch
+
+
+def _covered(missing, rows, cols):
+    covered = np.zeros_like(missing)
+    covered[rows, :] = True
+    covered[:, cols] = True
+    return covered
+
+
+def test_nothing_missing():
+    assert plan_missing_fetch(np.zeros((4, 4), dtype=bool)) == ([], [])
+
+
+def test_new_stop_costs_one_row_and_one_column():
+    missing = np.zeros((6, 6), dtype=bool)
+    missing[3, :] = True
+    missing[:, 3] = True
+
+    rows, cols = plan_missing_fetch(missing)
+
+    assert rows == [3]
+    assert cols == [3]
+
+
+def test_every_missing_cell_is_covered():
+    rng = np.random.default_rng(7)
+    missing = rng.random((12, 12)) < 0.15
+
+    rows, cols = plan_missing_fetch(missing)
+
+    assert not (missing & ~_covered(missing, rows, cols)).any()
+    assert rows == sorted(rows) and cols == sorted(cols)
+
+
+def test_does_not_modify_input():
+    missing = np.eye(3, dtype=bool)
+    plan_missing_fetch(missing)
+    assert missing.sum() == 3
+
+
+def _cache(monkeypatch, max_pairs=1000):
+    monkeypatch.setattr(settings, "matrix_cache_persist", False)
+    return PairCache(max_pairs=max_pairs)
+
+
+def _matrix(points):
+    n = len(points)
+    return np.arange(n * n, dtype=np.float64).reshape(n, n) + 1
+
+
+def test_pair_cache_round_trip(monkeypatch):
+    cache = _cache(monkeypatch)
+    points = cache.point_keys([(41.0, 29.0), (41.01, 29.0), (41.0, 29.01), (41.0, 29.0)])
+    distances = _matrix(points)
+    cells = np.ones((4, 4), dtype=bool)
+    cells[1, 2] = False
+
+    asyncio.run(cache.store(points, distances, distances * 2, cells, "driving", False))
+    found_distances, found_durations, found = asyncio.run(cache.lookup(points, "driving", False))
+
+    # Identical points cost nothing; the unstored cell stays missing
+    assert found_distances[0, 3] == 0.0
+    assert not found[1, 2] and np.isnan(found_distances[1, 2])
+    assert found_distances[2, 1] == distances[2, 1]
+    assert found_durations[0, 1] == 2 * distances[0, 1]
+    assert found.sum() == 15
+
+
+def test_pair_cache_keys_include_profile(monkeypatch):
+    cache = _cache(monkeypatch)
+    points = cache.point_keys([(41.0, 29.0), (41.01, 29.0)])
+    asyncio.run(cache.store(points, _matrix(points), _matrix(points), np.ones((2, 2), dtype=bool), "driving", False))
+
+    _, _, found = asyncio.run(cache.lookup(points, "foot", False))
+
+    assert not found[0, 1]
+
+
+def test_pair_cache_evicts_least_recent_rows(monkeypatch):
+    cache = _cache(monkeypatch, max_pairs=4)
+    first = cache.point_keys([(41.0, 29.0), (41.01, 29.0)])
+    second = cache.point_keys([(40.0, 28.0), (40.01, 28.0), (40.02, 28.0)])
+    asyncio.run(cache.store(first, _matrix(first), _matrix(first), np.ones((2, 2), dtype=bool), "driving", False))
+    asyncio.run(cache.store(second, _matrix(second), _matrix(second), np.ones((3, 3), dtype=bool), "driving", False))
+
+    _, _, found_first = asyncio.run(cache.lookup(first, "driving", False))
+
+    assert cache.stats()["cached_pairs"] <= 4
+    assert not found_first[0, 1] and not found_first[1, 0]
@@ -0,0 +1,156 @@
+import numpy as np
+
+from app.services import optimization_service
+from app.services.optimization_service import (
+    HARD_ROUTE_DURATION_FACTOR,
+    CVRPSolver,
+    _ConvergenceMonitor,
+    effective_capacity,
+    optional_vehicle_pool,
+    vehicle_lower_bound,
+)
+
+
+def _solver(demands, capacities, duration_matrix=None, max_route_duration=3900):
+    n = len(demands)
+    distances = np.full((n, n), 1000.0)
+    np.fill_diagonal(distances, 0)
+    return CVRPSolver(
+        distance_matrix=distances,
+        demands=demands,
+        vehicle_capacities=capacities,
+        duration_matrix=duration_matrix if duration_matrix is not None else distances / 10,
+        max_route_duration=max_route_duration
+    )
+
+
+def test_lower_bound_no_demand():
+    assert vehicle_lower_bound([0, 0, 0], [27, 16]) == 0
+
+
+def test_lower_bound_capacity_cover_uses_largest_first():
+    # 27 + 27 < 60 <= 27 + 27 + 16
+    assert vehicle_lower_bound([0, 20, 20, 20], [16, 27, 27, 16]) == 3
+
+
+def test_lower_bound_counts_stops_over_half_capacity():
+    # Total demand fits in two vehicles, but no two 15-passenger stops share one
+    assert vehicle_lower_bound([0, 15, 15, 15], [27, 27, 27]) == 3
+
+
+def test_lower_bound_when_fleet_too_small():
+    assert vehicle_lower_bound([0, 20, 20], [16]) == 2
+
+
+def test_optional_pool_defaults_per_priority():
+    demands = [5] * 4
+    assert optional_vehicle_pool(2, 2, "auto", demands) == (4, 4)
+    assert optional_vehicle_pool(2, 2, "small", demands) == (8, 0)
+    assert optional_vehicle_pool(2, 2, "large", demands) == (0, 8)
+
+
+def test_optional_pool_grows_until_fleet_has_headroom():
+    # 400 passengers need 15 27-seaters; the fleet keeps one vehicle to spare
+    demands = [10] * 40
+    optional_16, optional_27 = optional_vehicle_pool(0, 0, "large", demands)
+    capacities = [effective_capacity(27)] * optional_27 + [effective_capacity(16)] * optional_16
+    assert optional_16 == 0
+    assert vehicle_lower_bound(demands, capacities) < len(capacities)
+
+
+def test_optional_pool_respects_buffer_seats():
+    demands = [10] * 40
+    assert optional_vehicle_pool(0, 0, "large", demands) == (0, 16)
+    assert optional_vehicle_pool(0, 0, "large", demands, buffer_seats=5) == (0, 20)
+
+
+def test_feasible_instance():
+    assert _solver([0, 10, 10], [27]).check_feasibility() is None
+
+
+def test_stop_exceeds_capacity():
+    infeasibility = _solver([0, 10, 30], [27, 16]).check_feasibility()
+    assert infeasibility == {"reason": "stop_exceeds_capacity", "stops": [2], "max_capacity": 27}
+
+
+def test_insufficient_capacity():
+    infeasibility = _solver([0, 20, 20], [27]).check_feasibility()
+    assert infeasibility["reason"] == "insufficient_capacity"
+    assert infeasibility["total_demand"] == 40
+    assert infeasibility["total_capacity"] == 27
+
+
+def test_route_duration():
+    durations = np.full((3, 3), 100.0)
+    np.fill_diagonal(durations, 0)
+    durations[0, 2] = durations[2, 0] = 3900 * HARD_ROUTE_DURATION_FACTOR
+    infeasibility = _solver([0, 5, 5], [27], duration_matrix=durations).check_feasibility()
+    assert infeasibility["reason"] == "route_duration"
+    assert infeasibility["stops"] == [2]
+
+
+class _Value:
+    def __init__(self, value):
+        self.value = value
+
+    def Value(self):
+        return self.value
+
+
+class _FakeRouting:
+    """Two used vehicles with a 500000 fixed cost each, one unused."""
+
+    def __init__(self):
+        self.cost = 0
+        self.finished = False
+
+    def vehicles(self):
+        return 3
+
+    def Start(self, vehicle):
+        return 100 + vehicle
+
+    def End(self, vehicle):
+        return 200 + vehicle
+
+    def NextVar(self, index):
+        vehicle = index - 100
+        return _Value(200 + vehicle if vehicle == 2 else 1)
+
+    def GetFixedCostOfVehicle(self, vehicle):
+        return 500000
+
+    def CostVar(self):
+        return _Value(self.cost)
+
+    def solver(self):
+        return self
+
+    def FinishCurrentSearch(self):
+        self.finished = True
+
+
+def _run_monitor(monkeypatch, variable_costs):
+    clock = {"now": 0.0}
+    monkeypatch.setattr(optimization_service.time, "monotonic", lambda: clock["now"])
+    routing = _FakeRouting()
+    monitor = _ConvergenceMonitor(routing, window_seconds=10, min_improvement=0.005)
+    for second, variable_cost in enumerate(variable_costs):
+        clock["now"] = float(second)
+        routing.cost = 1000000 + variable_cost
+        monitor()
+    return monitor, routing
+
+
+def test_fixed_costs_do_not_hide_distance_improvements(monkeypatch):
+    # The whole objective improves by under 0.5% over the window, distance by 25%
+    monitor, routing = _run_monitor(monkeypatch, [20000 - 400 * second for second in range(13)])
+
+    assert not monitor.stopped_early and not routing.finished
+    assert monitor.trace[-1][2] == 20000 - 400 * 12
+
+
+def test_plateau_on_variable_cost_stops_search(monkeypatch):
+    monitor, routing = _run_monitor(monkeypatch, [20000, 15000] + [14990] * 11)
+
+    assert monitor.stopped_early and routing.finished
@@ -0,0 +1,101 @@
+import asyncio
+
+from app.services.osrm_service import OSRMService
+from app.services.route_cache import CachedLeg, stitch_legs
+
+
+def _leg(points, distance, duration):
+    """Raw OSRM leg with one step per consecutive point pair ([lng, lat] order)."""
+    return {
+        "distance": distance,
+        "duration": duration,
+        "weight": duration,
+        "summary": "",
+        "steps": [
+            {"geometry": {"coordinates": [[lng, lat] for lat, lng in points[i:i + 2]]}}
+            for i in range(len(points) - 1)
+        ]
+    }
+
+
+def test_cached_leg_drops_shared_step_junctions():
+    leg = CachedLeg(_leg([(41.0, 29.0), (41.1, 29.1), (41.2, 29.2)], 100, 10))
+    assert leg.geometry.tolist() == [[41.0, 29.0], [41.1, 29.1], [41.2, 29.2]]
+
+
+def test_stitch_joins_geometry_and_sums_legs():
+    first = CachedLeg(_leg([(41.0, 29.0), (41.1, 29.1)], 100, 10))
+    second = CachedLeg(_leg([(41.1, 29.1), (41.2, 29.2)], 250, 30))
+
+    route = stitch_legs([first, second])
+
+    assert route["geometry"] == [
+        {"lat": 41.0, "lng": 29.0},
+        {"lat": 41.1, "lng": 29.1},
+        {"lat": 41.2, "lng": 29.2}
+    ]
+    assert route["distance"] == 350
+    assert route["duration"] == 40
+    assert [leg["distance"] for leg in route["legs"]] == [100, 250]
+
+
+def test_stitch_keeps_points_when_legs_do_not_touch():
+    first = CachedLeg(_leg([(41.0, 29.0), (41.1, 29.1)], 100, 10))
+    second = CachedLeg(_leg([(41.15, 29.15), (41.2, 29.2)], 100, 10))
+
+    assert len(stitch_legs([first, second])["geometry"]) == 4
+
+
+def test_stitch_empty():
+    assert stitch_legs([]) == {"geometry": [], "distance": 0, "duration": 0, "legs": []}
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, coordinates):
+        points = [tuple(reversed(point)) for point in coordinates]
+        self._data = {
+            "code": "Ok",
+            "routes": [{
+                "geometry": {"coordinates": [list(point) for point in coordinates]},
+                "distance": 100.0 * (len(points) - 1),
+                "duration": 10.0 * (len(points) - 1),
+                "legs": [_leg(points[i:i + 2], 100, 10) for i in range(len(points) - 1)]
+            }]
+        }
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+def _recording_service():
+    service = OSRMService(base_url="http://osrm.test")
+    requests = []
+
+    async def request(url, params=None):
+        requests.append(params)
+        coords = url.rsplit("/", 1)[1].split(";")
+        return _Response([[float(value) for value in coord.split(",")] for coord in coords])
+
+    service._request = request
+    return service, requests
+
+
+def test_full_route_keeps_osrm_default_heading_behaviour():
+    service, requests = _recording_service()
+    asyncio.run(service.get_route([(41.3, 29.3), (41.31, 29.31), (41.32, 29.32)]))
+
+    assert len(requests) == 1
+    assert "continue_straight" not in requests[0]
+
+
+def test_preview_stitches_legs_routed_without_heading():
+    service, requests = _recording_service()
+    route = asyncio.run(service.get_route_preview([(41.4, 29.4), (41.41, 29.41), (41.42, 29.42)]))
+
+    assert requests[0]["continue_straight"] == "false"
+    assert route["distance"] == 200
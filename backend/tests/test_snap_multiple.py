@@ -0,0 +1,27 @@
+import asyncio
+
+from app.services.osrm_service import OSRMService
+
+
+def test_invalid_cells_are_snapped_concurrently():
+    service = OSRMService(base_url="http://osrm.test")
+    calls = []
+    active = {"now": 0, "max": 0}
+
+    async def snap(coordinate, profile, prefer_main_roads, max_distance):
+        calls.append(coordinate)
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        return {"original": coordinate, "valid": False}
+
+    service._snap_to_road = snap
+    # One snap cache cell, far from any road: the leader's result is not cached
+    coordinates = [(41.50001 + i * 1e-6, 29.50001) for i in range(4)]
+
+    results = asyncio.run(service.snap_multiple_to_road(coordinates, profile="foot"))
+
+    assert [result["original"] for result in results] == coordinates
+    assert len(calls) == 4
+    assert active["max"] == 3
@@ -0,0 +1,60 @@
+import asyncio
+
+from app.services.distance_utils import ellipsoidal_distance
+from app.services.walking_clustering import cluster_employees_walking
+
+# A motorway along this latitude; crossing it on foot is a long detour
+BARRIER_LAT = 41.0005
+DETOUR_METERS = 3000.0
+
+# ~0.0009 degrees of latitude per 100 m
+EMPLOYEES = [
+    {"id": 1, "lat": 41.0, "lng": 28.9990},
+    {"id": 2, "lat": 41.0, "lng": 29.0010},
+    {"id": 3, "lat": 41.0, "lng": 29.0000},
+    # 130 m north of the stop, on the other side of the motorway
+    {"id": 4, "lat": 41.0012, "lng": 29.0000},
+]
+
+
+class FakeFootOSRM:
+    """Straight-line walking distances, except across the barrier."""
+
+    def __init__(self, available: bool = True):
+        self.available = available
+
+    async def get_table(self, coordinates, sources, destinations, profile, annotations):
+        if not self.available:
+            return {"valid": False}
+        distances = []
+        for i in sources:
+            row = []
+            for j in destinations:
+                (lat_a, lng_a), (lat_b, lng_b) = coordinates[i], coordinates[j]
+                distance = float(ellipsoidal_distance(lat_a, lng_a, lat_b, lng_b))
+                if (lat_a > BARRIER_LAT) != (lat_b > BARRIER_LAT):
+                    distance += DETOUR_METERS
+                row.append(distance)
+            distances.append(row)
+        return {"distances": distances, "valid": True}
+
+
+def _cluster(osrm):
+    return asyncio.run(cluster_employees_walking(EMPLOYEES, max_walking_distance=200, osrm=osrm))
+
+
+def test_stop_close_in_straight_line_but_not_on_foot_is_not_joined():
+    result = _cluster(FakeFootOSRM())
+
+    groups = sorted(sorted(stop["employee_ids"]) for stop in result["stops"])
+    assert groups == [[1, 2, 3], [4]]
+    assert [stop["employee_ids"] for stop in result["stops"] if stop.get("is_individual_stop")] == [[4]]
+    assert result["unclustered"] == []
+    assert result["walking_fallback"] is False
+
+
+def test_foot_server_down_falls_back_to_straight_line():
+    result = _cluster(FakeFootOSRM(available=False))
+
+    assert [sorted(stop["employee_ids"]) for stop in result["stops"]] == [[1, 2, 3, 4]]
+    assert result["walking_fallback"] is True